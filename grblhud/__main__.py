@@ -51,6 +51,17 @@ def create_parser():
     # defaults
     cfg = {
         "serial_default" : "/dev/ttyUSB0",
+        "baud_default" : 115200,
+        "high_water_default" : 10000,
+        "low_water_default" : 2000,
+        "poll_fast_default" : .1,
+        "poll_slow_default" : 1.0,
+        "compact_default" : 0,
+        "simplify_default" : 0,
+        "raster_default" : 0,
+        "arcs_default" : 0,
+        "cache_size_default" : 1024,
+        "rx_buffer_size_default" : 0,
     }
 
     if os.path.exists(config_file):
@@ -63,7 +74,37 @@ def create_parser():
                                                   "  Type 'grblhud<enter>' to start the interactive 'hud'."
                                       , formatter_class=argparse.RawTextHelpFormatter )
 
-    parser.add_argument('--serial', default=cfg["serial_default"], metavar="<default:" + str(cfg["serial_default"])+">", help='serial device of your machine (115200 baud)')
+    parser.add_argument('--serial', default=cfg["serial_default"], metavar="<default:" + str(cfg["serial_default"])+">", 
+                        help='serial device of your machine, or its network address: tcp://<host>:<port> (grblHAL, ESP32),\n'
+                             'telnet://<host>[:<port>] or unix://<path> (a unix socket, grblsim --listen)')
+    parser.add_argument('--baud', type=int, default=cfg["baud_default"], metavar="<default:" + str(cfg["baud_default"])+">",
+                        help='serial device: baud rate (bits/s)')
+    parser.add_argument('--high_water', type=int, default=cfg["high_water_default"], metavar="<default:" + str(cfg["high_water_default"])+">",
+                        help='stream: max number of lines pending in the buffer, reading the file blocks from there')
+    parser.add_argument('--low_water', type=int, default=cfg["low_water_default"], metavar="<default:" + str(cfg["low_water_default"])+">",
+                        help='stream: resume reading the file when the number of pending lines drops to this number')
+    parser.add_argument('--poll_fast', type=float, default=cfg["poll_fast_default"], metavar="<default:" + str(cfg["poll_fast_default"])+">",
+                        help='status report interval (seconds) while the machine is busy (Run, Jog, Hold, Home, Door) or code is pending')
+    parser.add_argument('--poll_slow', type=float, default=cfg["poll_slow_default"], metavar="<default:" + str(cfg["poll_slow_default"])+">",
+                        help='max status report interval (seconds) when the machine is not busy (Idle, Sleep, Alarm)')
+    parser.add_argument('--compact', type=float, default=cfg["compact_default"], metavar="<default:" + str(cfg["compact_default"])+">",
+                        help='load, run and stream: compact gcode (strip comments, drop redundant words) and round coordinates\n'
+                             'to this resolution (mm), 0 is off')
+    parser.add_argument('--simplify', type=float, default=cfg["simplify_default"], metavar="<default:" + str(cfg["simplify_default"])+">",
+                        help='load and stream: merge (nearly) collinear G1 moves that deviate less than this tolerance (mm)\n'
+                             'from the simplified path, 0 is off')
+    parser.add_argument('--raster', type=int, choices=(0, 1), default=cfg["raster_default"], metavar="<default:" + str(cfg["raster_default"])+">",
+                        help='load and stream: merge laser raster moves (pixels) of the same power, laser off (S0) runs become\n'
+                             'rapid (G0) moves, 1 is on')
+    parser.add_argument('--arcs', type=float, default=cfg["arcs_default"], metavar="<default:" + str(cfg["arcs_default"])+">",
+                        help='load and stream: replace runs of short G1 moves by G2/G3 arcs that deviate less than this (mm)\n'
+                             'from the moves (including the arc tolerance $12 of the machine), 0 is off')
+    parser.add_argument('--cache_size', type=float, default=cfg["cache_size_default"], metavar="<default:" + str(cfg["cache_size_default"])+">",
+                        help='load: max size (MB) of the cache of loaded programs (~/.cache/grblhud), so unchanged files\n'
+                             'load instantly, 0 is off')
+    parser.add_argument('--rx_buffer_size', type=int, default=cfg["rx_buffer_size_default"], metavar="<default:" + str(cfg["rx_buffer_size_default"])+">",
+                        help='RX (serial receive) buffer size (bytes) of the device, the streamer fills it, 0: ask the device\n'
+                             '(\'$I\' build options or an \'Idle\' status report), 128 (grbl on an ATmega328p) when it does not tell')
     parser.add_argument('gcode', type=argparse.FileType('r'),nargs='*', help='gcode file(s) to stream to your machine')
     parser.add_argument('-V', '--version', action='version', version='%(prog)s ' + __version__, help="show version number and exit")
 
@@ -91,7 +132,24 @@ def main():
     atexit.register(readline.write_history_file, histfile)
 
     # get commandline arguments
-    args = create_parser().parse_args()
+    parser = create_parser()
+    args = parser.parse_args()
+    if not 0 <= args.low_water < args.high_water:
+        parser.error("low_water must be less than high_water (and not negative)")
+    if not 0 < args.poll_fast <= args.poll_slow:
+        parser.error("poll_fast must be greater than 0 and not greater than poll_slow")
+    if args.compact < 0:
+        parser.error("compact resolution must not be negative (0 is off)")
+    if args.simplify < 0:
+        parser.error("simplify tolerance must not be negative (0 is off)")
+    if args.arcs < 0:
+        parser.error("arcs deviation must not be negative (0 is off)")
+    if args.cache_size < 0:
+        parser.error("cache size must not be negative (0 is off)")
+    if args.baud <= 0:
+        parser.error("baud must be greater than 0")
+    if args.rx_buffer_size != 0 and args.rx_buffer_size < 16:
+        parser.error("rx_buffer_size must be at least 16 (0 is ask the device)")
 
     grblhudloop(args)
 
@@ -0,0 +1,179 @@
+"""
+gcodecache: on-disk cache of loaded (processed) gcode programs, keyed by content hash
+"""
+
+import os
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+from time import perf_counter
+from grblhud import __version__
+from grblhud.gcodefile import Gcodefile
+
+# default cache location
+CACHE_DIRECTORY = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "grblhud")
+
+class Gcodecache:
+    """
+    Gcodecache: content addressed cache of loaded gcode programs
+
+    An entry holds what 'load' computes for a file: the line index, the loop table, bounding box and
+    statistics (meta.json) and the processed (filtered) program, when the load settings changed the file.
+    Entries are keyed by a hash of the file contents, the load settings and the grblhud version, so a
+    changed file (or another grblhud version) never hits an old entry.
+    To not hash (large) files on every load, content hashes are remembered per file path, size, mtime and inode.
+    The cache is kept below 'size' bytes by removing the least recently used entries.
+    """
+
+    # entry format (part of the key, so entries of another format, or with other extents, are not used)
+    FORMAT = 3
+    # hash read size
+    CHUNK = 1 << 20
+    # number of remembered file hashes
+    MAX_FILES = 1000
+
+    def __init__(self, size, directory = CACHE_DIRECTORY):
+        """
+        size: max cache size (bytes)
+        directory: cache location
+        """
+        self.size = size
+        self.directory = directory
+        self.files_path = os.path.join(directory, "files.json")
+        os.makedirs(directory, exist_ok = True)
+        try:
+            with open(self.files_path) as f:
+                self.files = json.load(f)
+        except (OSError, ValueError):
+            self.files = {}
+
+    def file_hash(self, path) -> str:
+        """
+        content hash of file 'path' (remembered while the file is not changed)
+        """
+        path = os.path.realpath(path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ino]
+        known = self.files.get(path)
+        if known and known[:3] == stamp:
+            return known[3]
+
+        digest = hashlib.blake2b(digest_size = 20)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(Gcodecache.CHUNK), b''):
+                digest.update(block)
+        self.files.pop(path, None)
+        self.files[path] = stamp + [digest.hexdigest()]
+        # forget the oldest files
+        for old in list(self.files)[:-Gcodecache.MAX_FILES]:
+            del self.files[old]
+        self.write_json(self.files_path, self.files)
+        return digest.hexdigest()
+
+    def key(self, path, settings = '') -> str:
+        """
+        cache key of file 'path' loaded with 'settings' (str)
+        """
+        return hashlib.blake2b(f"{self.file_hash(path)} {settings} {__version__} {Gcodecache.FORMAT} {Gcodefile.STRIDE}".encode(),
+                               digest_size = 20).hexdigest()
+
+    def get(self, key, path):
+        """
+        load cached program 'key' (of file 'path')
+        returns: (Gcodefile, info), or None when it is not cached
+        """
+        entry = os.path.join(self.directory, key)
+        try:
+            with open(os.path.join(entry, "meta.json")) as f:
+                info = json.load(f)
+            index = (Gcodefile.read_index(os.path.join(entry, "index")), info["count"])
+            program = Gcodefile.open(os.path.join(entry, "program.gc") if info["processed"] else path, index)
+            # recently used
+            os.utime(os.path.join(entry, "meta.json"))
+        except (OSError, ValueError, KeyError):
+            return None
+        return program, info
+
+    def put(self, key, program, info, processed = False):
+        """
+        cache 'program' (Gcodefile) and its load 'info' (json data) under 'key'
+        processed: program differs from the file, so it is cached as well
+        """
+        entry = os.path.join(self.directory, key)
+        if os.path.isdir(entry):
+            return
+        # build the entry aside, then move it in place (other grblhud instances may use the cache as well)
+        build = tempfile.mkdtemp(dir = self.directory, prefix = ".build-")
+        try:
+            program.write_index(os.path.join(build, "index"))
+            if processed:
+                with open(os.path.join(build, "program.gc"), "wb") as f:
+                    program.file.seek(0)
+                    shutil.copyfileobj(program.file, f, Gcodecache.CHUNK)
+            info = dict(info, count = len(program), processed = processed, version = __version__)
+            self.write_json(os.path.join(build, "meta.json"), info)
+            os.rename(build, entry)
+        except OSError:
+            shutil.rmtree(build, ignore_errors = True)
+            return
+        self.trim()
+
+    def trim(self):
+        """
+        remove the least recently used entries until the cache fits its size
+        """
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            try:
+                used = os.stat(os.path.join(entry.path, "meta.json")).st_mtime
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+            except OSError:
+                # incomplete (or being built)
+                continue
+            entries.append((used, size, entry.path))
+            total += size
+        for used, size, path in sorted(entries):
+            if total <= self.size:
+                break
+            shutil.rmtree(path, ignore_errors = True)
+            total -= size
+
+    @staticmethod
+    def write_json(path, data):
+        """
+        write json file (atomic)
+        """
+        temp = path + f".{os.getpid()}"
+        with open(temp, "w") as f:
+            json.dump(data, f)
+        os.replace(temp, path)
+
+def main():
+    """
+    cache a gcode file (unprocessed), show load timing
+    """
+    if len(sys.argv) != 2:
+        print("usage: python -m grblhud.gcodecache <gcode file>")
+        return
+    cache = Gcodecache(1 << 30)
+    for attempt in ("first", "second"):
+        start = perf_counter()
+        key = cache.key(sys.argv[1])
+        cached = cache.get(key, sys.argv[1])
+        if cached:
+            program, info = cached
+        else:
+            program = Gcodefile.open(sys.argv[1])
+            program.find_all("Boundingbox:", "; WHILE", "; DO")
+            cache.put(key, program, {})
+        elapsed = perf_counter() - start
+        print(f"{attempt} load ({'cached' if cached else 'indexed'}): {len(program)} lines in {elapsed:.3f} seconds")
+        program.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,440 @@
+"""
+gcodeestimate: job time estimate, simulates the grbl planner over the moves of a loaded program
+"""
+
+import sys
+from math import cos, sin, sqrt
+from time import perf_counter
+from grblhud.gcodefile import Gcodefile, NUMPY
+from grblhud.gcodeextents import Gcodeextents, ARC_PLANES
+from grblhud.gcoderun import nested_loops
+
+if NUMPY:
+    import numpy as np
+    from grblhud.gcodefile import BLANK, comments, skip
+    from grblhud.gcodeextents import LINEAR_G, parse_numbers
+
+    # words read by the numpy scan
+    MOVE_LETTER = np.zeros(256, dtype = bool)
+    MOVE_LETTER[list(b"FGXYZfgxyz")] = True
+
+# grbl defaults, used for the settings that are not known (read by '$$')
+GRBL_DEFAULTS = { "$11" : .010, "$12" : .002, "$110" : 500.0, "$111" : 500.0, "$112" : 500.0,
+                  "$120" : 10.0, "$121" : 10.0, "$122" : 10.0 }
+
+# blocks grbl plans ahead (planner buffer size - 1)
+PLANNER_BLOCKS = 15
+# grbl MINIMUM_FEED_RATE (mm/min) and MINIMUM_JUNCTION_SPEED (mm/s)
+MINIMUM_FEED_RATE = 1.0
+MINIMUM_JUNCTION_SPEED = 0.0
+
+# serial line: 8N1 (10 bits per byte)
+BITS_PER_BYTE = 10
+
+def format_time(seconds) -> str:
+    """
+    [h:]mm:ss notation
+    """
+    seconds = round(seconds)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+class Gcodesegments(Gcodeextents):
+    """
+    Gcodesegments: collects the linear moves of a program, line by line (arcs are split in chords, as grbl does)
+
+    A segment is the end point of a move, it starts at the end point of the previous segment.
+    """
+
+    def __init__(self, arc_tolerance):
+        # the machine starts at the origin (the real start position is not known)
+        super().__init__((0.0, 0.0, 0.0))
+        self.arc_tolerance = arc_tolerance
+        # line number of the current line
+        self.number = 0
+        # segments: (line number, X, Y, Z, feed, rapid)
+        self.segments = []
+
+    def moved(self, start, offsets):
+        """
+        add the segment(s) of the move from 'start' to the current position
+        """
+        if None in self.position:
+            # position unknown (after home, probe, etc.)
+            return
+        feed = self.feed or 0.0
+        if self.motion in (2, 3) and None not in start:
+            center = self.arc_center(start, offsets)
+            if center is not None:
+                first, second, linear = ARC_PLANES[self.plane][:3]
+                begin, sweep, radius = self.arc_sweep(start, center)
+                # number of chords (grbl mc_arc)
+                chords = int(0.5 * sweep * radius / sqrt(max(self.arc_tolerance * (2 * radius - self.arc_tolerance), 1e-12)))
+                direction = -1 if self.motion == 2 else 1
+                for chord in range(1, chords):
+                    angle = begin + direction * sweep * chord / chords
+                    point = [0.0, 0.0, 0.0]
+                    point[first] = center[0] + radius * cos(angle)
+                    point[second] = center[1] + radius * sin(angle)
+                    point[linear] = start[linear] + (self.position[linear] - start[linear]) * chord / chords
+                    self.segments.append((self.number, *point, feed, False))
+        self.segments.append((self.number, *self.position, feed, self.motion in (0, None)))
+
+def program_segments(program: Gcodefile, arc_tolerance):
+    """
+    linear moves of a loaded program
+
+    Lines are scanned (with numpy) a chunk at a time while the program stays in absolute mm coordinates
+    and linear (G0, G1) moves, chunks with other G codes are tracked line by line (Gcodesegments).
+    generates: (line numbers, end points (n x 3), feeds (mm/min), rapid) numpy arrays, a chunk at a time
+    """
+    tracker = Gcodesegments(arc_tolerance)
+
+    def tracked(first, last):
+        """
+        track lines [first, last) line by line
+        """
+        for tracker.number, line in enumerate(program.lines(first, last), first):
+            tracker.update(line)
+        segments = tracker.segments
+        tracker.segments = []
+        return segment_arrays(segments)
+
+    for chunk, end in program.chunks():
+        first = program.line_number(chunk)
+        data = np.frombuffer(program.mm, dtype = np.uint8, count = end - chunk, offset = chunk)
+        positions, letters, values = scan_moves(data)
+        other = (letters == ord('g')) & ~np.isin(values, LINEAR_G)
+        if other.any() or not tracker.absolute or tracker.scale != 1 or tracker.motion not in (0, 1, None):
+            del data
+            yield tracked(first, program.line_number(end - 1) + 1)
+            continue
+
+        # line (in the chunk) of each word
+        newlines = np.flatnonzero(data == 10)
+        lines = len(newlines) + (data[-1] != 10)
+        line_of = np.searchsorted(newlines, positions)
+        del data
+
+        def modal(letter, select = None, initial = None):
+            """
+            value of a modal word for each line of the chunk (the last value given on or before the line)
+            returns: (values, given) given is True for lines that have the word
+            """
+            words = letters == letter if select is None else (letters == letter) & select
+            line_values = np.full(lines, np.nan)
+            line_values[line_of[words]] = values[words]
+            given = ~np.isnan(line_values)
+            last = np.maximum.accumulate(np.where(given, np.arange(lines), -1))
+            return np.where(last >= 0, line_values[np.maximum(last, 0)], np.nan if initial is None else initial), given
+
+        axes = []
+        moves = np.zeros(lines, dtype = bool)
+        for axis, letter in enumerate(b"xyz"):
+            axis_values, given = modal(letter, initial = tracker.position[axis])
+            axes.append(axis_values)
+            moves |= given
+        feeds, _ = modal(ord('f'), initial = tracker.feed if tracker.feed is not None else 0.0)
+        motion, _ = modal(ord('g'), (values == 0) | (values == 1), initial = -1 if tracker.motion is None else tracker.motion)
+
+        moves = np.flatnonzero(moves)
+        points = np.column_stack([axis_values[moves] for axis_values in axes])
+        # state at the end of the chunk
+        tracker.position = [float(axis_values[-1]) for axis_values in axes]
+        tracker.feed = float(feeds[-1])
+        tracker.motion = None if motion[-1] < 0 else int(motion[-1])
+        yield moves + first, points, feeds[moves], motion[moves] != 1
+
+if NUMPY:
+    def scan_moves(data):
+        """
+        F, G, X, Y and Z words of 'data' (comments skipped)
+        returns: (positions, letters, values) of the words, letters in lowercase
+        """
+        positions = np.flatnonzero(MOVE_LETTER[data])
+        inside = comments(data)
+        if inside is not None:
+            positions = positions[~inside[positions]]
+        values, valid = parse_numbers(data, skip(data, positions + 1, BLANK))
+        positions = positions[valid]
+        return positions, data[positions] | 0x20, values[valid]
+
+def segment_arrays(segments):
+    """
+    (line number, X, Y, Z, feed, rapid) tuples to (line numbers, end points, feeds, rapid) arrays
+    """
+    table = np.array(segments, dtype = np.float64).reshape(-1, 6)
+    return table[:, 0].astype(np.int64), table[:, 1:4], table[:, 4], table[:, 5] != 0
+
+def axis_limit(limits, direction):
+    """
+    limit of a move in 'direction' (unit vectors) by per axis 'limits' (max rate or acceleration)
+    """
+    with np.errstate(divide = "ignore"):
+        return np.min(limits / np.abs(direction), axis = 1)
+
+def plan(points, feeds, rapid, settings, feed_override = 100, rapid_override = 100, start = (0.0, 0.0, 0.0), entry = 0.0):
+    """
+    simulate the grbl planner: trapezoidal speed profiles with junction deviation ($11), max rates ($110-$112)
+    and accelerations ($120-$122), planned PLANNER_BLOCKS ahead (the last block ends at standstill)
+    points, feeds, rapid: block end points (no zero length moves), feeds (mm/min), rapid (G0) moves (numpy arrays)
+    settings: grbl settings { "$11" : <value>, ... }
+    start, entry: start point and entry speed (squared) of the first block
+    returns: (time, length, entry speed (squared)) of each block (seconds, mm, mm²/s²)
+    """
+    delta = np.diff(np.vstack((start, points)), axis = 0)
+    length = np.sqrt((delta ** 2).sum(axis = 1))
+    unit = delta / length[:, None]
+
+    max_rate = np.array([float(settings[f"${n}"]) for n in (110, 111, 112)])
+    acceleration_limit = np.array([float(settings[f"${n}"]) for n in (120, 121, 122)])
+    rapid_rate = axis_limit(max_rate, unit)
+    rate = np.where(rapid, rapid_rate * rapid_override / 100, np.minimum(feeds * feed_override / 100, rapid_rate))
+    # mm/s
+    rate = np.maximum(rate, MINIMUM_FEED_RATE) / 60
+    acceleration = np.maximum(axis_limit(acceleration_limit, unit), 1e-9)
+    nominal = rate ** 2
+
+    # junction speeds (squared): junction deviation, limited by the nominal speeds of both blocks
+    cos_theta = -(unit[1:] * unit[:-1]).sum(axis = 1)
+    junction_unit = unit[1:] - unit[:-1]
+    junction_norm = np.sqrt((junction_unit ** 2).sum(axis = 1))
+    junction_acceleration = axis_limit(acceleration_limit, junction_unit / np.maximum(junction_norm, 1e-12)[:, None])
+    sin_theta_d2 = np.sqrt(np.clip(0.5 * (1 - cos_theta), 0, 1))
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        junction = junction_acceleration * float(settings["$11"]) * sin_theta_d2 / (1 - sin_theta_d2)
+    junction = np.where(cos_theta > 0.999999, MINIMUM_JUNCTION_SPEED ** 2, np.where(cos_theta < -0.999999, np.inf, junction))
+    entry_max = np.concatenate(([entry], np.minimum(junction, np.minimum(nominal[:-1], nominal[1:]))))
+
+    # speed (squared) gained or lost over a block at full acceleration, prefix sums
+    gain = 2 * acceleration * length
+    total = np.concatenate(([0.0], np.cumsum(gain)))
+    blocks = len(length)
+
+    # backward pass: the entry speed of a block must allow to reach the entry speeds of the next blocks
+    # (within the planner buffer) and to stop at the end of the last block in the buffer
+    reach = entry_max + total[:-1]
+    window = reach.copy()
+    for shift in range(1, min(PLANNER_BLOCKS, blocks)):
+        np.minimum(window[:-shift], reach[shift:], out = window[:-shift])
+    stop = total[np.minimum(np.arange(blocks) + PLANNER_BLOCKS, blocks)] - total[:-1]
+    backward = np.minimum(window - total[:-1], stop)
+
+    # forward pass: the entry speed can not exceed the speed reached by accelerating from the previous blocks
+    entry = np.maximum(np.minimum.accumulate(backward - total[:-1]) + total[:-1], 0)
+    exit = np.concatenate((entry[1:], [0.0]))
+
+    # trapezoid (or triangle) speed profile times
+    v_entry = np.sqrt(entry)
+    v_exit = np.sqrt(exit)
+    accelerate = (nominal - entry) / (2 * acceleration)
+    decelerate = (nominal - exit) / (2 * acceleration)
+    cruise = length - accelerate - decelerate
+    peak = np.sqrt(np.maximum((gain + entry + exit) / 2, np.maximum(entry, exit)))
+    time = np.where(cruise >= 0,
+                    (rate - v_entry) / acceleration + (rate - v_exit) / acceleration + np.maximum(cruise, 0) / rate,
+                    (peak - v_entry) / acceleration + (peak - v_exit) / acceleration)
+    return time, length, entry
+
+class Gcodeplanner:
+    """
+    Gcodeplanner: streams segments through the planner (plan()), a chunk at a time
+
+    A block is planned when the PLANNER_BLOCKS blocks that follow it are known (or at the end of the
+    program), like grbl plans the blocks in its buffer. Zero length moves are dropped (as grbl does),
+    cutting moves without feed are counted (grbl does not run them). Times and lengths are summed
+    per line range (between 'boundaries'), so memory use does not depend on the size of the program.
+    """
+
+    def __init__(self, settings, feed_override, rapid_override, boundaries):
+        """
+        settings: grbl settings { "$11" : <value>, ... }
+        feed_override, rapid_override: grbl overrides (percent)
+        boundaries: line numbers that start a line range
+        """
+        self.settings = settings
+        self.feed_override = feed_override
+        self.rapid_override = rapid_override
+        self.boundaries = np.array(sorted(set(boundaries)), dtype = np.int64)
+        self.sums = { name : np.zeros(len(self.boundaries) + 1) for name in ("time", "cut time", "length", "cut length") }
+        self.blocks = 0
+        self.undefined = 0
+        # end point of the last segment
+        self.position = np.zeros(3)
+        # blocks not yet planned (line numbers, end points, feeds, rapid), their start point and entry speed (squared)
+        self.held = None
+        self.start = np.zeros(3)
+        self.entry = 0.0
+
+    def add(self, lines, points, feeds, rapid):
+        """
+        add segments (line numbers, end points, feeds, rapid)
+        """
+        undefined = ~rapid & (feeds <= 0)
+        if undefined.any():
+            self.undefined += int(undefined.sum())
+            defined = ~undefined
+            lines, points, feeds, rapid = lines[defined], points[defined], feeds[defined], rapid[defined]
+        if not len(lines):
+            return
+        moving = np.abs(points - np.vstack((self.position, points[:-1]))).max(axis = 1) > 1e-9
+        self.position = points[-1]
+        segments = (lines[moving], points[moving], feeds[moving], rapid[moving])
+        self.held = segments if self.held is None else tuple(np.concatenate(arrays) for arrays in zip(self.held, segments))
+        if len(self.held[0]) > PLANNER_BLOCKS:
+            self.plan()
+
+    def plan(self, final = False):
+        """
+        plan the held blocks, keep the last PLANNER_BLOCKS (their plan is not final yet)
+        """
+        lines, points, feeds, rapid = self.held
+        if not len(lines):
+            return
+        time, length, entry = plan(points, feeds, rapid, self.settings, self.feed_override, self.rapid_override,
+                                   self.start, self.entry)
+        done = len(lines) if final else len(lines) - PLANNER_BLOCKS
+        if not final:
+            self.start = points[done - 1]
+            self.entry = float(entry[done])
+        self.held = tuple(arrays[done:] for arrays in self.held)
+
+        bucket = np.searchsorted(self.boundaries, lines[:done], side = "right")
+        cutting = ~rapid[:done]
+        for name, values in (("time", time[:done]), ("cut time", time[:done] * cutting),
+                             ("length", length[:done]), ("cut length", length[:done] * cutting)):
+            self.sums[name] += np.bincount(bucket, values, minlength = len(self.sums[name]))
+        self.blocks += done
+
+    def finish(self):
+        """
+        plan the last blocks (the machine stops at the end of the program)
+        """
+        if self.held is not None:
+            self.plan(final = True)
+
+    def range_sums(self, start, stop):
+        """
+        sums of lines [start, stop) (both boundaries)
+        returns: { "time" : <s>, "cut time" : <s>, "length" : <mm>, "cut length" : <mm> }
+        """
+        first, last = np.searchsorted(self.boundaries, (start, stop), side = "right")
+        return { name : float(values[first:last].sum()) for name, values in self.sums.items() }
+
+class Gcodeestimate:
+    """
+    Gcodeestimate: job time estimate of a loaded program (and its loops)
+
+    The machine time is simulated (see plan()) from the start position 0, 0, 0, serial transfer time is
+    the time needed to send the job at 'baud' (0: not limited, a network link). The job takes at least the
+    longest of the two.
+    """
+
+    def __init__(self, program: Gcodefile, loops, settings, feed = None, feed_override = 100, rapid_override = 100):
+        """
+        program: loaded gcode (Gcodefile)
+        loops: loop info { <loopname> : { "pcstart" : <pc>, "pcend" : <pc>, "count" : <count> } }
+        settings: grbl machine settings (grbl defaults are used for missing settings)
+        feed: feed (mm/min) replacing the feed of the cutting moves (like 'run F<feed>')
+        feed_override, rapid_override: grbl overrides (percent)
+        """
+        self.program = program
+        # loops that have a body
+        self.loops = { name : loop for name, loop in loops.items() if loop["pcend"] >= loop["pcstart"] }
+        self.settings = dict(GRBL_DEFAULTS)
+        self.settings.update({ setting : settings[setting] for setting in GRBL_DEFAULTS if setting in settings })
+        self.defaults = [setting for setting in GRBL_DEFAULTS if setting not in settings]
+
+        boundaries = [0, len(program)]
+        for loop in self.loops.values():
+            boundaries += [loop["pcstart"], loop["pcend"] + 1]
+        self.planner = Gcodeplanner(self.settings, feed_override, rapid_override, boundaries)
+        for lines, points, feeds, rapid in program_segments(program, float(self.settings["$12"])):
+            if feed is not None:
+                feeds = np.where(rapid, feeds, feed)
+            self.planner.add(lines, points, feeds, rapid)
+        self.planner.finish()
+
+    def range_sums(self, pcstart, pcend):
+        """
+        time, length and size of lines [pcstart, pcend]
+        returns: { "time" : <s>, "cut time" : <s>, "length" : <mm>, "cut length" : <mm>, "bytes" : <bytes> }
+        """
+        sums = self.planner.range_sums(pcstart, pcend + 1)
+        sums["bytes"] = (self.program.offset(pcend + 1) if pcend + 1 < len(self.program) else self.program.size) - \
+                        self.program.offset(pcstart)
+        return sums
+
+    def loop_sums(self, name):
+        """
+        sums of one iteration of loop 'name', its nested loops included
+        """
+        loop = self.loops[name]
+        return self.with_loops(self.range_sums(loop["pcstart"], loop["pcend"]), loop["pcstart"], loop["pcend"], name)
+
+    def with_loops(self, sums, pcstart, pcend, outer = None):
+        """
+        add the loops run within lines [pcstart, pcend] to 'sums' (of the lines): the body of a loop runs once
+        (its nested loops included), then 'count' iterations
+        """
+        for name in nested_loops(self.program, self.loops, pcstart, pcend, outer):
+            loop = self.loops[name]
+            body = self.loop_sums(name)
+            lines = self.range_sums(loop["pcstart"], loop["pcend"])
+            for key in sums:
+                sums[key] += body[key] - lines[key] + loop["count"] * body[key]
+            # iteration comment lines
+            sums["bytes"] += loop["count"] * len(f"; {name} iterate nr: {loop['count']}\n")
+        return sums
+
+    def totals(self):
+        """
+        sums of the job (loops run)
+        """
+        if not len(self.program):
+            return { "time" : 0.0, "cut time" : 0.0, "length" : 0.0, "cut length" : 0.0, "bytes" : 0 }
+        return self.with_loops(self.range_sums(0, len(self.program) - 1), 0, len(self.program) - 1)
+
+    def report(self, baud = 115200) -> str:
+        """
+        estimate summary
+        """
+        totals = self.totals()
+        serial = totals["bytes"] * BITS_PER_BYTE / baud if baud else 0.0
+        lines = [f"    job: {format_time(max(totals['time'], serial))}"
+                 f"{' (serial transfer bound)' if serial > totals['time'] else ''}",
+                 f"    machine: {format_time(totals['time'])} (cutting {format_time(totals['cut time'])}, "
+                 f"travel {format_time(totals['time'] - totals['cut time'])})",
+                 f"    path: cutting {totals['cut length']:.0f} mm, travel {totals['length'] - totals['cut length']:.0f} mm "
+                 f"({self.planner.blocks} moves in the program)",
+                 f"    serial transfer: {format_time(serial)} ({totals['bytes']} bytes at {baud} baud)" if baud else
+                 f"    transfer: {totals['bytes']} bytes (network link)"]
+        for name, loop in self.loops.items():
+            sums = self.loop_sums(name)
+            lines.append(f"    loop {name}: {sums['time']:.1f} s per iteration (cutting {sums['cut time']:.1f} s), "
+                         f"{loop['count']} iterations: {format_time(loop['count'] * sums['time'])}")
+        if self.planner.undefined:
+            lines.append(f"    {self.planner.undefined} cutting moves without feed are not counted (grbl does not run them),"
+                         f" use 'estimate F<feed>'")
+        if self.defaults:
+            lines.append(f"    grbl defaults are used for {', '.join(self.defaults)} (use '$$' to read the machine settings)")
+        return "\n".join(lines)
+
+def main():
+    """
+    estimate the run time of a gcode file (grbl default settings), show timing
+    """
+    if len(sys.argv) != 2:
+        print("usage: python -m grblhud.gcodeestimate <gcode file>")
+        return
+    program = Gcodefile.open(sys.argv[1])
+    start = perf_counter()
+    estimate = Gcodeestimate(program, {}, {})
+    elapsed = perf_counter() - start
+    print(estimate.report())
+    print(f"estimated {len(program)} lines ({estimate.planner.blocks} blocks) in {elapsed:.3f} seconds")
+    program.close()
+
+if __name__ == '__main__':
+    main()
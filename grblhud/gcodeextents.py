@@ -0,0 +1,342 @@
+"""
+gcodeextents: extents (min/max XYZ) of all moves of a gcode program, rapids included
+"""
+
+import sys
+from math import atan2, cos, hypot, pi, sin, sqrt, tau
+from time import perf_counter
+from grblhud.gcodefilter import COMMENT_PATTERN, split_block
+from grblhud.gcodefile import Gcodefile, NUMPY
+
+if NUMPY:
+    import numpy as np
+    from grblhud.gcodefile import BLANK, comments, skip
+
+    # words read by the numpy scan
+    EXTENT_LETTER = np.zeros(256, dtype = bool)
+    EXTENT_LETTER[list(b"GXYZgxyz")] = True
+
+    # digit values, -1 for '.', -2 for other bytes
+    DIGIT = np.full(256, -2, dtype = np.int8)
+    DIGIT[list(b"0123456789")] = np.arange(10)
+    DIGIT[ord('.')] = -1
+
+    # G codes that keep coordinates absolute (in mm) and linear: a program that only uses these
+    # moves within the min/max of its X, Y and Z values
+    # (G0, G1, G4, G17, G21, G40, G49, G54-G59, G61, G80, G90, G93, G94)
+    LINEAR_G = np.array((0, 1, 4, 17, 21, 40, 49, 54, 55, 56, 57, 58, 59, 61, 80, 90, 93, 94), dtype = np.float64)
+
+    def parse_numbers(data, pos):
+        """
+        values of the numbers that start at 'pos' (numpy array) in 'data', digit by digit for all numbers at once
+        returns: (values, valid) valid is False where there is no number
+        """
+        last = len(data) - 1
+        value = np.zeros(len(pos))
+        fraction = np.zeros(len(pos), dtype = np.int32)
+        dot = np.zeros(len(pos), dtype = bool)
+        valid = np.zeros(len(pos), dtype = bool)
+        sign = data[np.minimum(pos, last)]
+        negative = sign == ord('-')
+        pos = pos + (negative | (sign == ord('+')))
+        active = np.ones(len(pos), dtype = bool)
+        while True:
+            digit = DIGIT[data[np.minimum(pos, last)]]
+            active &= (digit >= -1) & (pos <= last)
+            if not active.any():
+                break
+            number = active & (digit >= 0)
+            value = np.where(number, value * 10 + digit, value)
+            fraction += number & dot
+            valid |= number
+            dot |= active & (digit == -1)
+            pos += active
+        value /= 10.0 ** fraction
+        value[negative] *= -1
+        return value, valid
+
+    def scan_extents(data):
+        """
+        X, Y and Z values and the G codes other than G0 and G1 of 'data' (comments skipped)
+        returns: (positions, letters, values) of the words, letters in lowercase
+        """
+        positions = np.flatnonzero(EXTENT_LETTER[data])
+        inside = comments(data)
+        if inside is not None:
+            positions = positions[~inside[positions]]
+        letters = data[positions] | 0x20
+        # G0 and G1 (most G words) need not be parsed
+        last = len(data) - 1
+        code = data[np.minimum(positions + 1, last)]
+        linear = (letters == ord('g')) & ((code == ord('0')) | (code == ord('1'))) & \
+                 (DIGIT[data[np.minimum(positions + 2, last)]] == -2) & (positions + 1 <= last)
+        positions = positions[~linear]
+        letters = letters[~linear]
+        values, valid = parse_numbers(data, skip(data, positions + 1, BLANK))
+        return positions[valid], letters[valid], values[valid]
+
+# axes of the arc planes (G17, G18, G19): (first, second, linear) axis and the offset words of the first and second axis
+ARC_PLANES = { 17 : (0, 1, 2, 'I', 'J'), 18 : (2, 0, 1, 'K', 'I'), 19 : (1, 2, 0, 'J', 'K') }
+
+# G codes that make the position unknown (home, probe, machine coordinates, offsets)
+UNKNOWN_G = (10, 28, 30, 38.2, 38.3, 38.4, 38.5, 43.1, 53)
+
+def format_coordinate(value) -> str:
+    """
+    coordinate notation of the Bbox command
+    """
+    text = f"{value:.3f}".rstrip('0').rstrip('.')
+    return '0' if text == "-0" else text
+
+class Gcodeextents:
+    """
+    Gcodeextents: tracks the position of a gcode program, line by line, and the extents of its moves
+
+    Handles absolute and relative coordinates (G90/G91), inch and mm (G20/G21), arcs (G2/G3, I J K
+    offsets and R) in all planes and coordinate offsets (G92, G92.1). Extents are in mm, in the work
+    coordinates the program starts in (those set by its first G92 when the position is not known then):
+    coordinates after a G92 are offset back to them. The offsets of the coordinate systems (G54-G59) are
+    kept by the machine, so G54-G59 are not applied. The position is unknown after G28/G30 (home),
+    G38.x (probe) and G53 (machine coordinates) until each axis is set absolutely again.
+    """
+
+    def __init__(self, position = (None, None, None)):
+        """
+        position: start position (X, Y, Z), None when unknown
+        """
+        self.absolute = True
+        self.scale = 1.0
+        self.motion = None
+        self.plane = 17
+        self.feed = None
+        self.position = list(position)
+        # coordinate offset (G92): program coordinates + offset are the coordinates the extents are in,
+        # None when not known
+        self.offset = [0.0, 0.0, 0.0]
+        # the coordinates the extents are in were set by a G92 (the coordinates without offset are not known)
+        self.reference = [False, False, False]
+        self.minimum = [None, None, None]
+        self.maximum = [None, None, None]
+
+    def add(self, axis, value):
+        """
+        extend the extents of 'axis' with 'value'
+        """
+        if self.minimum[axis] is None or value < self.minimum[axis]:
+            self.minimum[axis] = value
+        if self.maximum[axis] is None or value > self.maximum[axis]:
+            self.maximum[axis] = value
+
+    def update(self, line):
+        """
+        track gcode line
+        """
+        code = COMMENT_PATTERN.sub('', line).strip()
+        if not code or not code[0].isalpha():
+            # empty, '$' (system) and realtime commands
+            return
+        words = split_block(code)
+        if not words:
+            return
+
+        non_modal = None
+        target = {}
+        offsets = {}
+        for letter, value in words:
+            if letter == 'G':
+                if value in (0, 1, 2, 3):
+                    self.motion = value
+                elif value in (90, 91):
+                    self.absolute = value == 90
+                elif value in (20, 21):
+                    self.scale = 25.4 if value == 20 else 1.0
+                elif value in ARC_PLANES:
+                    self.plane = value
+                elif value in (92, 92.1, 4) or value in UNKNOWN_G:
+                    non_modal = value
+            elif letter in "XYZ":
+                target["XYZ".index(letter)] = value * self.scale
+            elif letter in "IJKR":
+                offsets[letter] = value * self.scale
+            elif letter == 'F':
+                self.feed = value * self.scale
+
+        if non_modal == 92:
+            # coordinate offset: the current position gets the given coordinates
+            for axis, value in target.items():
+                if self.position[axis] is not None:
+                    self.offset[axis] = self.position[axis] - value
+                elif self.minimum[axis] is None:
+                    # no moves yet: the extents are in these coordinates
+                    self.position[axis] = value
+                    self.offset[axis] = 0.0
+                    self.reference[axis] = True
+                else:
+                    self.offset[axis] = None
+            return
+        if non_modal == 92.1:
+            # coordinate offset cancelled
+            self.offset = [None if reference else 0.0 for reference in self.reference]
+            return
+        if non_modal is not None and non_modal != 4:
+            # position unknown for the given axes (all axes for home)
+            for axis in (target if target and non_modal not in (28, 30) else range(3)):
+                self.position[axis] = None
+            return
+        if not target:
+            return
+
+        start = list(self.position)
+        for axis, value in target.items():
+            if self.absolute:
+                self.position[axis] = None if self.offset[axis] is None else value + self.offset[axis]
+            elif self.position[axis] is not None:
+                self.position[axis] += value
+        self.moved(start, offsets)
+
+    def moved(self, start, offsets):
+        """
+        move from 'start' to the current position (offsets: arc I, J, K and R words)
+        """
+        for axis, value in enumerate(self.position):
+            if value is not None:
+                self.add(axis, value)
+
+        if self.motion in (2, 3):
+            self.arc(start, offsets)
+
+    def arc_center(self, start, offsets):
+        """
+        center of the arc from 'start' to the current position
+        returns: (center first axis, center second axis), None when the arc is not defined
+        """
+        first, second, _, first_offset, second_offset = ARC_PLANES[self.plane]
+        end = self.position
+        if None in (start[first], start[second], end[first], end[second]):
+            return None
+        da = end[first] - start[first]
+        db = end[second] - start[second]
+        if 'R' in offsets:
+            # radius format: center on the perpendicular bisector of start and end (as grbl computes it)
+            radius = offsets['R']
+            chord = hypot(da, db)
+            if chord == 0:
+                return None
+            h = -sqrt(max(4 * radius * radius - chord * chord, 0)) / chord
+            if self.motion == 3:
+                h = -h
+            if radius < 0:
+                h = -h
+            return start[first] + 0.5 * (da - db * h), start[second] + 0.5 * (db + da * h)
+        return start[first] + offsets.get(first_offset, 0), start[second] + offsets.get(second_offset, 0)
+
+    def arc_sweep(self, start, center):
+        """
+        start angle, sweep (radians, positive) and radius of the arc from 'start' around 'center' to the current position
+        """
+        first, second = ARC_PLANES[self.plane][:2]
+        end = self.position
+        ca, cb = center
+        radius = hypot(start[first] - ca, start[second] - cb)
+        begin = atan2(start[second] - cb, start[first] - ca)
+        stop = atan2(end[second] - cb, end[first] - ca)
+        if self.motion == 2:
+            # clockwise
+            sweep = (begin - stop) % tau
+        else:
+            sweep = (stop - begin) % tau
+        if sweep == 0:
+            # full circle
+            sweep = tau
+        return begin, sweep, radius
+
+    def arc(self, start, offsets):
+        """
+        add the extreme points of the arc from 'start' to the current position (the end points are added already)
+        """
+        center = self.arc_center(start, offsets)
+        if center is None:
+            return
+        first, second = ARC_PLANES[self.plane][:2]
+        ca, cb = center
+        begin, sweep, radius = self.arc_sweep(start, center)
+        for quadrant in range(4):
+            angle = quadrant * pi / 2
+            if ((begin - angle) % tau if self.motion == 2 else (angle - begin) % tau) <= sweep:
+                self.add(first, ca + radius * cos(angle))
+                self.add(second, cb + radius * sin(angle))
+
+    def extents(self):
+        """
+        returns: ((min X, min Y, min Z), (max X, max Y, max Z)), None for axes that did not move
+        """
+        return tuple(self.minimum), tuple(self.maximum)
+
+def program_extents(program: Gcodefile):
+    """
+    extents of (all moves of) a loaded program
+
+    Lines are scanned (with numpy) a chunk at a time until a G code that is not absolute and linear is found,
+    the program is tracked line by line (Gcodeextents) from that line on. So programs that stay in
+    absolute mm coordinates are not parsed line by line.
+    returns: Gcodeextents
+    """
+    tracker = Gcodeextents()
+    if not NUMPY:
+        for line in program:
+            tracker.update(line)
+        return tracker
+
+    last_value = [None, None, None]
+    handover = None
+    for chunk, end in program.chunks():
+        data = np.frombuffer(program.mm, dtype = np.uint8, count = end - chunk, offset = chunk)
+        positions, letters, values = scan_extents(data)
+        del data
+        other = np.flatnonzero((letters == ord('g')) & ~np.isin(values, LINEAR_G))
+        if len(other):
+            # the program is tracked line by line from the line of this G code
+            handover = program.line_number(chunk + int(positions[other[0]]))
+            keep = positions < program.offset(handover) - chunk
+            letters, values = letters[keep], values[keep]
+        for axis, letter in enumerate(b"xyz"):
+            axis_values = values[letters == letter]
+            if len(axis_values):
+                tracker.add(axis, float(axis_values.min()))
+                tracker.add(axis, float(axis_values.max()))
+                last_value[axis] = float(axis_values[-1])
+        if handover is not None:
+            break
+
+    if handover is not None:
+        tracker.position = last_value
+        for line in program.lines(handover):
+            tracker.update(line)
+    return tracker
+
+def extents_text(tracker) -> str:
+    """
+    XY extents in the (annotation) format of 'Boundingbox:', '' when there are none
+    """
+    minimum, maximum = tracker.extents()
+    if None in minimum[:2] or None in maximum[:2]:
+        return ''
+    return f"(X{format_coordinate(minimum[0])},Y{format_coordinate(minimum[1])}) to " \
+           f"(X{format_coordinate(maximum[0])},Y{format_coordinate(maximum[1])})"
+
+def main():
+    """
+    show the extents of a gcode file
+    """
+    if len(sys.argv) != 2:
+        print("usage: python -m grblhud.gcodeextents <gcode file>")
+        return
+    program = Gcodefile.open(sys.argv[1])
+    start = perf_counter()
+    tracker = program_extents(program)
+    elapsed = perf_counter() - start
+    print(f"extents of {len(program)} lines in {elapsed:.3f} seconds: {tracker.extents()}")
+    program.close()
+
+if __name__ == '__main__':
+    main()
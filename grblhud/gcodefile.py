@@ -0,0 +1,423 @@
+"""
+gcodefile: memory mapped gcode program with a (sparse) line index
+"""
+
+import re
+import sys
+import mmap
+import tempfile
+from array import array
+from bisect import bisect_right
+from time import perf_counter
+
+NUMPY = True
+try:
+    import numpy as np
+except ImportError:
+    NUMPY = False
+
+# F and S words (letter, blanks, number), comments are matched (and skipped) so their text is not taken for words
+WORD_PATTERN = re.compile(rb"\([^)\n]*\)|;[^\n]*|([FSfs])[ \t]*[+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)")
+
+if NUMPY:
+    # byte class lookup tables (for the numpy word scan)
+    WORD_LETTER = np.zeros(256, dtype = bool)
+    WORD_LETTER[list(b"FSfs")] = True
+    BLANK = np.zeros(256, dtype = bool)
+    BLANK[list(b" \t")] = True
+    NUMBER = np.zeros(256, dtype = bool)
+    NUMBER[list(b"0123456789.+-")] = True
+
+    def skip(data, pos, table):
+        """
+        advance positions 'pos' (numpy array) over the bytes of 'data' that are in 'table'
+        (a byte at a time, for the positions that still advance)
+        """
+        pos = pos.copy()
+        last = len(data) - 1
+        moving = np.flatnonzero(pos <= last)
+        moving = moving[table[data[pos[moving]]]]
+        while len(moving):
+            pos[moving] += 1
+            ahead = pos[moving]
+            moving = moving[ahead <= last]
+            moving = moving[table[data[pos[moving]]]]
+        return pos
+
+    def comments(data):
+        """
+        comment bytes of 'data': ';' up to the line end, '(' up to ')' (or the line end)
+        returns: bool numpy array (True within comments), None when there are no comments
+        """
+        newlines = np.flatnonzero(data == 10)
+        line_end = lambda pos: np.append(newlines, len(data))[np.searchsorted(newlines, pos)]
+        semicolons = np.flatnonzero(data == 59)
+        opened = np.flatnonzero(data == 40)
+        closed = np.flatnonzero(data == 41)
+        closing = np.append(closed, len(data))[np.searchsorted(closed, opened)]
+        starts = np.concatenate((semicolons, opened))
+        if not len(starts):
+            return None
+        lengths = np.concatenate((line_end(semicolons), np.minimum(closing + 1, line_end(opened)))) - starts
+        # offsets of all comment bytes (the ranges [start, start + length) concatenated)
+        first = np.cumsum(lengths) - lengths
+        inside = np.zeros(len(data), dtype = bool)
+        inside[np.repeat(starts - first, lengths) + np.arange(lengths.sum())] = True
+        return inside
+
+class Gcodefile:
+    """
+    Gcodefile: gcode program (file) loaded via a memory map
+
+    Lines are only materialised (decoded to str) when they are used (run, listed, etc.).
+    The line index holds the start offset of every STRIDE-th line, other lines are found
+    from there (this keeps the index small: 8 bytes per STRIDE lines).
+    Supports len(), [<line number>], iteration and lines(<start>, <stop>).
+    """
+
+    # every STRIDE-th line start is indexed
+    STRIDE = 64
+    # bytes scanned at a time while indexing
+    CHUNK = 1 << 24
+
+    def __init__(self, file, index = None):
+        """
+        file: (binary) file object, it is closed by close()
+        index: (index, number of lines) of the file when it is known (see read_index()), the file is indexed otherwise
+        """
+        self.file = file
+        self.file.seek(0, 2)
+        self.size = self.file.tell()
+        # note that an empty file cannot be mapped
+        self.mm = mmap.mmap(self.file.fileno(), 0, access = mmap.ACCESS_READ) if self.size else b''
+        self.index, self.count = index if index else self.build_index()
+        # F and S word offsets (starts, ends), scanned on first use
+        self.fs_words = None
+        # programs with F and/or S values replaced: { (feed, speed) : Gcodefile }
+        self.variants = {}
+
+    @classmethod
+    def open(cls, path, index = None):
+        """
+        memory map gcode file 'path'
+        """
+        return cls(open(path, "rb"), index)
+
+    @classmethod
+    def from_lines(cls, lines):
+        """
+        write (processed) lines to an unnamed temporary file and memory map that
+        """
+        file = tempfile.TemporaryFile()
+        write = file.write
+        for line in lines:
+            write(line.encode())
+        file.flush()
+        return cls(file)
+
+    def build_index(self):
+        """
+        index the start offset of every STRIDE-th line
+        returns: (index, number of lines)
+        """
+        if NUMPY and self.size:
+            return self.build_index_numpy()
+
+        index = array('q')
+        count = 0
+        find = self.mm.find
+        start = 0
+        released = 0
+        while start < self.size:
+            if count % self.STRIDE == 0:
+                index.append(start)
+                if start - released >= self.CHUNK:
+                    self.release(released, start - released)
+                    released = start - start % mmap.PAGESIZE
+            count += 1
+            end = find(b'\n', start)
+            if end < 0:
+                break
+            start = end + 1
+        if self.size:
+            self.release(released, self.size - released)
+        return index, count
+
+    def build_index_numpy(self):
+        """
+        build_index, numpy version: newlines are located a chunk at a time
+        """
+        data = np.frombuffer(self.mm, dtype = np.uint8)
+        parts = [np.zeros(1, dtype = np.int64)]
+        # number of lines started before the current chunk
+        count = 1
+        for offset in range(0, self.size, self.CHUNK):
+            starts = np.flatnonzero(data[offset:offset + self.CHUNK] == 10) + (offset + 1)
+            # line numbers of these starts are count .. count + len(starts) - 1
+            first = (-count) % self.STRIDE
+            # (copy, so the newline offsets of the chunk are freed)
+            parts.append(starts[first::self.STRIDE].copy())
+            count += len(starts)
+            self.release(offset, self.CHUNK)
+        del data
+        index = np.concatenate(parts)
+        if self.mm[self.size - 1] == 10:
+            # no line after the last newline
+            count -= 1
+            if index[-1] == self.size:
+                index = index[:-1]
+        return index, count
+
+    def write_index(self, path):
+        """
+        save the line index (raw 64 bit offsets)
+        """
+        with open(path, "wb") as f:
+            self.index.tofile(f)
+
+    @staticmethod
+    def read_index(path):
+        """
+        read a line index saved by write_index()
+        """
+        if NUMPY:
+            return np.fromfile(path, dtype = np.int64)
+        index = array('q')
+        with open(path, "rb") as f:
+            index.frombytes(f.read())
+        return index
+
+    def release(self, start, length):
+        """
+        drop mapped pages [start, start + length) of the process (after a scan), to keep resident memory small
+        Note that the pages stay in the page cache, so they are cheap to get back.
+        """
+        if hasattr(mmap, "MADV_DONTNEED"):
+            start -= start % mmap.PAGESIZE
+            self.mm.madvise(mmap.MADV_DONTNEED, start, min(length, self.size - start))
+
+    def chunks(self):
+        """
+        split the file in chunks of about CHUNK bytes that end at a line end (so lines and comments are not cut)
+        returns: generator of (start, end) offsets, the pages of a chunk are released when the next chunk is taken
+        """
+        chunk = 0
+        while chunk < self.size:
+            end = self.mm.find(b'\n', chunk + self.CHUNK) + 1 or self.size
+            yield chunk, end
+            self.release(chunk, end - chunk)
+            chunk = end
+
+    def words(self):
+        """
+        byte offsets of the F and S words (tokenized once, when first needed)
+        returns: (starts, ends) word start offsets (of the letter) and end offsets (past the number)
+        """
+        if self.fs_words is None:
+            starts = []
+            ends = []
+            for chunk, end in self.chunks():
+                if NUMPY:
+                    chunk_starts, _, chunk_ends = self.scan_words_numpy(chunk, end)
+                else:
+                    chunk_starts, chunk_ends = self.scan_words(chunk, end)
+                starts.append(chunk_starts)
+                ends.append(chunk_ends)
+            if NUMPY:
+                empty = np.zeros(0, dtype = np.int64)
+                self.fs_words = (np.concatenate(starts or [empty]), np.concatenate(ends or [empty]))
+            else:
+                self.fs_words = (array('q', (offset for part in starts for offset in part)),
+                                 array('q', (offset for part in ends for offset in part)))
+        return self.fs_words
+
+    def scan_words(self, start, end):
+        """
+        F and S words of bytes [start, end)
+        returns: (starts, ends)
+        """
+        starts = array('q')
+        ends = array('q')
+        for word in WORD_PATTERN.finditer(self.mm, start, end):
+            if word.lastindex:
+                starts.append(word.start())
+                ends.append(word.end())
+        return starts, ends
+
+    def scan_words_numpy(self, start, end, table = None):
+        """
+        scan_words, numpy version: letters followed by a number that are not within a comment
+        table: letters to scan for (bool lookup table, default F and S)
+        returns: (starts, numbers, ends) offsets of the letters, their numbers and the ends of the numbers
+        """
+        data = np.frombuffer(self.mm, dtype = np.uint8, count = end - start, offset = start)
+        letters = np.flatnonzero((WORD_LETTER if table is None else table)[data])
+        numbers = skip(data, letters + 1, BLANK)
+        numbers_end = skip(data, numbers, NUMBER)
+        words = numbers_end > numbers
+
+        # drop letters within comments
+        inside = comments(data)
+        if inside is not None:
+            words &= ~inside[letters]
+        del data
+        return letters[words] + start, numbers[words] + start, numbers_end[words] + start
+
+    def variant(self, feed = None, speed = None):
+        """
+        program with its F and/or S values replaced by 'feed' and 'speed' ('F<nr>', 'S<nr>'), cached per (feed, speed)
+        Line numbers are unchanged, so loops (pc's) apply to variants as well.
+        """
+        if not feed and not speed:
+            return self
+        key = (feed, speed)
+        if key not in self.variants:
+            self.variants[key] = self.splice(feed, speed)
+        return self.variants[key]
+
+    def splice(self, feed, speed):
+        """
+        write the program with the replaced F and/or S words to an unnamed temporary file and memory map that
+        """
+        replace = {}
+        if feed:
+            replace[ord('F')] = replace[ord('f')] = feed.encode()
+        if speed:
+            replace[ord('S')] = replace[ord('s')] = speed.encode()
+
+        starts, ends = self.words()
+        if NUMPY:
+            # only words of the replaced letters
+            data = np.frombuffer(self.mm, dtype = np.uint8) if self.size else np.zeros(0, dtype = np.uint8)
+            selected = np.isin(data[starts], list(replace))
+            del data
+            starts = starts[selected].tolist()
+            ends = ends[selected].tolist()
+
+        file = tempfile.TemporaryFile()
+        mm = self.mm
+        pieces = []
+        begin = 0
+        released = 0
+        for start, end in zip(starts, ends):
+            text = replace.get(mm[start])
+            if text is None:
+                continue
+            pieces.append(mm[begin:start])
+            pieces.append(text)
+            begin = end
+            if len(pieces) >= 65536:
+                file.write(b''.join(pieces))
+                pieces.clear()
+                self.release(released, begin - released)
+                released = begin - begin % mmap.PAGESIZE
+        pieces.append(mm[begin:self.size])
+        file.write(b''.join(pieces))
+        file.flush()
+        self.release(released, self.size - released)
+        return Gcodefile(file)
+
+    def close(self):
+        for variant in self.variants.values():
+            variant.close()
+        self.variants = {}
+        if self.size:
+            self.mm.close()
+        self.file.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def offset(self, number) -> int:
+        """
+        start offset of line 'number'
+        """
+        start = int(self.index[number // self.STRIDE])
+        find = self.mm.find
+        for _ in range(number % self.STRIDE):
+            start = find(b'\n', start) + 1
+        return start
+
+    def __getitem__(self, number) -> str:
+        if number < 0:
+            number += self.count
+        if not 0 <= number < self.count:
+            raise IndexError("gcode line number out of range")
+        return next(self.lines(number, number + 1))
+
+    def __iter__(self):
+        return self.lines()
+
+    def lines(self, start = 0, stop = None):
+        """
+        lines [start, stop) (generator)
+        """
+        if stop is None or stop > self.count:
+            stop = self.count
+        if start >= stop:
+            return
+        mm = self.mm
+        find = mm.find
+        begin = self.offset(start)
+        for _ in range(start, stop):
+            end = find(b'\n', begin)
+            if end < 0:
+                end = self.size - 1
+            yield mm[begin:end + 1].decode(errors = "replace")
+            begin = end + 1
+
+    def line_number(self, offset) -> int:
+        """
+        number of the line that contains byte 'offset'
+        """
+        if not self.size:
+            return 0
+        slot = bisect_right(self.index, offset) - 1
+        return slot * self.STRIDE + self.mm[int(self.index[slot]):offset].count(b'\n')
+
+    def find_all(self, *patterns):
+        """
+        find lines that contain any of 'patterns' (str), in file order
+        returns: list of (line number, line)
+        """
+        found = {}
+        patterns = [pattern.encode() for pattern in patterns]
+        find = self.mm.find if self.size else None
+        # scan a chunk at a time (chunks overlap by the pattern length)
+        for chunk in range(0, self.size, self.CHUNK):
+            for pattern in patterns:
+                end = min(chunk + self.CHUNK + len(pattern) - 1, self.size)
+                offset = find(pattern, chunk, end)
+                while offset >= 0:
+                    number = self.line_number(offset)
+                    if number not in found:
+                        found[number] = self[number]
+                    offset = find(pattern, offset + 1, end)
+            self.release(chunk, self.CHUNK)
+        return sorted(found.items())
+
+def main():
+    """
+    load (index) a gcode file, show timing and index size
+    """
+    if len(sys.argv) != 2:
+        print("usage: python -m grblhud.gcodefile <gcode file>")
+        return
+    start = perf_counter()
+    gcode = Gcodefile.open(sys.argv[1])
+    elapsed = perf_counter() - start
+    print(f"indexed {len(gcode)} lines ({gcode.size} bytes) in {elapsed:.3f} seconds, "
+          f"index: {len(gcode.index)} entries ({'numpy' if NUMPY else 'array'})")
+    print(f"annotations: {gcode.find_all('; WHILE', '; DO', 'Boundingbox:')[:10]}")
+    start = perf_counter()
+    starts, ends = gcode.words()
+    elapsed = perf_counter() - start
+    print(f"tokenized {len(starts)} F and S words in {elapsed:.3f} seconds")
+    start = perf_counter()
+    variant = gcode.variant("F1000", "S500")
+    elapsed = perf_counter() - start
+    print(f"F1000 S500 variant: {variant.size} bytes in {elapsed:.3f} seconds")
+    gcode.close()
+
+if __name__ == '__main__':
+    main()
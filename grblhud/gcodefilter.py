@@ -0,0 +1,826 @@
+"""
+gcodefilter: gcode (pre)processing stages, applied on 'load', 'run' and 'stream'
+"""
+
+import re
+import random
+from math import atan2, ceil, cos, hypot, log10, pi, sin, sqrt
+from time import perf_counter
+
+# grblhud annotations, these must reach the loader unchanged
+ANNOTATIONS = ("; WHILE", "; DO", "Boundingbox:")
+
+# comments: '(...)' and ';...'
+COMMENT_PATTERN = re.compile(r"\([^)]*\)|;.*")
+
+# gcode word: letter and number
+WORD_PATTERN = re.compile(r"([A-Za-z])[ \t]*([+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))[ \t]*")
+
+# G codes handled by the stages, other G codes (G4, G10, G28, G38.x, G53, G54, G92, etc.)
+# make the machine position and/or motion mode unknown
+MOTION = (0, 1, 2, 3)
+PLANE = (17, 18, 19)
+UNITS = (20, 21)
+DISTANCE = (90, 91)
+FEEDMODE = (93, 94)
+KNOWN_G = MOTION + PLANE + UNITS + DISTANCE + FEEDMODE
+
+AXES = ('X', 'Y', 'Z')
+ARC_OFFSETS = ('I', 'J', 'K', 'R')
+# arc plane: its axes and center offsets
+ARC_PLANE_WORDS = { 17 : (('X', 'Y'), ('I', 'J')), 18 : (('Z', 'X'), ('K', 'I')), 19 : (('Y', 'Z'), ('J', 'K')) }
+# grbl arc check (error:33): start and end point radius may differ this much (mm), and 0.1% of the radius
+ARC_RADIUS_ERROR = .005
+
+# serial line: 8N1 (10 bits per byte)
+BITS_PER_BYTE = 10
+
+def format_number(value: float, decimals: int) -> str:
+    """
+    shortest number notation grbl reads: no trailing zeros, no leading zero ('.5', '-.5')
+    """
+    text = f"{value:.{decimals}f}"
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    if text.startswith("0."):
+        text = text[1:]
+    elif text.startswith("-0."):
+        text = '-' + text[2:]
+    if text in ('-0', ''):
+        text = '0'
+    return text
+
+def arc_radius_error(start, end, center) -> bool:
+    """
+    grbl arc check (error:33): the end point of an arc (offset format) is not on its circle, start, end and
+    center: points in the arc plane (mm)
+    """
+    radius = hypot(start[0] - center[0], start[1] - center[1])
+    delta = abs(hypot(end[0] - center[0], end[1] - center[1]) - radius)
+    return delta > .5 or (delta > ARC_RADIUS_ERROR and delta > .001 * radius)
+
+def split_block(code: str):
+    """
+    split gcode block (without comments) in words
+    returns: list of (letter, value) tuples, or None when the block is not just a sequence of words
+    """
+    words = []
+    pos = 0
+    for word in WORD_PATTERN.finditer(code):
+        if word.start() != pos:
+            return None
+        words.append((word.group(1).upper(), float(word.group(2))))
+        pos = word.end()
+    if pos != len(code):
+        return None
+    return words
+
+class Gcodefilter:
+    """
+    Gcodefilter: gcode (pre)processing stage, base class
+
+    A stage processes a stream of gcode lines (a generator, so memory is bounded)
+    and keeps statistics of lines and bytes (as sent to the device) in and out.
+    Lines are (tag, line) tuples: the tag (source line of the line, None when not known) is passed along
+    with each line, a line that replaces (merged) lines takes the tag of the last line it replaces.
+    """
+    name = "filter"
+
+    def __init__(self):
+        self.lines_in = 0
+        self.lines_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def count_in(self, lines):
+        """
+        count lines and bytes going in
+        """
+        for tag, line in lines:
+            self.lines_in += 1
+            self.bytes_in += len(line.strip()) + 1
+            yield tag, line
+
+    def filter(self, lines):
+        """
+        filter lines ((tag, line) tuples, generator)
+        """
+        for tag, line in self.process(self.count_in(lines)):
+            self.lines_out += 1
+            self.bytes_out += len(line.strip()) + 1
+            yield tag, line
+
+    def process(self, lines):
+        """
+        process lines ((tag, line) tuples, generator): override this
+        """
+        yield from lines
+
+    def summary(self, baud = 115200) -> str:
+        """
+        statistics: line and byte reduction, estimated (serial link) time saved
+        """
+        saved = self.bytes_in - self.bytes_out
+        percent = (100 * saved / self.bytes_in) if self.bytes_in else 0
+        return (f"{self.name}: {self.lines_in} -> {self.lines_out} lines, {self.bytes_in} -> {self.bytes_out} bytes "
+                f"({percent:.1f}% less), estimated {saved * BITS_PER_BYTE / baud:.1f} seconds saved at {baud} baud")
+
+class Gcodecompact(Gcodefilter):
+    """
+    Gcodecompact: shrink gcode blocks (bytes on the wire)
+
+    Strips comments and whitespace, drops redundant modal words (motion mode, F, S and
+    unchanged coordinates) and rounds coordinates to 'resolution' (mm).
+    Arc offsets are not rounded: the center is moved to the perpendicular bisector of the rounded
+    start and end point (the radius, R, to at least half their distance), so grbl accepts the arc.
+    Lines with annotations are passed unchanged, modal state is reset on them, so
+    (WHILE DO) loops can start with any state.
+    """
+    name = "compact"
+
+    def __init__(self, resolution = .01):
+        super().__init__()
+        self.resolution = resolution
+        self.reset()
+
+    def reset(self):
+        """
+        modal state unknown
+        """
+        self.motion = None
+        self.plane = None
+        self.units = None
+        self.distance = None
+        self.feedmode = None
+        self.feed = None
+        self.speed = None
+        self.position = dict.fromkeys(AXES)
+        # position before rounding
+        self.exact = dict.fromkeys(AXES)
+
+    def process(self, lines):
+        for tag, line in lines:
+            block = self.compact(line)
+            if block:
+                yield tag, block + '\n'
+
+    def compact(self, line) -> str:
+        """
+        compact line
+        returns: compacted block (without newline), empty when the line has no effect
+        """
+        if any(annotation in line for annotation in ANNOTATIONS):
+            # loop boundaries, etc.
+            self.reset()
+            return line.strip()
+
+        code = COMMENT_PATTERN.sub('', line).strip()
+        if not code or not code[0].isalpha():
+            # '$' (system) commands ('$H', '$J=', etc.), realtime commands, etc.
+            if code:
+                self.reset()
+            return code
+
+        words = split_block(code)
+        if words is None:
+            # not a sequence of words, leave it to grbl
+            self.reset()
+            return code
+
+        return self.compact_words(words)
+
+    def compact_words(self, words) -> str:
+        """
+        compact block (list of words)
+        """
+        gcodes = [value for letter, value in words if letter == 'G']
+        known = all(value in KNOWN_G for value in gcodes)
+
+        # modal state of this block
+        units = next((value for value in gcodes if value in UNITS), self.units)
+        if units != self.units:
+            # position unknown in new units
+            self.position = dict.fromkeys(AXES)
+            self.exact = dict.fromkeys(AXES)
+        distance = next((value for value in gcodes if value in DISTANCE), self.distance)
+        resolution = self.resolution / 25.4 if units == 20 else self.resolution
+        decimals = max(0, ceil(-log10(resolution) - 1e-9))
+        start = dict(self.position)
+        start_exact = dict(self.exact)
+
+        block = []
+        # arc offset words: (index in block, letter, value), set when the end point is known
+        offsets = []
+        motion = self.motion
+        for letter, value in words:
+            if letter == 'G':
+                if not known:
+                    block.append('G' + format_number(value, 3))
+                elif value in MOTION:
+                    motion = value
+                    if value != self.motion:
+                        block.append('G' + format_number(value, 0))
+                elif ((value in PLANE and value != self.plane) or (value in UNITS and value != self.units) or
+                      (value in DISTANCE and value != self.distance) or (value in FEEDMODE and value != self.feedmode)):
+                    block.append('G' + format_number(value, 0))
+                if value in PLANE:
+                    self.plane = value
+                elif value in UNITS:
+                    self.units = value
+                elif value in DISTANCE:
+                    self.distance = value
+                elif value in FEEDMODE:
+                    self.feedmode = value
+            elif letter in AXES:
+                exact = value
+                value = round(value / resolution) * resolution
+                text = format_number(value, decimals)
+                value = float(text)
+                position = self.position[letter]
+                if known and motion in (0, 1):
+                    # unchanged coordinates are redundant (zero length moves are discarded by grbl)
+                    if distance == 90 and position == value:
+                        self.exact[letter] = exact
+                        continue
+                    if distance == 91 and value == 0:
+                        if self.exact[letter] is not None:
+                            self.exact[letter] += exact
+                        continue
+                if distance == 90:
+                    self.position[letter] = value
+                    self.exact[letter] = exact
+                elif distance == 91 and position is not None:
+                    self.position[letter] = position + value
+                    self.exact[letter] = self.exact[letter] + exact
+                else:
+                    self.position[letter] = None
+                    self.exact[letter] = None
+                block.append(letter + text)
+            elif letter in ARC_OFFSETS:
+                offsets.append((len(block), letter, value))
+                block.append('')
+            elif letter == 'F':
+                # note that inverse time mode (G93) needs F on each block
+                if known and value == self.feed and self.feedmode != 93:
+                    continue
+                self.feed = value
+                block.append('F' + format_number(value, 4))
+            elif letter == 'S':
+                if known and value == self.speed:
+                    continue
+                self.speed = value
+                block.append('S' + format_number(value, 4))
+            else:
+                block.append(letter + format_number(value, 4))
+
+        if offsets:
+            plane = next((value for value in gcodes if value in PLANE), self.plane) or 17
+            arc = self.arc_offsets(offsets, plane, start, start_exact) if known and motion in (2, 3) else {}
+            for index, letter, value in offsets:
+                block[index] = letter + format_number(arc.get(letter, value), decimals + 2)
+
+        self.motion = motion
+        if not known:
+            # position (and for G38.x, G80 motion mode) unknown after this block
+            self.position = dict.fromkeys(AXES)
+            self.exact = dict.fromkeys(AXES)
+            if any(value == 80 or 38 <= value < 39 for value in gcodes):
+                self.motion = None
+
+        return ''.join(block)
+
+    def arc_offsets(self, offsets, plane, start, start_exact):
+        """
+        arc offsets for the rounded start and end point (the position after the block)
+        offsets: arc offset words (index, letter, value)
+        start, start_exact: position before the block (rounded and exact)
+        returns: { <letter> : <value> }, empty when the start or end point is not known
+        """
+        axes, letters = ARC_PLANE_WORDS[plane]
+        words = { letter : value for _, letter, value in offsets }
+        points = [[position[axis] for axis in axes] for position in (start, self.position, start_exact, self.exact)]
+        if any(value is None for point in points for value in point):
+            return {}
+        (sx, sy), (ex, ey), exact, _ = points
+        dx = ex - sx
+        dy = ey - sy
+        chord = hypot(dx, dy)
+        if 'R' in words:
+            # grbl needs the radius to be at least half the chord
+            radius = words['R']
+            return { 'R' : radius if abs(radius) >= chord / 2 else (chord / 2 if radius >= 0 else -chord / 2) }
+        if not chord:
+            # full circle: any center
+            return {}
+        # center (of the exact start point) projected on the perpendicular bisector of the rounded points
+        cx = exact[0] + words.get(letters[0], 0.0)
+        cy = exact[1] + words.get(letters[1], 0.0)
+        nx = -dy / chord
+        ny = dx / chord
+        t = (cx - (sx + ex) / 2) * nx + (cy - (sy + ey) / 2) * ny
+        return { letters[0] : (sx + ex) / 2 + t * nx - sx, letters[1] : (sy + ey) / 2 + t * ny - sy }
+
+def segment_distance(point, start, end):
+    """
+    distance of point to line segment start-end
+    returns: (distance, position of the projection of point along the segment (length units))
+    """
+    px, py = point
+    sx, sy = start
+    dx = end[0] - sx
+    dy = end[1] - sy
+    length = hypot(dx, dy)
+    if not length:
+        return (hypot(px - sx, py - sy), 0.0)
+    projection = ((px - sx) * dx + (py - sy) * dy) / length
+    # clip projection to the segment (end points)
+    t = max(0.0, min(1.0, projection / length))
+    return (hypot(px - sx - t * dx, py - sy - t * dy), projection)
+
+def douglas_peucker(points, tolerance):
+    """
+    polyline simplification (Douglas-Peucker, iterative)
+    Note that a path that turns back (along the same line) is split at the turning point.
+    returns: list of flags, True for the points to keep (first and last are always kept)
+    """
+    keep = [False] * len(points)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(points) - 1)]
+    while stack:
+        first, last = stack.pop()
+        start = points[first]
+        end = points[last]
+        dmax = tolerance
+        index = 0
+        turn = 0
+        previous = 0.0
+        for i in range(first + 1, last):
+            distance, projection = segment_distance(points[i], start, end)
+            if distance > dmax:
+                dmax = distance
+                index = i
+            if not turn and projection < previous - tolerance:
+                # path turns back
+                turn = i - 1 if i - 1 > first else i
+            previous = max(previous, projection)
+        index = index or turn
+        if index:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+    return keep
+
+class Gcodegeometry(Gcodefilter):
+    """
+    Gcodegeometry: base class of stages that rewrite runs of (XY) G1 moves
+
+    A run is a sequence of 'G1 X.. Y..' blocks in absolute distance mode (G90, not G93) with the same F and S,
+    starting at a known position. Runs are limited to 'window' moves, so memory is bounded.
+    All other lines end a run and are passed unchanged (the modal state is tracked).
+    """
+
+    def __init__(self, window = 1000):
+        super().__init__()
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        """
+        modal state unknown
+        """
+        self.motion = None
+        self.distance = None
+        self.units = None
+        self.feedmode = None
+        self.plane = None
+        self.feed = None
+        self.speed = None
+        self.x = None
+        self.y = None
+        # current run: start point and moves (x, y, xtext, ytext, tag)
+        self.start = None
+        self.run = []
+        self.modal = False
+        # a run was rewritten to a rapid (G0) move, G1 mode must be restored for the lines that follow
+        self.rapid = False
+
+    def process(self, lines):
+        for tag, line in lines:
+            move = self.parse_move(line)
+            if move is None:
+                yield from self.flush()
+                if self.rapid:
+                    yield tag, "G1\n"
+                    self.rapid = False
+                self.track(line)
+                yield tag, line
+                continue
+            x, y, xtext, ytext, feed, speed = move
+            if self.run and (feed != self.feed or speed != self.speed):
+                yield from self.flush()
+            if not self.run:
+                self.start = (self.x, self.y)
+            self.motion = 1
+            self.feed = feed
+            self.speed = speed
+            self.x = x
+            self.y = y
+            self.run.append((x, y, xtext, ytext, tag))
+            if len(self.run) >= self.window:
+                yield from self.flush()
+        yield from self.flush()
+
+    def flush(self):
+        """
+        rewrite and emit the current run
+        """
+        if self.run:
+            # the first block of the rewritten run (re)sets F and S
+            self.modal = True
+            yield from self.rewrite(self.start, self.run)
+            self.run = []
+
+    def rewrite(self, start, run):
+        """
+        rewrite run of moves (generator): override this
+        """
+        yield from self.emit(run)
+
+    def modal_words(self) -> str:
+        """
+        F and S words of the run for its first block, empty for the blocks that follow
+        """
+        words = ''
+        if self.modal:
+            if self.feed is not None:
+                words += 'F' + format_number(self.feed, 4)
+            if self.speed is not None:
+                words += 'S' + format_number(self.speed, 4)
+            self.modal = False
+        return words
+
+    def emit(self, moves):
+        """
+        gcode of moves
+        """
+        for x, y, xtext, ytext, tag in moves:
+            yield tag, f"G1X{xtext}Y{ytext}{self.modal_words()}\n"
+            self.rapid = False
+
+    def parse_move(self, line):
+        """
+        returns: (x, y, xtext, ytext, feed, speed) when line is a G1 (XY) move that can be part of a run, None otherwise
+        """
+        if (self.distance != 90 or self.feedmode == 93 or self.x is None or self.y is None or
+            ';' in line or '(' in line):
+            return None
+        code = line.strip()
+        if not code or not code[0].isalpha():
+            return None
+        x = self.x
+        y = self.y
+        xtext = ytext = None
+        feed = self.feed
+        speed = self.speed
+        motion = self.motion
+        for word in WORD_PATTERN.finditer(code):
+            letter = word.group(1).upper()
+            value = float(word.group(2))
+            if letter == 'X':
+                x = value
+                xtext = word.group(2)
+            elif letter == 'Y':
+                y = value
+                ytext = word.group(2)
+            elif letter == 'F':
+                feed = value
+            elif letter == 'S':
+                speed = value
+            elif letter == 'G' and value in MOTION:
+                motion = value
+            else:
+                return None
+        if motion != 1 or (xtext is None and ytext is None) or split_block(code) is None:
+            return None
+        if xtext is None:
+            xtext = format_number(x, 6)
+        if ytext is None:
+            ytext = format_number(y, 6)
+        return (x, y, xtext, ytext, feed, speed)
+
+    def track(self, line):
+        """
+        update modal state (motion, distance, units, F, S and XY position) of a line that is passed
+        """
+        if any(annotation in line for annotation in ANNOTATIONS):
+            # loop boundaries, etc.
+            self.reset()
+            return
+        code = COMMENT_PATTERN.sub('', line).strip()
+        if not code:
+            return
+        words = split_block(code) if code[0].isalpha() else None
+        if words is None:
+            # '$' commands, etc.
+            self.reset()
+            return
+
+        gcodes = [value for letter, value in words if letter == 'G']
+        known = all(value in KNOWN_G for value in gcodes)
+        for value in gcodes:
+            if value in MOTION:
+                self.motion = value
+            elif value in DISTANCE:
+                self.distance = value
+            elif value in FEEDMODE:
+                self.feedmode = value
+            elif value in PLANE:
+                self.plane = value
+            elif value in UNITS:
+                if value != self.units:
+                    self.x = self.y = None
+                self.units = value
+        for letter, value in words:
+            if letter == 'F':
+                self.feed = value
+            elif letter == 'S':
+                self.speed = value
+            elif letter in ('X', 'Y'):
+                axis = letter.lower()
+                if self.distance == 90:
+                    setattr(self, axis, value)
+                elif self.distance == 91 and getattr(self, axis) is not None:
+                    setattr(self, axis, getattr(self, axis) + value)
+                else:
+                    setattr(self, axis, None)
+        if not known:
+            # position (and for G38.x, G80 motion mode) unknown after this block
+            self.x = self.y = None
+            if any(value == 80 or 38 <= value < 39 for value in gcodes):
+                self.motion = None
+
+class Gcodesimplify(Gcodegeometry):
+    """
+    Gcodesimplify: merge (nearly) collinear G1 moves
+
+    Runs of moves with the same F and S are simplified (Douglas-Peucker): moves that
+    deviate less than 'tolerance' (mm) from the simplified path are removed, so fewer
+    (planner) blocks and junctions remain.
+    """
+    name = "simplify"
+
+    def __init__(self, tolerance = .01, window = 1000):
+        super().__init__(window)
+        self.tolerance = tolerance
+
+    def rewrite(self, start, run):
+        tolerance = self.tolerance / 25.4 if self.units == 20 else self.tolerance
+        points = [start] + [move[:2] for move in run]
+        keep = douglas_peucker(points, tolerance)
+        yield from self.emit(move for move, kept in zip(run, keep[1:]) if kept)
+
+class Gcoderaster(Gcodegeometry):
+    """
+    Gcoderaster: run-length merge of (laser) raster moves
+
+    Consecutive collinear moves with the same power (S) - pixels of a scanline - are merged
+    into one move, runs with power S0 (laser off) become one rapid (G0) move.
+    Note that this is meant for laser engraving: the path of a laser off run becomes a straight line.
+    """
+    name = "raster"
+
+    # max deviation (mm) of collinear moves
+    COLLINEAR = 1e-6
+
+    def rewrite(self, start, run):
+        if self.speed == 0:
+            # laser off: one rapid move to the end of the run
+            x, y, xtext, ytext, tag = run[-1]
+            yield tag, f"G0X{xtext}Y{ytext}S0\n"
+            self.rapid = True
+            return
+        points = [start] + [move[:2] for move in run]
+        keep = douglas_peucker(points, self.COLLINEAR)
+        yield from self.emit(move for move, kept in zip(run, keep[1:]) if kept)
+
+def fit_circle(start, middle, end):
+    """
+    circle through three points
+    returns: (center x, center y, radius), or None when the points are collinear
+    """
+    ax, ay = start
+    bx, by = middle
+    cx, cy = end
+    d = 2 * (ax * (by - cy) + bx * (cy - ay) + cx * (ay - by))
+    if not d:
+        return None
+    a = ax * ax + ay * ay
+    b = bx * bx + by * by
+    c = cx * cx + cy * cy
+    x = (a * (by - cy) + b * (cy - ay) + c * (ay - by)) / d
+    y = (a * (cx - bx) + b * (ax - cx) + c * (bx - ax)) / d
+    return (x, y, hypot(ax - x, ay - y))
+
+class Gcodearcs(Gcodegeometry):
+    """
+    Gcodearcs: replace runs of short G1 moves (chords) by G2/G3 arcs
+
+    An arc replaces at least 'MIN_MOVES' moves when all points are within 'deviation' of it and it
+    does not deviate more than that from the chords in between. Grbl draws arcs with line segments
+    that deviate up to 'arc_tolerance' ($12) from the arc, so the fit uses 'deviation' - $12.
+    Arcs are fitted in the XY plane (G17) only.
+    """
+    name = "arcs"
+
+    # arc replaces at least this number of moves
+    MIN_MOVES = 3
+    # and at most this number (limits fit time)
+    MAX_MOVES = 200
+    # radius limit (mm) (almost straight lines are left to the simplify stage)
+    MAX_RADIUS = 1000.0
+
+    def __init__(self, deviation = .01, arc_tolerance = .002, window = 1000):
+        super().__init__(window)
+        self.deviation = deviation
+        self.arc_tolerance = arc_tolerance
+        # G18/G19 used in this file (so an unknown plane might not be G17)
+        self.planes = False
+        # path time (seconds at the programmed feed) of the replaced moves and of the arcs
+        self.time_moves = 0.0
+        self.time_arcs = 0.0
+        self.arcs = 0
+
+    def track(self, line):
+        super().track(line)
+        if self.plane in (18, 19):
+            self.planes = True
+
+    def fit(self, points, first, last, tolerance):
+        """
+        fit arc to points[first:last + 1]
+        returns: (center x, center y, radius, direction (2: G2 clockwise, 3: G3 counterclockwise), sweep), or None
+        """
+        circle = fit_circle(points[first], points[(first + last) // 2], points[last])
+        if circle is None:
+            return None
+        x, y, radius = circle
+        if radius > self.MAX_RADIUS:
+            return None
+        sweep = 0.0
+        previous = atan2(points[first][1] - y, points[first][0] - x)
+        px, py = points[first]
+        for i in range(first + 1, last + 1):
+            qx, qy = points[i]
+            # point on the arc
+            if abs(hypot(qx - x, qy - y) - radius) > tolerance:
+                return None
+            # chord: arc sagitta
+            half = hypot(qx - px, qy - py) / 2
+            if half >= radius or radius - sqrt(radius * radius - half * half) > tolerance:
+                return None
+            angle = atan2(qy - y, qx - x)
+            step = (angle - previous + pi) % (2 * pi) - pi
+            if sweep and (step > 0) != (sweep > 0):
+                # direction changes
+                return None
+            sweep += step
+            previous = angle
+            px, py = qx, qy
+        if not sweep or abs(sweep) >= 2 * pi:
+            return None
+        return (x, y, radius, 3 if sweep > 0 else 2, sweep)
+
+    def rewrite(self, start, run):
+        tolerance = self.deviation - self.arc_tolerance
+        if self.units == 20:
+            tolerance /= 25.4
+        if tolerance <= 0 or self.plane not in (None, 17) or (self.plane is None and self.planes):
+            # no arcs
+            yield from self.emit(run)
+            return
+        points = [start] + [move[:2] for move in run]
+
+        # greedy: extend an arc as far as possible (double its length, then bisect), otherwise emit a move
+        first = 0
+        lines = []
+        while first < len(run):
+            arc = None
+            limit = min(len(points) - 1, first + self.MAX_MOVES)
+            moves = self.MIN_MOVES
+            failed = limit + 1
+            while first + moves <= limit:
+                fit = self.fit(points, first, first + moves, tolerance)
+                if fit is None:
+                    failed = first + moves
+                    break
+                arc = (first + moves, fit)
+                moves *= 2
+            if arc is not None:
+                good = arc[0]
+                while failed - good > 1:
+                    last = (good + failed) // 2
+                    fit = self.fit(points, first, last, tolerance)
+                    if fit is None:
+                        failed = last
+                    else:
+                        good = last
+                        arc = (last, fit)
+            if arc is None:
+                lines.append(run[first])
+                first += 1
+                continue
+            yield from self.emit(lines)
+            lines = []
+            last, (x, y, radius, direction, sweep) = arc
+            yield from self.emit_arc(points, first, last, x, y, radius, direction, sweep, run[last - 1])
+            first = last
+        yield from self.emit(lines)
+
+    def emit_arc(self, points, first, last, x, y, radius, direction, sweep, move):
+        """
+        gcode of arc points[first] to points[last] around (x, y)
+        """
+        decimals = 5 if self.units == 20 else 4
+        sx, sy = points[first]
+        xend, yend, xtext, ytext, tag = move
+        yield tag, (f"G{direction}X{xtext}Y{ytext}I{format_number(x - sx, decimals)}J{format_number(y - sy, decimals)}"
+                    f"{self.modal_words()}\n")
+        self.arcs += 1
+        self.rapid = False
+        if self.feed:
+            scale = 25.4 if self.units == 20 else 1.0
+            chords = sum(hypot(points[i][0] - points[i - 1][0], points[i][1] - points[i - 1][1]) for i in range(first + 1, last + 1))
+            self.time_moves += chords * scale / self.feed * 60
+            self.time_arcs += abs(sweep) * radius * scale / self.feed * 60
+
+    def summary(self, baud = 115200) -> str:
+        return (super().summary(baud) + f"\n    {self.arcs} arcs, {self.lines_in - self.lines_out} blocks eliminated, "
+                f"path time at programmed feed {self.time_arcs - self.time_moves:+.2f} seconds")
+
+def create_filters(compact = 0, simplify = 0, raster = False, arcs = 0, arc_tolerance = .002):
+    """
+    create (pre)processing stages
+    compact: resolution (mm) of the compaction stage, 0 is off
+    simplify: tolerance (mm) of the simplify stage, 0 is off
+    raster: raster stage on/off
+    arcs: max deviation (mm) of the arc fitting stage, 0 is off
+    arc_tolerance: grbl setting $12 (mm)
+    returns: list of stages (in order)
+    """
+    filters = []
+    if raster:
+        filters.append(Gcoderaster())
+    if arcs:
+        filters.append(Gcodearcs(arcs, arc_tolerance))
+    if simplify:
+        filters.append(Gcodesimplify(simplify))
+    if compact:
+        filters.append(Gcodecompact(compact))
+    return filters
+
+def filter_chain(lines, filters):
+    """
+    pass lines ((tag, line) tuples) through the (pre)processing stages
+    returns: generator of processed (tag, line) tuples
+    """
+    for stage in filters:
+        lines = stage.filter(lines)
+    return lines
+
+def main():
+    """
+    microbenchmark: compaction cost (per block), check that compacted arcs pass the grbl arc check
+    """
+    rng = random.Random(1)
+    lines = ["G90 G21 G17\n", "G0 X0 Y0\n", "G1 F1000\n"]
+    x, y = 0.0, 0.0
+    for i in range(20000):
+        # small arcs (r .5 to 3 mm) with exact (4 decimal) offsets
+        radius = rng.uniform(.5, 3)
+        angle = rng.uniform(0, 2 * pi)
+        sweep = rng.uniform(.2, 3)
+        cx, cy = x - radius * cos(angle), y - radius * sin(angle)
+        ex, ey = cx + radius * cos(angle + sweep), cy + radius * sin(angle + sweep)
+        lines.append(f"G3 X{ex:.4f} Y{ey:.4f} I{cx - x:.4f} J{cy - y:.4f}\n")
+        x, y = float(f"{ex:.4f}"), float(f"{ey:.4f}")
+    stage = Gcodecompact(.01)
+    start = perf_counter()
+    compacted = [line for tag, line in stage.filter(enumerate(lines))]
+    elapsed = perf_counter() - start
+    print(f"compacted {len(lines)} blocks in {elapsed:.3f} seconds ({elapsed / len(lines) * 1e6:.1f} us/block)")
+    print(stage.summary())
+
+    # replay the compacted program: each arc must pass the grbl arc check
+    errors = 0
+    x, y, motion = 0.0, 0.0, None
+    for line in compacted:
+        words = dict(split_block(line.strip()))
+        motion = words.get('G', motion) if words.get('G') in MOTION else motion
+        ex, ey = words.get('X', x), words.get('Y', y)
+        if motion in (2, 3) and ('I' in words or 'J' in words):
+            errors += arc_radius_error((x, y), (ex, ey), (x + words.get('I', 0.0), y + words.get('J', 0.0)))
+        x, y = ex, ey
+    print(f"arcs outside the grbl arc check (error:33): {errors}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+"""
+gcodequeue: two lane gcode queue (interactive commands and job lines)
+"""
+
+from collections import deque
+from itertools import chain, islice, repeat
+
+class Gcodequeue:
+    """
+    Gcodequeue: O(1) gcode queue with two priority lanes
+
+    Interactive (prepended) commands are served before the lines of a (bulk) job.
+    All access that changes the queue is done holding 'condition', consumers
+    wait on it until the queue is not empty, producers (can) wait on it while
+    the job lane is filled up to the high water mark.
+    A source (iterator of job lines) can be set instead: lines are pulled from it (a chunk at a time)
+    when the job lane runs empty, so a (large) job is never copied into the queue. Pulling (reading and
+    filtering source lines) is done not holding 'condition', it is taken only to extend the job lane.
+    Job lines carry a tag (their source line, None when not known), lines are served as (tag, line) tuples.
+    """
+
+    # number of lines pulled from the source at a time
+    SOURCE_CHUNK = 256
+
+    def __init__(self, condition, high_water = 10000, low_water = 2000):
+        # 'buffer empty' condition (shared with the consumer)
+        self.condition = condition
+
+        # job lane backpressure: producers block at 'high_water' and resume at 'low_water'
+        self.high_water = high_water
+        self.low_water = low_water
+        self.draining = False
+
+        # priority lane: interactive/prepended commands (first served)
+        self.interactive = deque()
+        # bulk lane: job lines, (tag, line) tuples (served when there are no interactive commands)
+        self.job = deque()
+        # job line source (iterator of (tag, line) tuples), None when there is none
+        self.source = None
+        # changes when the queue is cleared (lines pulled before that are dropped)
+        self.generation = 0
+
+    def __len__(self) -> int:
+        # note that deque len is atomic, so no lock needed here
+        return len(self.interactive) + len(self.job)
+
+    def clear(self):
+        """
+        purge both lanes
+        """
+        with self.condition:
+            self.interactive.clear()
+            self.job.clear()
+            self.source = None
+            self.generation += 1
+            # release producers
+            self.draining = False
+            self.condition.notify_all()
+
+    def put(self, line, prepend = False):
+        """
+        put line on the queue: at the end of the job lane or in front of the interactive lane (prepend)
+        """
+        with self.condition:
+            if prepend:
+                # put line at the start of the queue (first served/prioritized)
+                self.interactive.appendleft(line)
+            else:
+                # put line at the end of the queue (last served)
+                self.job.append((None, line))
+            self.condition.notify()
+
+    def put_many(self, lines, tags = None):
+        """
+        put lines (and their tags) at the end of the job lane, notify once
+        """
+        with self.condition:
+            self.job.extend(zip(repeat(None) if tags is None else tags, lines))
+            if len(self):
+                self.condition.notify()
+
+    def set_source(self, lines):
+        """
+        pull job lines from 'lines' (iterator of (tag, line) tuples) when the job lane runs empty (after the current
+        source, if any)
+        """
+        with self.condition:
+            self.source = iter(lines) if self.source is None else chain(self.source, lines)
+            self.condition.notify()
+
+    def ready(self) -> bool:
+        """
+        lines available (or a source to pull them from)
+        """
+        return bool(self.interactive or self.job or self.source is not None)
+
+    def refill(self):
+        """
+        pull a chunk of lines from the source when the job lane is empty (consumer, not holding 'condition')
+        """
+        with self.condition:
+            if self.source is None or self.job:
+                return
+            source, generation = self.source, self.generation
+        try:
+            chunk = list(islice(source, Gcodequeue.SOURCE_CHUNK))
+        except (ValueError, OSError) as e:
+            # source is gone (file closed)
+            print(f"Job source error: {e}, job lines skipped!")
+            chunk = []
+        with self.condition:
+            if self.generation != generation:
+                # cleared meanwhile
+                return
+            self.job.extend(chunk)
+            if not chunk and self.source is source:
+                # exhausted (a source set meanwhile is chained to it)
+                self.source = None
+
+    def get(self):
+        """
+        get first line of the queue, wait for it when empty
+        returns: (tag, line)
+        """
+        while True:
+            with self.condition:
+                self.condition.wait_for(self.ready)
+                if self.interactive:
+                    return (None, self.interactive.popleft())
+                if self.job:
+                    line = self.job.popleft()
+                    if self.draining and len(self.job) <= self.low_water:
+                        # wake up blocked producer
+                        self.condition.notify_all()
+                    return line
+            self.refill()
+
+    def get_fitting(self, size):
+        """
+        get first line of the queue when its length is less than or equal to 'size', do not wait
+        returns: (tag, line), or None
+        """
+        self.refill()
+        with self.condition:
+            if self.interactive:
+                if len(self.interactive[0]) > size:
+                    return None
+                return (None, self.interactive.popleft())
+            if not self.job or len(self.job[0][1]) > size:
+                return None
+            line = self.job.popleft()
+            if self.draining and len(self.job) <= self.low_water:
+                # wake up blocked producer
+                self.condition.notify_all()
+            return line
+
+    def wait_for_room(self, timeout = None) -> bool:
+        """
+        block (a producer) when the job lane reached its high water mark, until it is drained to the low water mark
+        returns: True when there is room for more lines, False on timeout
+        """
+        with self.condition:
+            if len(self.job) >= self.high_water:
+                self.draining = True
+            if self.draining:
+                self.draining = not self.condition.wait_for(lambda: len(self.job) <= self.low_water, timeout)
+            return not self.draining
@@ -0,0 +1,137 @@
+"""
+gcoderun: run engine, produces the blocks of a loaded gcode program on demand
+"""
+
+import re
+
+# loopname of a '; DO <loopname>' annotation
+LOOPNAME_PATTERN = re.compile(" [a-z]+[0-9]*")
+
+def nested_loops(program, loops, pcstart, pcend, outer = None):
+    """
+    loops that a run of lines [pcstart, pcend] repeats: loops that have their '; DO <loopname>' line (right after
+    the loop body) in that range and are not within another such loop
+    outer: loop that runs lines [pcstart, pcend] (it is not repeated within itself)
+    """
+    def repeated(name, loop):
+        if name == outer or not (pcstart <= loop["pcstart"] <= loop["pcend"] < pcend):
+            return False
+        loopname = LOOPNAME_PATTERN.search(program[loop["pcend"] + 1]) if program[loop["pcend"] + 1].find("; DO") >= 0 else None
+        return loopname is not None and loopname.group()[1:] == name
+
+    within = [name for name, loop in loops.items() if repeated(name, loop)]
+    return [name for name in within if not any(other != name and loops[other]["pcstart"] <= loops[name]["pcstart"] and
+                                               loops[name]["pcend"] <= loops[other]["pcend"] for other in within)]
+
+class Gcoderun:
+    """
+    Gcoderun: program counter and loop stack over a loaded gcode program
+
+    Blocks are produced on demand (an iterator of (pc, line) tuples), loops are run by jumping
+    back, so memory use does not depend on loop counts and a run starts right away.
+    A '; DO <loopname>' line repeats the loop body (lines 'pcstart' to 'pcend') 'count' times,
+    after the body ran once. Loops can be nested. Each iteration starts with a comment line
+    '; <loopname> iterate nr: <n>' (pc is None for these).
+    F and S settings of a run are applied by running a variant of the program (see Gcodefile.variant()).
+    """
+
+    def __init__(self, program, loops, loop = None, count = None):
+        """
+        program: loaded gcode (Gcodefile)
+        loops: loop info { <loopname> : { "pcstart" : <pc>, "pcend" : <pc>, "count" : <count> } }
+        loop, count: run loop 'loop' 'count' times (instead of the program)
+        """
+        self.program = program
+        self.loops = loops
+
+        # loop stack: [ loopname, pcstart, pcend, iteration, count, resume pc ]
+        self.stack = []
+        # line reader (from pc), None after a jump
+        self.reader = None
+        if loop is None:
+            self.pc = 0
+            self.end = len(program)
+        else:
+            # start past the loop body, so the first iteration starts right away
+            self.pc = self.end = loops[loop]["pcend"] + 1
+            self.stack.append([loop, loops[loop]["pcstart"], loops[loop]["pcend"], 0, count, self.end])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        """
+        next block
+        returns: (pc, line), pc is None for loop iteration comments
+        """
+        while self.stack and self.pc > self.stack[-1][2]:
+            # end of loop body
+            frame = self.stack[-1]
+            if frame[3] < frame[4]:
+                frame[3] += 1
+                self.jump(frame[1])
+                return (None, "; " + frame[0] + " iterate nr: " + str(frame[3]) + "\n")
+            self.stack.pop()
+            self.jump(frame[5])
+
+        if self.pc >= self.end:
+            raise StopIteration
+
+        if self.reader is None:
+            self.reader = self.program.lines(self.pc, self.end)
+        line = next(self.reader)
+        pc = self.pc
+        self.pc += 1
+
+        if line.find("; DO") >= 0:
+            self.do(pc, line)
+
+        return (pc, line)
+
+    def jump(self, pc):
+        """
+        continue at pc
+        """
+        self.pc = pc
+        self.reader = None
+
+    def do(self, pc, line):
+        """
+        '; DO <loopname>': push loop, its iterations start after this line
+        """
+        loopname = LOOPNAME_PATTERN.search(line)
+        if not loopname:
+            return
+        loopname = loopname.group()[1:]
+        loop = self.loops.get(loopname)
+        if loop is None or loop["pcend"] >= pc or any(frame[0] == loopname for frame in self.stack):
+            # unknown (or inconsistent) loop
+            return
+        self.stack.append([loopname, loop["pcstart"], loop["pcend"], 0, loop["count"], pc + 1])
+
+    def length(self) -> int:
+        """
+        number of blocks the run produces (loop iterations included)
+        """
+        def blocks(pcstart, pcend, outer = None):
+            # lines [pcstart, pcend] run once: the lines and the iterations of the loops within them
+            # (an iteration: its comment line and one run of the loop body)
+            count = pcend - pcstart + 1
+            for name in nested_loops(self.program, self.loops, pcstart, pcend, outer):
+                loop = self.loops[name]
+                body = blocks(loop["pcstart"], loop["pcend"], name)
+                count += body - (loop["pcend"] - loop["pcstart"] + 1) + loop["count"] * (1 + body)
+            return count
+
+        if self.stack:
+            # loop run
+            name, pcstart, pcend, _, count, _ = self.stack[0]
+            return count * (1 + blocks(pcstart, pcend, name))
+        return blocks(0, len(self.program) - 1)
+
+    def lines(self):
+        """
+        blocks (lines only, generator)
+        """
+        for pc, line in self:
+            yield line
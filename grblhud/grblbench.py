@@ -0,0 +1,342 @@
+"""
+grblbench: streaming throughput benchmark, grblhud streams synthetic workloads to a simulated device (grblsim)
+over a pseudo terminal (serial) or a socket (network)
+"""
+
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import multiprocessing
+from math import cos, pi, sin
+from time import monotonic, process_time, sleep
+from grblhud import __version__
+from grblhud.grblsim import Grblsim
+
+def raster_lines(count, rng):
+    """
+    laser raster: scanlines of .1 mm pixels, the power changes from pixel to pixel (as image2gcode writes it)
+    """
+    yield "G90 G21\n"
+    yield "M4 S0\n"
+    yield "G1 F3000\n"
+    width = 500
+    power = 0
+    for i in range(count):
+        row, pixel = divmod(i, width)
+        if pixel == 0:
+            yield f"G0 Y{row * .1:.1f}\n"
+        if rng.random() < .3:
+            power = rng.randrange(256)
+        x = pixel if row % 2 == 0 else width - 1 - pixel
+        yield f"G1 X{x * .1:.1f} S{power}\n"
+    yield "M5\n"
+
+def vector_lines(count, rng):
+    """
+    vector graphics: polylines of 1 to 20 mm moves and half circles (as svg2gcode writes it)
+    """
+    yield "G90 G21\n"
+    yield "G1 F1500\n"
+    x, y = 50.0, 50.0
+    for i in range(count):
+        if i % 50 == 0:
+            # next shape
+            x, y = rng.uniform(20, 80), rng.uniform(20, 80)
+            yield "M5\n"
+            yield f"G0 X{x:.3f} Y{y:.3f}\n"
+            yield "M3 S1000\n"
+        if i % 10 == 9:
+            # half circle
+            radius = rng.uniform(1, 5)
+            yield f"G{rng.choice((2, 3))} X{x + 2 * radius:.3f} Y{y:.3f} I{radius:.3f} J0\n"
+            x += 2 * radius
+        else:
+            angle = rng.uniform(0, 2 * pi)
+            length = rng.uniform(1, 20)
+            x = min(max(x + length * cos(angle), 0), 100)
+            y = min(max(y + length * sin(angle), 0), 100)
+            yield f"G1 X{x:.3f} Y{y:.3f}\n"
+    yield "M5\n"
+
+def tiny_lines(count, rng):
+    """
+    tiny segments: a spiral of .02 mm moves (as a finely sampled curve is written)
+    """
+    yield "G90 G21\n"
+    yield "G1 F1000\n"
+    radius = 1.0
+    angle = 0.0
+    for i in range(count):
+        angle += .02 / radius
+        radius += .0001
+        yield f"G1 X{50 + radius * cos(angle):.3f} Y{50 + radius * sin(angle):.3f}\n"
+
+WORKLOADS = { "raster" : raster_lines, "vector" : vector_lines, "tiny" : tiny_lines }
+MODES = ("stream", "run")
+TRANSPORTS = ("pty", "tcp", "unix")
+
+def simulate(connection, options, transport):
+    """
+    device process: run grblsim on a pseudo terminal or a socket (transport), send its device name (address),
+    on request stop it and send its counters
+    """
+    sim = Grblsim(**options)
+    if transport == "tcp":
+        connection.send(sim.listen("tcp://127.0.0.1:0"))
+    elif transport == "unix":
+        connection.send(sim.listen("unix://" + os.path.join(tempfile.gettempdir(), f"grblbench-{os.getpid()}.sock")))
+    else:
+        connection.send(sim.open())
+
+    def stop():
+        if connection.recv() == "counters":
+            # counters of the job (from its first block on)
+            connection.send(dict(sim.counters))
+        connection.recv()
+        sim.stop()
+
+    threading.Thread(target = stop, daemon = True).start()
+    sim.run()
+    sim.close()
+
+def host(connection, device, path, mode, rx_buffer_size, timeout):
+    """
+    host process: grblhud streams (or loads and runs) file 'path' to 'device', send its measurements
+    rx_buffer_size: device RX buffer size the streamer fills, 0: ask the device (as grblhud does)
+    """
+    # grblhud (threads) report on stdout
+    sys.stdout = open(os.devnull, "w")
+    from grblhud.transport import open_transport
+    from grblhud.grblbuffer import Grblbuffer
+    from grblhud.gcodefile import Gcodefile
+    from grblhud.gcoderun import Gcoderun
+    from grblhud.gcodefilter import filter_chain
+
+    ser = open_transport(device)
+    # wake up, drop the responses
+    ser.write(b"\r\n\r\n")
+    sleep(.5)
+    ser.reset_input_buffer()
+    if not rx_buffer_size:
+        rx_buffer_size = Grblbuffer.detect_buffers(ser)[0] or Grblbuffer.RX_BUFFER_SIZE
+        ser.reset_input_buffer()
+
+    grblbuffer = Grblbuffer(ser, None, False, rx_buffer_size = rx_buffer_size)
+    grblbuffer.start()
+    # wait for the planner size (from an 'Idle' status report)
+    while not grblbuffer.stats.planner_size:
+        sleep(.05)
+
+    start = monotonic()
+    cpu = process_time()
+    load_time = 0.0
+    if mode == "stream":
+        # as the 'stream' command does: lines are put on the buffer in batches
+        with open(path) as f:
+            grblbuffer.start_job(os.path.getsize(path), os.path.basename(path))
+            batch = []
+            tags = []
+            for i, (tag, line) in enumerate(filter_chain(grblbuffer.stats.counted(enumerate(f), len), [])):
+                if i and i % 1000 == 0:
+                    grblbuffer.put_many(batch, tags)
+                    batch = []
+                    tags = []
+                    while not grblbuffer.wait_for_room(.5):
+                        pass
+                batch.append(line)
+                tags.append(tag)
+            grblbuffer.put_many(batch, tags)
+    else:
+        # as the 'load' and 'run' commands do
+        program = Gcodefile.open(path)
+        program.find_all("Boundingbox:", "; WHILE", "; DO")
+        load_time = monotonic() - start
+        job = Gcoderun(program, {})
+        grblbuffer.start_job(job.length(), os.path.basename(path))
+        grblbuffer.put_source(filter_chain(grblbuffer.stats.counted(job), []))
+
+    while grblbuffer.stats.active and monotonic() - start < timeout:
+        sleep(.01)
+    cpu = process_time() - cpu
+    stats = grblbuffer.stats
+    ledger = grblbuffer.ledger
+    elapsed = (stats.ended or monotonic()) - stats.started
+    result = {
+        "done" : not stats.active,
+        "rx_buffer_size" : rx_buffer_size,
+        "blocks" : stats.acked,
+        "bytes" : stats.bytes,
+        "seconds" : elapsed,
+        "load_seconds" : load_time,
+        "cpu_seconds" : cpu,
+        "starved_reports" : stats.starved,
+        "starved_seconds_reported" : stats.starved_time,
+        "latency_ms_50" : (ledger.percentile(.5) or 0) * 1000,
+        "latency_ms_99" : (ledger.percentile(.99) or 0) * 1000,
+        # KB on Linux, bytes on macOS
+        "peak_rss_mb" : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10),
+    }
+
+    Grblbuffer.GRBLHUD_EXIT = True
+    grblbuffer.grblstatus.join()
+    grblbuffer.grblreader.join()
+    # put something to get run loop out of waiting
+    grblbuffer.put(";")
+    grblbuffer.join()
+    ser.close()
+    connection.send(result)
+
+def benchmark(workload, mode, path, options, rx_buffer_size, timeout, transport = "pty"):
+    """
+    stream (or load and run) workload file 'path' to a simulated device, each in a process of its own
+    (so CPU time and peak memory are those of grblhud alone), connected by 'transport' (pty, tcp or unix)
+    returns: measurements
+    """
+    context = multiprocessing.get_context("spawn")
+    device_end, device_connection = context.Pipe()
+    device = context.Process(target = simulate, args = (device_connection, options, transport))
+    device.start()
+    name = device_end.recv()
+
+    host_end, host_connection = context.Pipe()
+    process = context.Process(target = host, args = (host_connection, name, path, mode, rx_buffer_size, timeout))
+    process.start()
+    result = host_end.recv() if host_end.poll(timeout + 60) else { "done" : False }
+    process.join(10)
+
+    device_end.send("counters")
+    counters = device_end.recv()
+    device_end.send("stop")
+    device.join(10)
+
+    result.update(workload = workload, mode = mode, transport = transport)
+    if "blocks" in result:
+        seconds = max(result["seconds"], 1e-9)
+        # the link (bytes per second) as the simulator runs it
+        link = options["baud"] / 10 * options["speed"] if options["baud"] else None
+        result.update(
+            blocks_per_second = result["blocks"] / seconds,
+            kbytes_per_second = result["bytes"] / seconds / 1000,
+            link_utilisation = result["bytes"] / seconds / link if link else None,
+            # planner starvation as the device counts it (model seconds to real seconds)
+            starved_seconds = counters["starved"] / options["speed"],
+            cpu_us_per_block = result["cpu_seconds"] / max(result["blocks"], 1) * 1e6,
+            device_errors = counters["errors"],
+            device_overflow = counters["overflow"],
+        )
+    return result
+
+def compare(results, base):
+    """
+    relative change of throughput and CPU per block against 'base' (results of an earlier benchmark)
+    """
+    previous = { (result["workload"], result["mode"]) : result for result in base["results"] if "blocks" in result }
+    lines = [f"compared to grblhud {base.get('version', '?')}:"]
+    for result in results:
+        old = previous.get((result["workload"], result["mode"]))
+        if old is None or "blocks" not in result:
+            continue
+        lines.append(f"  {result['workload']:<7} {result['mode']:<7}"
+                     f" blocks/s {100 * (result['blocks_per_second'] / old['blocks_per_second'] - 1):+6.1f}%"
+                     f"   cpu/block {100 * (result['cpu_us_per_block'] / old['cpu_us_per_block'] - 1):+6.1f}%"
+                     f"   starved {result['starved_seconds'] - old['starved_seconds']:+.2f} s")
+    return "\n".join(lines)
+
+def main():
+    """
+    run the benchmarks, print a table and (optionally) write json
+    """
+    parser = argparse.ArgumentParser(description = "grblhud streaming benchmark: synthetic workloads streamed to a simulated grbl device",
+                                     formatter_class = argparse.RawTextHelpFormatter)
+    parser.add_argument('--workloads', default = ",".join(WORKLOADS), metavar = "<default:" + ",".join(WORKLOADS) + ">",
+                        help = 'workloads to run (comma separated)')
+    parser.add_argument('--modes', default = "stream", metavar = "<default:stream>",
+                        help = "stream: as the 'stream' command, run: as the 'load' and 'run' commands (comma separated)")
+    parser.add_argument('--lines', type = int, default = 10000, metavar = "<default:10000>",
+                        help = 'moves per workload')
+    parser.add_argument('--rx_buffer_size', type = int, default = 128, metavar = "<default:128>",
+                        help = 'device RX buffer size (bytes)')
+    parser.add_argument('--planner_blocks', type = int, default = 15, metavar = "<default:15>",
+                        help = 'device planner size (blocks)')
+    parser.add_argument('--block_time', type = float, default = .0005, metavar = "<default:0.0005>",
+                        help = 'device execution time of a block (seconds), 0: its length at feed rate')
+    parser.add_argument('--transport', choices = TRANSPORTS, default = "pty", metavar = "<default:pty>",
+                        help = 'connection to the device: pty (serial), tcp or unix (socket, a network attached controller)')
+    parser.add_argument('--baud', type = int, metavar = "<default:115200, 0 on a socket>",
+                        help = 'link speed (bits/s), 0 is not limited')
+    parser.add_argument('--speed', type = float, default = 1.0, metavar = "<default:1.0>",
+                        help = 'run the device this many times faster than real time')
+    parser.add_argument('--latency', type = float, default = .001, metavar = "<default:0.001>",
+                        help = 'time (seconds) device responses take to reach grblhud')
+    parser.add_argument('--host_rx_buffer_size', type = int, default = 0, metavar = "<default:0>",
+                        help = 'device RX buffer size grblhud fills, 0: ask the device (as grblhud does)')
+    parser.add_argument('--timeout', type = float, default = 600, metavar = "<default:600>",
+                        help = 'max time (seconds) of a benchmark')
+    parser.add_argument('--json', metavar = "<file>",
+                        help = "write the results (json) to this file, '-' is stdout")
+    parser.add_argument('--compare', metavar = "<file>",
+                        help = 'compare with the results (json) of an earlier benchmark')
+    args = parser.parse_args()
+    workloads = args.workloads.split(',')
+    modes = args.modes.split(',')
+    if not set(workloads) <= set(WORKLOADS) or not set(modes) <= set(MODES):
+        parser.error(f"workloads are {', '.join(WORKLOADS)}, modes are {', '.join(MODES)}")
+    if args.lines < 1 or args.speed <= 0 or args.latency < 0:
+        parser.error("lines must be at least 1, speed must be greater than 0 and latency must not be negative")
+    if args.host_rx_buffer_size != 0 and args.host_rx_buffer_size < 16:
+        parser.error("host_rx_buffer_size must be at least 16 (0 is ask the device)")
+    if args.baud is None:
+        # a network link is not limited by a baud rate
+        args.baud = 115200 if args.transport == "pty" else 0
+    if args.baud < 0:
+        parser.error("baud must not be negative (0 is not limited)")
+
+    options = { "rx_buffer_size" : args.rx_buffer_size, "planner_blocks" : args.planner_blocks, "block_time" : args.block_time,
+                "baud" : args.baud, "speed" : args.speed, "latency" : args.latency }
+    report = sys.stderr if args.json == '-' else sys.stdout
+    print(f"grblhud {__version__} streaming benchmark, device: RX buffer {args.rx_buffer_size} bytes, {args.planner_blocks} planner blocks, "
+          f"block time {args.block_time * 1000:g} ms, latency {args.latency * 1000:g} ms, {args.transport} link {str(args.baud) + ' baud' if args.baud else 'not limited'}, speed x{args.speed:g}", file = report)
+    print(f"{'workload':<9}{'mode':<8}{'rx':>6}{'blocks':>8}{'blocks/s':>10}{'kB/s':>8}{'link':>7}{'starved':>9}"
+          f"{'cpu/block':>11}{'peak rss':>10}{'p99 ack':>9}", file = report, flush = True)
+
+    directory = tempfile.mkdtemp(prefix = "grblbench-")
+    results = []
+    try:
+        for workload in workloads:
+            path = os.path.join(directory, workload + ".gc")
+            with open(path, "w") as f:
+                f.writelines(WORKLOADS[workload](args.lines, random.Random(1)))
+            for mode in modes:
+                result = benchmark(workload, mode, path, options, args.host_rx_buffer_size, args.timeout, args.transport)
+                results.append(result)
+                if "blocks" not in result:
+                    print(f"{workload:<9}{mode:<8} failed", file = report, flush = True)
+                    continue
+                link = f"{100 * result['link_utilisation']:.0f}%" if result["link_utilisation"] is not None else "-"
+                print(f"{workload:<9}{mode:<8}{result['rx_buffer_size']:>6}{result['blocks']:>8}{result['blocks_per_second']:>10.0f}{result['kbytes_per_second']:>8.1f}"
+                      f"{link:>7}{result['starved_seconds']:>8.2f}s{result['cpu_us_per_block']:>9.0f}us{result['peak_rss_mb']:>8.1f}MB"
+                      f"{result['latency_ms_99']:>7.1f}ms" + ("" if result["done"] else " (timeout)"), file = report, flush = True)
+    finally:
+        shutil.rmtree(directory, ignore_errors = True)
+
+    output = { "version" : __version__, "python" : platform.python_version(), "platform" : platform.platform(),
+               "lines" : args.lines, "transport" : args.transport, "device" : options, "results" : results }
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(results, json.load(f)), file = report)
+    if args.json == '-':
+        json.dump(output, sys.stdout, indent = 1)
+        print()
+    elif args.json:
+        with open(args.json, "w") as f:
+            json.dump(output, f, indent = 1)
+
+if __name__ == '__main__':
+    main()
@@ -5,10 +5,13 @@ grblhub: a command line tool to handle grbl code.
 
 import re
 import threading
-from time import sleep
-# needs pyserial!
-import serial
+from time import monotonic
 from grblhud import lineinput
+from grblhud.gcodequeue import Gcodequeue
+from grblhud.machinestatus import MachineStatus
+from grblhud.machinestatus import parse_status
+from grblhud.grblstats import Grblstats
+from grblhud.grblledger import Grblledger
 from grblhud.grblmessages import grbl_errors
 from grblhud.grblmessages import grbl_alarm
 from grblhud.grblmessages import grbl_settings
@@ -36,260 +39,471 @@ class Grblbuffer(threading.Thread):
 
     EndCol = '\033[0;0m'     # End of color setting
 
-    # lock
+    # locks, lock order: serialio_lock, bec, ifc (a lock is never taken while holding one that comes after it:
+    # bec is never taken holding ifc, so the streamer takes queued blocks before it accounts for them under ifc)
     serialio_lock = threading.Lock()
 
+    # last status report and the machine status and job progress parsed from it (the reader sets them, the status
+    # thread shows them), taken after serialio_lock
+    display_lock = threading.Lock()
+
     # buffer empty condition
     bec = threading.Condition()
 
-    # device buffer size
+    # in flight condition: signalled when the device acknowledged a block ('ok' or 'error')
+    ifc = threading.Condition()
+
+    # response channels (see dispatch())
+    ACK     = "ack"         # 'ok'
+    ERROR   = "error"       # 'error:<code>'
+    ALARM   = "alarm"       # 'ALARM:<code>'
+    STATUS  = "status"      # '<...>' realtime status report
+    SETTING = "setting"     # '$<nr>=<value>'
+    MESSAGE = "message"     # feedback messages '[...]', startup line, etc.
+    CHANNELS = (ACK, ERROR, ALARM, STATUS, SETTING, MESSAGE)
+
+    # setting response pattern (on raw bytes): '$<nr>=<value>'
+    SETTING_PATTERN = re.compile(rb"\$([0-9]+)=([0-9]+(\.[0-9]+)?)")
+
+    # device buffer size (of grbl on an ATmega328p), used when the device does not report it (see detect_buffers())
     RX_BUFFER_SIZE = 128
 
+    # build options response (on raw bytes): '[OPT:<codes>,<planner blocks>,<RX buffer bytes>...]'
+    OPTIONS_PATTERN = re.compile(rb"\[OPT:[^,\]]*,([0-9]+),([0-9]+)")
+
     # class global thread exit signal
     GRBLHUD_EXIT = False
 
     # pauze status report when true
     STATUS_PAUZE = False
 
-    def __init__(self, serial, grblinput, interactive: bool):
+    # machine states that need fast status polling (all others back off to the slow polling rate)
+    POLL_FAST_STATES = ("Run", "Jog", "Hold", "Home", "Door")
+
+    # max time (seconds) the streamer blocks waiting for room in the device buffer
+    # (before checking the exit signal)
+    RESPONSE_WAIT = .5
+
+    def __init__(self, serial, grblinput, interactive: bool, high_water = 10000, low_water = 2000, poll_fast = .1, poll_slow = 1.0,
+                 rx_buffer_size = RX_BUFFER_SIZE):
         threading.Thread.__init__(self)
+        # serial port (pyserial) or network connection (transport): read(), in_waiting, read_until(), write()
         self.serial = serial
+        # device RX buffer size: bytes the streamer keeps in flight (character counting)
+        self.rx_buffer_size = rx_buffer_size
         self.interactive = interactive
 
         # init
+        # input line the status is shown on (None: not attached to a terminal)
         self.grblinput = grblinput
+        self.gcode_buffer = Gcodequeue(Grblbuffer.bec, high_water, low_water)
+        # job progress and throughput
+        self.stats = Grblstats()
+        # blocks in flight (character counting)
+        self.ledger = Grblledger()
+        # ledger entry of the last acknowledged block (None when it was not tracked)
+        self.last_acknowledged = None
         self.init_buffer()
-        self.WCO = {"X" : 0.0, "Y" : 0.0, "Z" : 0.0}
-        self.machinestatus = { "state" : "", "X" : 0.0, "Y" : 0.0, "Z" : 0.0, "Feed" : 0, "Speed" : 0 }
+        self.machinestatus = MachineStatus()
         self.machinesettings = {}
 
         # status report
         self.status_plain = False
+        # last status report (raw), set when a report is received
+        self.status_report = ''
+        self.reported = threading.Event()
+
+        # response channel subscribers
+        self.channels = { channel : [] for channel in Grblbuffer.CHANNELS }
+        self.subscribe(Grblbuffer.ACK, self.report_ack)
+        self.subscribe(Grblbuffer.ERROR, self.report_ack)
+        self.subscribe(Grblbuffer.ERROR, self.report_error)
+        self.subscribe(Grblbuffer.ALARM, self.report_alarm)
+        self.subscribe(Grblbuffer.STATUS, self.report_status)
+        self.subscribe(Grblbuffer.SETTING, self.report_setting)
+        self.subscribe(Grblbuffer.MESSAGE, self.report_message)
+
+        # create and start reader process (the only one reading the serial device)
+        self.grblreader = threading.Thread(target=self.reader)
+        self.grblreader.start()
+
+        # status polling: wake up to poll right away (on new commands)
+        self.poll_now = threading.Event()
 
         # create and start query process
-        self.grblstatus = threading.Thread(target=self.status, args=(.1,))
+        self.grblstatus = threading.Thread(target=self.status, args=(poll_fast, poll_slow))
         self.grblstatus.start()
 
+    @staticmethod
+    def detect_buffers(serial):
+        """
+        ask the device for its buffer sizes (before the reader runs): the build options of '$I' (grbl 1.1, grblHAL),
+        or else the free RX bytes of an 'Idle' status report (that has a 'Bf:' field, grbl setting $10)
+        returns: (RX buffer size, planner blocks, source), (None, None, None) when the device does not report them
+        """
+        serial.write(b"$I\n")
+        # read until the response ends (or the read times out)
+        started = False
+        for _ in range(20):
+            line = serial.read_until().strip()
+            options = Grblbuffer.OPTIONS_PATTERN.match(line)
+            if options:
+                return int(options.group(2)), int(options.group(1)), "$I"
+            if line == b"ok" and not started:
+                # a late 'ok' of the wakeup (on a network link the flush can come before it)
+                continue
+            if not line or line == b"ok" or line.startswith(b"error"):
+                break
+            started = True
+
+        serial.write(b"?")
+        for _ in range(5):
+            line = serial.read_until().strip()
+            if line.startswith(b"<"):
+                status = parse_status(line.decode('ascii', errors = 'replace'))
+                # an idle device has an empty RX buffer (None: not a grbl 1.1 status report), grbl reports one byte
+                # less than its buffer size (a ring buffer keeps one byte free), '$I' reports the size: add it
+                if status is not None and status.state == "Idle" and status.rx_bytes:
+                    return status.rx_bytes + 1, status.planner_blocks, "status report"
+                break
+            if not line:
+                break
+        return None, None, None
+
     def init_buffer(self):
         """
         init buffer
         """
         # reset device buffer count
-        self.gcode_count = 0
-        self.line_count = 0
-        self.serial_buffer_count = []
+        with Grblbuffer.ifc:
+            self.gcode_count = 0
+            self.line_count = 0
+            self.ledger.clear()
+            Grblbuffer.ifc.notify_all()
 
         # initial buffer state: empty
-        self.gcode_buffer = []
+        self.gcode_buffer.clear()
+        # no job
+        self.stats.stop()
 
     def update_machinestatus(self, status):
         """
         set machinestatus info from grbl status (result of grbl '?' command)
         """
-        if status != '':
-            # Sample status report:
-            #   <Idle|MPos:0.000,0.000,-10.000|FS:0,0>
-            #   <Idle|MPos:-2.996,-2.996,0.000|Bf:15,126|FS:0,0|WCO:0.000,0.000,0.000>
-            # Note that 'Real-time Status Reports' are specified here:
-            # 'https://github.com/gnea/grbl/wiki/Grbl-v1.1-Interface'
-            self.machinestatus = {"state" : "Error", "X" : -1.0, "Y" : -1.0, "Z" : -1.0, "Feed" : "-1", "Speed" : "-1"}
-
-            #state = re.search("^<[a-zA-Z]+",status)
-            state = re.search("<[a-zA-Z]+",status)
-            if state:
-                self.machinestatus["state"] = state.group(0)[1:]
-
-            # Get WCO (Work Coordinate Offset)
-            # GRBL documentation:
-            #    GUI Developers: Simply track and retain the last WCO: vector and use the below equation to compute the
-            #    other position vector for your position readouts. If Grbl's status reports show either WPos or MPos,
-            #    just follow the equations below. It's as easy as that!
-            wco = re.search("WCO:[+\-]?[0-9.,+\-]+[\|>]",status)
-            if wco:
-                wco_X = re.search("[+-]?[0-9.+\-]+", wco.group(0))
-                if wco_X:
-                    self.WCO["X"] = float(wco_X.group(0))
-                wco_Y = re.search(",[+-]?[0-9.+\-]+", wco.group(0))
-                if wco_Y:
-                    self.WCO["Y"] = float(wco_Y.group(0)[1:])
-                wco_Z = re.search(",[+-]?[0-9.+\-]+[\|>]", wco.group(0))
-                if wco_Z:
-                    self.WCO["Z"] = float(wco_Z.group(0)[1:-1])
-
-            # always report WPos coordinates
-            mpos = re.search("MPos:[+\-]?[0-9.,+\-]+[\|>]",status)
-            if mpos:
-                # * If MPos: is given, use WPos = MPos - WCO.
-                X = re.search("[+-]?[0-9.+\-]+", mpos.group(0))
-                if X:
-                    self.machinestatus["X"] = float(X.group(0)) - self.WCO["X"]
-                Y = re.search(",[+-]?[0-9.+\-]+", mpos.group(0))
-                if Y:
-                    self.machinestatus["Y"] = float(Y.group(0)[1:]) - self.WCO["Y"]
-                Z = re.search(",[+-]?[0-9.+\-]+[\|>]", mpos.group(0))
-                if Z:
-                    self.machinestatus["Z"] = float(Z.group(0)[1:-1]) - self.WCO["Z"]
-            else:
-                wpos = re.search("WPos:[+\-]?[0-9.,+\-]+[\|>]",status)
-                if wpos:
-                    # always report WPos coordinates
-                    # ( * If WPos: is given, use MPos = WPos + WCO.)
-                    X = re.search("[+-]?[0-9.+\-]+", wpos.group(0))
-                    if X:
-                        # self.machinestatus["X"] = float(X.group(0)) + self.WCO["X"]
-                        self.machinestatus["X"] = float(X.group(0))
-                    Y = re.search(",[+-]?[0-9.+\-]+", wpos.group(0))
-                    if Y:
-                        # self.machinestatus["Y"] = float(Y.group(0)[1:]) + self.WCO["Y"]
-                        self.machinestatus["Y"] = float(Y.group(0)[1:])
-                    Z = re.search(",[+-]?[0-9.+\-]+[\|>]", wpos.group(0))
-                    if Z:
-                        #self.machinestatus["Z"] = float(Z.group(0)[1:-1]) + self.WCO["Z"]
-                        self.machinestatus["Z"] = float(Z.group(0)[1:-1])
-
-            fs = re.search("FS:[0-9,]+",status)
-            if fs:
-                F = re.search("[0-9]+", fs.group(0))
-                if F:
-                    self.machinestatus["Feed"] = F.group(0)
-                S = re.search(",[0-9]+", fs.group(0))
-                if S:
-                    self.machinestatus["Speed"] = S.group(0)[1:]
+        # Sample status report:
+        #   <Idle|MPos:0.000,0.000,-10.000|FS:0,0>
+        #   <Idle|MPos:-2.996,-2.996,0.000|Bf:15,126|FS:0,0|WCO:0.000,0.000,0.000>
+        machinestatus = parse_status(status, self.machinestatus)
+        # ignore broken off reports (keep the last known status)
+        if machinestatus is not None:
+            self.machinestatus = machinestatus
 
     def format_machinestatus(self):
         """
         format machinestatus for printing
         """
-        # machinestatus = { "state" : "", "X" : 0.0, "Y" : 0.0, "Z" : 0.0, "Feed" : 0, "Speed" : 0 }
+        machinestatus = self.machinestatus
         return (
-                    f"[{self.machinestatus['state']:<4} "
-                    f"XYZ:{self.machinestatus['X']:06.3f},{self.machinestatus['Y']:06.3f},{self.machinestatus['Z']:06.3f} "
-                    f"FS:{self.machinestatus['Feed']},{self.machinestatus['Speed']}]"
+                    f"[{machinestatus.state:<4} "
+                    f"XYZ:{machinestatus.X:06.3f},{machinestatus.Y:06.3f},{machinestatus.Z:06.3f} "
+                    f"FS:{machinestatus.feed:g},{machinestatus.speed:g}]"
         )
 
-    def grbl_count_io(self):
+    def subscribe(self, channel, callback):
         """
-        grbl io counting
+        subscribe to a response channel: callback(line) is called (by the reader) for each response on it
         """
-        with Grblbuffer.serialio_lock:
-            while not Grblbuffer.GRBLHUD_EXIT and self.serial.in_waiting:
-                #read
-                out_temp = self.serial.read_until().strip() # Wait for grbl response
-                if out_temp.find(b"ok") < 0 and out_temp.find(b"error") < 0 :
-                    if re.search("<.+", out_temp.decode('ascii')) or re.search(".+>", out_temp.decode('ascii')):
-                        self.update_machinestatus(out_temp.decode('ascii'))
-                        color = ''
-                        # select status color
-                        if "Idle" in self.machinestatus["state"]:
-                            color = Grblbuffer.Green
-                        elif "Hold" in self.machinestatus["state"]:
-                            color = Grblbuffer.IRed
-                        elif "Run" in self.machinestatus["state"]:
-                            color = Grblbuffer.Red
-                        elif "Alarm" in self.machinestatus["state"]:
-                            color = Grblbuffer.IYellow
-                        elif "Sleep" in self.machinestatus["state"]:
-                            color = Grblbuffer.Blue
-                        elif "Door" in self.machinestatus["state"]:
-                            color = Grblbuffer.Cyan
-                        elif "Check" in self.machinestatus["state"]:
-                            color = ''
-
-                        endmarker =  "> " if self.interactive else "#  "
-                        endprompt =  " grbl" if self.interactive else " "
-
-                        prompt_length = len(str(self.buffer_not_empty()) + "|" + self.format_machinestatus() + endmarker + endprompt)
-                        self.grblinput.display_line(str(self.buffer_not_empty()) + "|" + color + self.format_machinestatus() +
-                                                    Grblbuffer.EndCol + endprompt + color + endmarker + Grblbuffer.EndCol, prompt_length)
-
-                        if self.status_plain:
-                            # toggle it
-                            self.status_plain = False
-                            print(out_temp.decode('ascii'), flush=True)
-                    else:
-                        # Ignore all else
-                        # Note that this should not happen, but sometimes, it seems, returns on direct commands are broken off
-                        otds = out_temp.decode('ascii').strip()
-                        if len(otds):
-                            alrm = re.search("ALARM:[1-9][0-9]?",otds)
-                            if alrm and int(alrm.group()[6:]) in grbl_alarm.keys():
-                                otds += " (" + grbl_alarm[int(alrm.group()[6:])] + ")"
-                            else:
-                                # add meaning to settings
-                                # $1=25
-                                setting = re.search("^\$[0-9]+=[0-9]+(\.[0-9]+)?",otds)
-                                if setting:
-                                    setting = re.search("^\$[0-9]+",setting.group())
-                                    if setting and int(setting.group()[1:]) in grbl_settings.keys():
-                                        value = re.search("=[0-9]+(\.[0-9]+)?",otds)
-                                        # save machine settings
-                                        if value:
-                                            self.machinesettings[setting.group()] = value.group()[1:]
-
-                                        otds += " " * ((25 - len(otds)) if len(otds) < 25 else 1)  + "(" + grbl_settings[int(setting.group()[1:])] + ")"
-                            print(otds)
-                else:
-                    # Note: ignore incomming pending ok's until counting is in balance.
-                    # this is needed at startup when the device is in 'Hold' state
-                    if self.serial_buffer_count:            # Delete the block character count corresponding to the last 'ok'
-                        self.gcode_count += 1               # update g-code counter
-                        del self.serial_buffer_count[0]     # Delete the block character count corresponding to the last 'ok'
-                    otds = out_temp.decode('ascii').strip()
-                    if len(otds):
-                        if otds != "ok":
-                            err = re.search("error:[1-9][0-9]?",otds)
-                            if err and int(err.group()[6:]) in grbl_errors.keys():
-                                otds += " (" + grbl_errors[int(err.group()[6:])] + ")"
-                            print(otds)
-
-    def status(self, delay):
-        """
-        write status request to grbl device and get response
-        """
-        print("Status report every", delay, "seconds (WPos coordinates)")
+        self.channels[channel].append(callback)
+
+    def unsubscribe(self, channel, callback):
+        """
+        unsubscribe from a response channel
+        """
+        self.channels[channel].remove(callback)
+
+    def dispatch(self, line):
+        """
+        demultiplex grbl response (raw bytes): pass it to the subscribers of its channel
+        """
+        if line == b"ok":
+            channel = Grblbuffer.ACK
+        elif line.startswith(b'<') or line.endswith(b'>'):
+            # Note that (sometimes, it seems) responses are broken off
+            channel = Grblbuffer.STATUS
+        elif line.startswith(b"error"):
+            channel = Grblbuffer.ERROR
+        elif line.startswith(b"ALARM"):
+            channel = Grblbuffer.ALARM
+        elif Grblbuffer.SETTING_PATTERN.match(line):
+            channel = Grblbuffer.SETTING
+        else:
+            channel = Grblbuffer.MESSAGE
+
+        for callback in self.channels[channel]:
+            callback(line)
+
+    def reader(self):
+        """
+        read grbl responses in bulk, split them in lines and dispatch them
+        """
+        received = bytearray()
+        while not Grblbuffer.GRBLHUD_EXIT:
+            # read all that is waiting, or block (until serial timeout) for the next byte
+            received += self.serial.read(self.serial.in_waiting or 1)
+
+            start = 0
+            end = received.find(b'\n')
+            while end >= 0:
+                line = bytes(received[start:end]).strip()
+                if line:
+                    try:
+                        self.dispatch(line)
+                    except Exception as e:
+                        # a garbled response (or a failing subscriber) must not stop the reader
+                        print(f"Cannot handle response {line!r}: {e!r}", flush = True)
+                start = end + 1
+                end = received.find(b'\n', start)
+            # keep the part of a line received so far
+            del received[:start]
+
+    def report_ack(self, line):
+        """
+        grbl io counting: the device acknowledged the oldest block in its buffer ('ok' or 'error')
+        """
+        with Grblbuffer.ifc:
+            # Note: ignore incomming pending ok's until counting is in balance.
+            # this is needed at startup when the device is in 'Hold' state
+            entry = self.ledger.acknowledged(monotonic(), None if line == b"ok" else line.decode('ascii', errors = 'replace'))
+            self.last_acknowledged = entry
+            if entry is not None:
+                self.gcode_count += 1               # update g-code counter
+                self.stats.ack(len(entry[0]))
+                Grblbuffer.ifc.notify_all()
+
+    def report_error(self, line):
+        """
+        print error, add its meaning
+        """
+        line = line.decode('ascii', errors = 'replace')
+        err = re.search("error:[1-9][0-9]?",line)
+        if err and int(err.group()[6:]) in grbl_errors.keys():
+            line += " (" + grbl_errors[int(err.group()[6:])] + ")"
+        # the block in error (acknowledged just before, see report_ack())
+        if self.last_acknowledged is not None:
+            block, tag, _ = self.last_acknowledged
+            line += (f" at line [{tag}]" + (f" of {self.stats.name}" if self.stats.name else '') if tag is not None else '') + \
+                    ": " + block.decode('ascii', errors = 'replace').strip()
+        self.report_message(line)
+
+    def report_alarm(self, line):
+        """
+        print alarm, add its meaning
+        """
+        line = line.decode('ascii', errors = 'replace')
+        alrm = re.search("ALARM:[1-9][0-9]?",line)
+        if alrm and int(alrm.group()[6:]) in grbl_alarm.keys():
+            line += " (" + grbl_alarm[int(alrm.group()[6:])] + ")"
+        self.report_message(line)
+
+    def report_setting(self, line):
+        """
+        save machine setting, print it and add its meaning
+        """
+        # $1=25
+        setting = Grblbuffer.SETTING_PATTERN.match(line)
+        line = line.decode('ascii', errors = 'replace')
+        if setting and int(setting.group(1)) in grbl_settings.keys():
+            # save machine settings
+            self.machinesettings["$" + setting.group(1).decode()] = setting.group(2).decode()
+
+            line += " " * ((25 - len(line)) if len(line) < 25 else 1)  + "(" + grbl_settings[int(setting.group(1))] + ")"
+        self.report_message(line)
+
+    def report_message(self, line):
+        """
+        print message
+        """
+        if isinstance(line, bytes):
+            line = line.decode('ascii', errors = 'replace')
+        with lineinput.Input.display_lock:
+            print(line, flush = True)
+
+    def report_status(self, line):
+        """
+        update machine status (the status thread shows it, see show_status())
+        """
+        # status reports are shown, so decode them
+        line = line.decode('ascii', errors = 'replace')
+        with Grblbuffer.display_lock:
+            self.update_machinestatus(line)
+            done = self.stats.update(self.machinestatus, len(self.gcode_buffer) + len(self.ledger), self.ledger.bytes)
+            self.status_report = line
+        self.reported.set()
+        if done:
+            # end of job summary
+            self.report_message(self.job_summary())
+
+    def show_status(self):
+        """
+        show the last status report on the input line
+        """
+        if self.grblinput is None:
+            # no input line to show the status on (not attached to a terminal)
+            return
+
+        # do not disturb (main thread) dialogs: wait for them (the streamer holds the lock for a write only)
+        with Grblbuffer.serialio_lock, Grblbuffer.display_lock:
+            color = ''
+            # select status color
+            if "Idle" in self.machinestatus.state:
+                color = Grblbuffer.Green
+            elif "Hold" in self.machinestatus.state:
+                color = Grblbuffer.IRed
+            elif "Run" in self.machinestatus.state:
+                color = Grblbuffer.Red
+            elif "Alarm" in self.machinestatus.state:
+                color = Grblbuffer.IYellow
+            elif "Sleep" in self.machinestatus.state:
+                color = Grblbuffer.Blue
+            elif "Door" in self.machinestatus.state:
+                color = Grblbuffer.Cyan
+            elif "Check" in self.machinestatus.state:
+                color = ''
+
+            endmarker =  "> " if self.interactive else "#  "
+            endprompt =  " grbl" if self.interactive else " "
+
+            # job progress (when a job runs)
+            progress = self.stats.format() + "|" if self.stats.active else ""
+            prompt_length = len(str(self.buffer_not_empty()) + "|" + progress + self.format_machinestatus() + endmarker + endprompt)
+            self.grblinput.display_line(str(self.buffer_not_empty()) + "|" + progress + color + self.format_machinestatus() +
+                                        Grblbuffer.EndCol + endprompt + color + endmarker + Grblbuffer.EndCol, prompt_length)
+
+            if self.status_plain:
+                # toggle it
+                self.status_plain = False
+                print(self.status_report, flush=True)
+
+    def wait_for_message(self, timeout) -> bool:
+        """
+        wait for a message (or alarm) from the grbl device, note that the reader prints it
+        returns: False on timeout
+        """
+        received = threading.Event()
+        def on_message(line):
+            received.set()
+
+        self.subscribe(Grblbuffer.MESSAGE, on_message)
+        self.subscribe(Grblbuffer.ALARM, on_message)
+        try:
+            return received.wait(timeout)
+        finally:
+            self.unsubscribe(Grblbuffer.MESSAGE, on_message)
+            self.unsubscribe(Grblbuffer.ALARM, on_message)
+
+    def status_delay(self, delay, fast, slow):
+        """
+        adapt status polling delay to machine state and streaming load
+        returns: next delay
+        """
+        if (self.machinestatus.state in Grblbuffer.POLL_FAST_STATES or self.buffer_not_empty() or self.ledger):
+            # machine is busy (or about to be)
+            return fast
+        # back off (Idle, Sleep, Alarm, etc.)
+        return min(delay * 2, slow)
+
+    def status(self, fast, slow):
+        """
+        write status request to grbl device and show the response (the reader gets it)
+        """
+        print("Status report every", fast, "to", slow, "seconds (WPos coordinates)")
+        delay = fast
         while not Grblbuffer.GRBLHUD_EXIT:
+            polled = monotonic()
             if not Grblbuffer.STATUS_PAUZE:
+                self.reported.clear()
                 with Grblbuffer.serialio_lock:
                     # write direct command '?'
                     self.serial.write("?".encode())
-                # read result
-                self.grbl_count_io()
-            sleep(delay)
+                # show the report (the reader gets it)
+                if self.reported.wait(delay):
+                    self.show_status()
+            if self.poll_now.wait(max(polled + delay - monotonic(), 0)):
+                # command issued, poll fast again
+                self.poll_now.clear()
+                delay = fast
+            else:
+                delay = self.status_delay(delay, fast, slow)
         print("Status report exit")
 
     def buffer_not_empty(self) -> int:
         """
-       	check if gcode buffer has elements
-        returns: 0 if buffer empty, buffer length if not
+       	check if gcode buffer has elements (or a source to pull them from)
+        returns: 0 if buffer empty, buffer length (at least 1 when there is a source) if not
+        """
+        return len(self.gcode_buffer) or int(self.gcode_buffer.source is not None)
+
+    def start_job(self, total, name = ''):
+        """
+       	start job 'name' of 'total' units (see Grblstats), profile the latency of its blocks
+        """
+        self.stats.start(total, name)
+        self.ledger.profile(name)
+
+    def job_summary(self) -> str:
+        """
+       	statistics of the current (or last) job
+        """
+        return self.stats.summary() + "\n" + self.ledger.summary()
+
+    def source_active(self) -> bool:
+        """
+       	check if job lines are pulled from a source (a run)
         """
-        return len(self.gcode_buffer)
+        return self.gcode_buffer.source is not None
+
+    @staticmethod
+    def encode(line) -> bytes:
+        """
+       	encode gcode line to a block as it is sent to the device (an empty line stays empty)
+        """
+        return (line.strip() + '\n').encode() if line != '' else b''
 
     def put(self, line, prepend=False):
         """
        	put gcode on buffer
         """
-        with Grblbuffer.bec:
-            if not self.buffer_not_empty():
-                Grblbuffer.bec.notify()
-            if prepend:
-                # put line at the start of the queue (first served/prioritized)
-                self.gcode_buffer = [line] + self.gcode_buffer
-            else:
-                # put line at the end of the queue (last served)
-                self.gcode_buffer.append(line)
+        self.gcode_buffer.put(Grblbuffer.encode(line), prepend)
+        self.poll_now.set()
+
+    def put_many(self, lines, tags = None):
+        """
+       	put gcode lines (and their tags: source lines) on buffer (at the end, in one go)
+        """
+        self.gcode_buffer.put_many(map(Grblbuffer.encode, lines), tags)
+        self.poll_now.set()
+
+    def put_source(self, lines):
+        """
+       	put gcode lines on buffer lazily: lines (iterator of (tag, line) tuples) are pulled (at the end) as the buffer drains
+        """
+        self.gcode_buffer.set_source((tag, Grblbuffer.encode(line)) for tag, line in lines)
+        self.poll_now.set()
+
+    def wait_for_room(self, timeout = None) -> bool:
+        """
+       	wait until the buffer can take more (job) lines
+        returns: False on timeout
+        """
+        return self.gcode_buffer.wait_for_room(timeout)
 
     def get(self):
         """
        	get gcode from buffer
+        returns: (tag, block)
         """
         # get first line put onto the queue
-        line = ''
-        with Grblbuffer.bec:
-            Grblbuffer.bec.wait_for(self.buffer_not_empty)
-
-            line = self.gcode_buffer[0]
-            del self.gcode_buffer[0]
-        return line
+        return self.gcode_buffer.get()
 
     # override run message
     def run(self):
@@ -298,14 +512,15 @@ class Grblbuffer(threading.Thread):
         """
         print("Start command queue")
         while not Grblbuffer.GRBLHUD_EXIT:
-            line = self.get()
-            self.grbl_buffer(line)
+            tag, block = self.get()
+            self.grbl_buffer(block, tag)
         print("End command queue")
 
-    def grbl_buffer(self, line):
+    def grbl_buffer(self, block, tag = None):
         """
-       	grbl device buffer: write gcode (block), or wait until space available
-	also, handle grbl device results
+       	grbl device buffer: write gcode (encoded block, tag: its source line), or wait until space available
+	(grbl device results are handled by the reader)
+        Queued blocks that fit the device buffer as well are written along with it (in one write).
         """
         # Send g-code program via a more agressive streaming protocol that forces characters into
         # Grbl's serial read buffer to ensure Grbl has immediate access to the next g-code command
@@ -313,19 +528,34 @@ class Grblbuffer(threading.Thread):
         # counting of the number of characters sent by the streamer to Grbl and tracking Grbl's
         # responses, such that we never overflow Grbl's serial read buffer.
 
-        if line != '':
-            with Grblbuffer.serialio_lock:
+        if block == b'':
+            return
+
+        with Grblbuffer.ifc:
+            # wait for the device to acknowledge blocks (the reader signals 'ok's) until the block fits
+            # (a block that does not fit an empty device buffer is sent when nothing is in flight)
+            while not Grblbuffer.GRBLHUD_EXIT and self.ledger and self.ledger.bytes + len(block) >= self.rx_buffer_size-1:
+                Grblbuffer.ifc.wait(Grblbuffer.RESPONSE_WAIT)
+            room = self.rx_buffer_size - 2 - self.ledger.bytes - len(block)
+
+        # coalesce: take queued blocks as long as they fit the device buffer as well (not holding ifc, see the lock
+        # order; the room only grows meanwhile, as the streamer is the only one that adds blocks in flight)
+        blocks = [(tag, block)]
+        while room > 0:
+            queued = self.gcode_buffer.get_fitting(room)
+            if queued is None:
+                break
+            if queued[1]:
+                blocks.append(queued)
+                room -= len(queued[1])
+
+        with Grblbuffer.ifc:
+            # Track the characters in grbl serial read buffer (and the blocks, their source line and send time)
+            now = monotonic()
+            for tag, block in blocks:
                 self.line_count += 1 # Iterate line counter
-                l_block = line.strip()
-                self.serial_buffer_count.append(len(l_block)+1) # Track number of characters in grbl serial read buffer
-
-        while not Grblbuffer.GRBLHUD_EXIT and ((sum(self.serial_buffer_count) >= Grblbuffer.RX_BUFFER_SIZE-1) or self.serial.in_waiting):
-            self.grbl_count_io()
-
-        if line != '':
-            with Grblbuffer.serialio_lock:
-                # check for special characters not needing a nl
-                l_blockn = l_block + '\n'
-                self.serial.write(l_blockn.encode()) # Send g-code block to grbl
-
+                self.ledger.sent(block, tag, now)
+        blocks = [block for _, block in blocks]
 
+        with Grblbuffer.serialio_lock:
+            self.serial.write(b''.join(blocks)) # Send g-code block(s) to grbl
@@ -9,14 +9,20 @@ import sys
 import re
 from time import sleep
 from argparse import Namespace
-# needs pyserial!
-import serial
 
 from inputimeout import inputimeout, TimeoutOccurred
 from grblhud import lineinput
 from grblhud.grblbuffer import Grblbuffer
+from grblhud.gcodefilter import create_filters, filter_chain
+from grblhud.gcodefile import Gcodefile
+from grblhud.gcodecache import Gcodecache
+from grblhud.gcodeextents import program_extents, extents_text, format_coordinate
+from grblhud.gcoderun import Gcoderun
+from grblhud.gcodefile import NUMPY
+from grblhud.gcodeestimate import Gcodeestimate
 from grblhud.grblmessages import grbl_alarm
 from grblhud.unblockedgetch import UnblockedGetch
+from grblhud.transport import open_transport
 from grblhud.lineinput import Input
 
 GCODE2IMAGE = True
@@ -32,10 +38,66 @@ SERIALDEVICE = ''
 NO_OF_LINES_SHOWN = 40
 
 GRBLHUDCOMMANDS = [ "help", "exit", "OS", "os", "stream", "load", "run", "listgcode", "showgcode", "setLOOP", "setloop", "S+", "S-",
-                    "F+", "F-", "softstop", "softreset", "hardreset", "sleep", "Zprobe", "zprobe", "origin", "Bbox", "bbox", "Stoggle", "stoggle" ]
+                    "F+", "F-", "softstop", "softreset", "hardreset", "sleep", "Zprobe", "zprobe", "origin", "Bbox", "bbox", "Stoggle", "stoggle",
+                    "filter", "estimate", "stats" ]
 
 gcode_pattern = "^ *(G0|G1|X|Y|M4|M3|M5|M2|S|F|;|\$|~|!|\?)"
 
+def load_filters(args, machinesettings):
+    """
+    gcode (pre)processing stages of 'load' and 'stream'
+    """
+    # arc fitting takes the arc tolerance of the machine into account (grbl default is 0.002 mm)
+    return create_filters(compact = args.compact, simplify = args.simplify, raster = args.raster, arcs = args.arcs,
+                          arc_tolerance = float(machinesettings.get("$12", .002)))
+
+def load_settings(args, machinesettings) -> str:
+    """
+    settings that change a loaded program (part of its cache key)
+    """
+    return f"compact {args.compact} simplify {args.simplify} raster {args.raster} arcs {args.arcs} " \
+           f"arc_tolerance {float(machinesettings.get('$12', .002)) if args.arcs else 0}"
+
+def run_preview(blocks):
+    """
+    show the first blocks of a run (blocks: Gcoderun)
+    """
+    for nbr_of_lines, (pc, line) in enumerate(blocks):
+        if nbr_of_lines == NO_OF_LINES_SHOWN:
+            print("    ...\n    ...\n")
+            break
+        print("<  >\t" if pc is None else "<" + str(pc) + ">\t", line, end = '')
+
+def watch_run(grblbuffer, name):
+    """
+    show run progress while the run engine produces blocks, check keypress (to be able abort)
+    returns: True when the run is aborted
+    """
+    getch_nowait = UnblockedGetch().getch_nowait
+    print("Press <anykey> to abort!\n")
+    try:
+        while grblbuffer.source_active():
+            sleep(.5)
+            with Grblbuffer.serialio_lock:
+                print("\033[A" + '\r' + Input.ERASE_TO_EOL + "Run", grblbuffer.line_count, "blocks ...", flush = True)
+                if getch_nowait() != '':
+                    sr = input(f"Abort run of {name} (yes/no)? ")
+                    if sr.find("yes") >= 0:
+                        print(f"run of {name} aborted!")
+                        break
+                    else:
+                        print("\n")
+        else:
+            return False
+    except KeyboardInterrupt:
+        print(f"run of {name} aborted!")
+    print("Issued softstop (purged command buffer)")
+    # purge buffer
+    grblbuffer.init_buffer()
+    # end grbl program (switch laser off)
+    grblbuffer.serial.write("M2\n".encode())
+    return True
+
 def count_321():
     """
     Countdown
@@ -114,21 +176,41 @@ def machine_init(ser):
     # flush input (stray 'ok's may ruin strict block counting)
     ser.reset_input_buffer()
 
-def machine_open(device):
+def machine_buffer(ser, rx_buffer_size) -> int:
+    """
+    RX buffer size of the device: 'rx_buffer_size' when it is set (not 0), else as the device reports it
     """
-    Open serial (grbl) device
+    if rx_buffer_size:
+        print("Device RX buffer:", rx_buffer_size, "bytes (set)")
+        return rx_buffer_size
+    size, blocks, source = Grblbuffer.detect_buffers(ser)
+    # flush input (the rest of the responses)
+    ser.reset_input_buffer()
+    if size is None or size < 16:
+        print("Device RX buffer:", Grblbuffer.RX_BUFFER_SIZE, "bytes (not reported by the device, set 'rx_buffer_size' when it differs)")
+        return Grblbuffer.RX_BUFFER_SIZE
+    print("Device RX buffer:", size, "bytes" + (f", planner: {blocks} blocks" if blocks else '') + f" (from {source})")
+    return size
+
+def machine_open(device, baud = 115200):
+    """
+    Open serial (grbl) device (or its network connection: tcp://, telnet://, unix://)
     """
     global SERIALDEVICE
     ser = None
     while True:
         # try open serial device (grlb)
         try:
-            ser = serial.Serial(port = device, baudrate = 115200, timeout = .5)
-            print("Opened serial port", device, "at 115200 bauds (bits/s)")
+            ser = open_transport(device, baud)
+            if ser.baudrate:
+                print("Opened serial port", device, "at", ser.baudrate, "bauds (bits/s)")
+            else:
+                print("Connected to", device)
             SERIALDEVICE = device
             break
-        except serial.SerialException:
-            print("Cannot open serial port", device)
+        except OSError as e:
+            # (serial.SerialException is an OSError)
+            print("Cannot open serial port", device, f"({e})" if "://" in device else '')
             filenames = next(os.walk("/dev"))[2]
 
             # get known serial device names (linux(es), macos, macold):
@@ -174,16 +256,18 @@ def grblhudloop(args):
                 # <Ctrl><D>
                 Grblbuffer.STATUS_PAUZE = True
 
+                # stop first (a realtime command), wait until it is sent
+                grblbuffer.serial.write(b'\x84')
+                ser.flush()
+                print("FULL STOP")
+
                 # flush input/output
                 ser.reset_input_buffer()
                 ser.reset_output_buffer()
 
-                print("FULL STOP")
-                grblbuffer.serial.write(b'\x84')
-
-                # get response
+                # get response (the reader prints it)
                 # Wait for grbl to initialize and print startup text (if any)
-                wait_for_it(ser)
+                grblbuffer.wait_for_message(1)
 
                 # flush input/output
                 ser.reset_input_buffer()
@@ -197,6 +281,7 @@ def grblhudloop(args):
             print("Wait for program exit ....")
             Grblbuffer.GRBLHUD_EXIT = True
             grblbuffer.grblstatus.join()
+            grblbuffer.grblreader.join()
             # put something to get run loop out of waiting
             grblbuffer.put(";")
             grblbuffer.join()
@@ -210,8 +295,14 @@ def grblhudloop(args):
             print(" - exit                                              (exit grblhud)")
             print(" - OS <Unix command>                                 (run a Unix command)")
             print(" - stream <filename>                                 (stream file 'directly' to the machine (Note that WHILE loops, F and S settings are not possible)")
-            print(" - load <filename>                                   (load file to buffer)")
+            print(" - load <filename>                                   (load file to buffer, shows its bounding box and the extents of its moves")
+            print("                                                     in work coordinates, G92 applied, G54-G59 offsets not)")
             print(" - run [LOOP] [F<eed>] [S<pindlepeed/power>]         (run file or LOOP from buffer, and possibly set F and/or S for this run)")
+            print(" - estimate [F<eed>] [O<verride %>]                  (estimate the run time of the loaded file, possibly set F and/or a feed override, needs numpy)")
+            print(" - stats [latency|trace <file>]                      (statistics of the current or last job: throughput, planner starvation,")
+            print("                                                     block latency histogram or export of the block latencies (csv))")
+            print(" - filter [compact|simplify|arcs <value>|off]        (show or set gcode (pre)processing of load, run and stream)")
+            print(" - filter [raster on|off]                            (merge laser raster moves of the same power on load and stream)")
             print(" - listgcode [<pcstart> [<pcend>]]                   (gcode listing, possibly set start [end] lines (for large files)")
             print(" - showgcode                                         (show image of the current gcode file (must be in the working directory))")
             print(" - setLOOP <loopname> <count> <pcstart> <pcend>      (set a WHILE LOOP)")
@@ -248,10 +339,9 @@ def grblhudloop(args):
 
         if line == 'softstop':
             with Grblbuffer.serialio_lock:
-                with Grblbuffer.bec:
-                    print("Issued softstop (purged command buffer)")
-                    # purge buffer
-                    grblbuffer.init_buffer()
+                print("Issued softstop (purged command buffer)")
+                # purge buffer
+                grblbuffer.init_buffer()
                 # end grbl program (switch laser off)
                 grblbuffer.serial.write("M2\n".encode())
             return False
@@ -270,8 +360,8 @@ def grblhudloop(args):
                     # send softreset to device
                     ser.write(b'\x18')
 
-                    # get response
-                    wait_for_it(ser)
+                    # get response (the reader prints it)
+                    grblbuffer.wait_for_message(2)
 
                     # flush input/output (stray 'ok's may ruin strict block counting)
                     ser.reset_input_buffer()
@@ -290,6 +380,7 @@ def grblhudloop(args):
                 # close grblstatus loop and Grblbuffer
                 Grblbuffer.GRBLHUD_EXIT = True
                 grblbuffer.grblstatus.join()
+                grblbuffer.grblreader.join()
                 # put someting to get run loop out of waiting
                 grblbuffer.put(";")
                 grblbuffer.join()
@@ -299,14 +390,16 @@ def grblhudloop(args):
                 sleep(.5)
 
                 # open serial port (and device)
-                ser = machine_open(args.serial if SERIALDEVICE == '' else SERIALDEVICE)
+                ser = machine_open(args.serial if SERIALDEVICE == '' else SERIALDEVICE, args.baud)
                 machine_init(ser)
+                rx_buffer_size = machine_buffer(ser, args.rx_buffer_size)
 
                 # enable run
                 Grblbuffer.GRBLHUD_EXIT = False
                 # instantiate and run buffer thread (serial io to/from grbl device)
                 with Grblbuffer.serialio_lock:
-                    grblbuffer = Grblbuffer(ser, grblinput, False if args.gcode else True)
+                    grblbuffer = Grblbuffer(ser, grblinput, False if args.gcode else True, args.high_water, args.low_water, args.poll_fast, args.poll_slow,
+                                            rx_buffer_size)
                     sleep(1)
                 grblbuffer.start()
             return False
@@ -315,19 +408,19 @@ def grblhudloop(args):
             with Grblbuffer.serialio_lock:
                 Grblbuffer.STATUS_PAUZE = True
                 # check machine state
-                if grblbuffer.machinestatus["state"] != "Hold":
+                if grblbuffer.machinestatus.state != "Hold":
                     print("machinestate must be 'Hold' to toggle Spindle")
                 else:
                     print("Spindle On/Off ")
                     grblbuffer.serial.write(b'\x9E') # 0x9E:ToggleSpindleStop
 
-                    # get response
-                    wait_for_it(ser)
+                    # get response (the reader prints it)
+                    grblbuffer.wait_for_message(1)
                 Grblbuffer.STATUS_PAUZE = False
             return False
 
         if line == "sleep":
-            if grblbuffer.machinestatus["state"] != "Idle":
+            if grblbuffer.machinestatus.state != "Idle":
                 print("machinestate must be 'Idle' to be able to sleep")
             else:
                 with Grblbuffer.serialio_lock:
@@ -335,13 +428,30 @@ def grblhudloop(args):
                     grblbuffer.serial.write("$SLP\n".encode())     # $SLP: zzzz
             return False
 
+        if re.search("^filter", line):
+            # gcode (pre)processing: 'filter [compact|simplify|arcs <value>|off]' or 'filter [raster on|off]'
+            setting = re.search("^filter +(compact|simplify|arcs) +([0-9]*\.?[0-9]+|off)$", line)
+            switch = re.search("^filter +(raster) +(on|off)$", line)
+            if setting:
+                setattr(args, setting.group(1), 0 if setting.group(2) == "off" else float(setting.group(2)))
+            elif switch:
+                setattr(args, switch.group(1), 1 if switch.group(2) == "on" else 0)
+            elif line != "filter":
+                print("filter syntax error. Format: 'filter [compact|simplify|arcs <value>|off]' or 'filter [raster on|off]'")
+                return False
+            print("gcode (pre)processing:")
+            print("    raster (load, stream):       ", "on (merge scanline moves of the same power)" if args.raster else "off")
+            print("    arcs (load, stream):         ", f"{args.arcs} mm (max deviation, arc tolerance $12 is "
+                                                        f"{grblbuffer.machinesettings.get('$12', 'unknown: use 0.002')})" if args.arcs else "off")
+            print("    simplify (load, stream):     ", f"{args.simplify} mm (tolerance)" if args.simplify else "off")
+            print("    compact (load, run, stream): ", f"{args.compact} mm (coordinate resolution)" if args.compact else "off")
+            return False
+
         if re.search("^load +[^<>:;,*|\"]+$", line):
             # load file: 'load <filename>'
             filePath = line[line.find(' ') + 1:]
             try:
                 with open(filePath, "r") as f:
-                    gcodeFile = { "name" : "", "bBox" : "", "buffer" : [], "WHILE" : {} }
-                    gcodeFile["name"] = os.path.basename(filePath)
                     abort = False
 
                     with Grblbuffer.serialio_lock:
@@ -349,19 +459,22 @@ def grblhudloop(args):
                         print("Load file into memory buffer - wait for it to complete!\nPress <anykey> to abort!")
                         sr = input(f"Load file {filePath} (yes/no)? ")
 
-                    if sr.find("yes") >= 0:
+                    if sr.find("yes") >= 0 and grblbuffer.source_active():
+                        print("A program is running, wait for it to complete (or use 'softstop') before loading a file!")
+                    elif sr.find("yes") >= 0:
+                        # release the current file
+                        if isinstance(gcodeFile["buffer"], Gcodefile):
+                            gcodeFile["buffer"].close()
+                        gcodeFile = { "name" : os.path.basename(filePath), "bBox" : "", "buffer" : [], "WHILE" : {}, "extents" : None }
                         print("Loading file", gcodeFile["name"], "into memory buffer ...\n")
                         getch_nowait = UnblockedGetch().getch_nowait
-                        # for line in f:
-                        for i, line in enumerate(f):
-                            try:
-                                if i < NO_OF_LINES_SHOWN:
-                                    print("[" + str(i) + "]\t", line, end = '')
 
-                                if i == NO_OF_LINES_SHOWN:
-                                    print("    ...\n    ...\n")
-
-                                # check keypress every 1000 lines (to be able abort)
+                        def load_progress(lines):
+                            """
+                            pass lines, check keypress every 1000 lines (to be able abort)
+                            """
+                            nonlocal abort
+                            for i, line in enumerate(lines):
                                 if i and i % 1000 == 0:
                                     with Grblbuffer.serialio_lock:
                                         sleep(.02)
@@ -371,88 +484,134 @@ def grblhudloop(args):
                                             if sr.find("yes") >= 0:
                                                 print(f"load of file {filePath} aborted!")
                                                 abort = True
-                                                break
+                                                return
                                             else:
                                                 print("\n")
+                                yield line
+
+                        # the file is memory mapped and indexed, lines are only read when they are listed or run
+                        # (processed lines are written to a temporary file first)
+                        filters = load_filters(args, grblbuffer.machinesettings)
+                        # an unchanged file (loaded with the same settings) is taken from the cache
+                        cached = None
+                        if gcodeCache:
+                            try:
+                                cacheKey = gcodeCache.key(filePath, load_settings(args, grblbuffer.machinesettings))
+                                cached = gcodeCache.get(cacheKey, filePath)
+                            except OSError:
+                                cacheKey = None
+                        try:
+                            if cached:
+                                gcodeFile["buffer"], info = cached
+                                gcodeFile["bBox"] = info["bBox"]
+                                gcodeFile["WHILE"] = info["WHILE"]
+                                gcodeFile["extents"] = info["extents"]
+                                print("(from cache)")
+                            elif filters:
+                                gcodeFile["buffer"] = Gcodefile.from_lines(load_progress(line for tag, line in filter_chain(enumerate(f), filters)))
+                            else:
+                                gcodeFile["buffer"] = Gcodefile.open(filePath)
+                        except KeyboardInterrupt:
+                            print(f"load of file {filePath} aborted!")
+                            abort = True
+                        except (OSError, MemoryError) as e:
+                            print(f"Cannot load file {filePath} ({e})! Load aborted!")
+                            abort = True
 
-                                # get bbox if any
-                                # find line like: '; Boundingbox: (X7.231380,Y8.677330) to (X78.658588,Y24.579710)'
-                                if line.find("Boundingbox:") >= 0:
-                                    gcodeFile["bBox"] = line[line.find("Boundingbox:") + len("Boundingbox:"):].strip()
-
-                                #    #100 = 1
-                                #    WHILE [#100 LE 5] DO1
-                                #    (Some G-Code Blocks Go Here to Be Repeated Each Loop)
-                                #    #100 = #100 + 1 (Increase #100 by 1 each iteration of the loop)
-                                #    END1
-
-                                # Simulate gcode WHILE DO instructions (above) like this:
-                                #    ; WHILE <count> <loopname>' example: '; WHILE 23 aloop123'
-                                #    (Some G-Code Blocks Go Here to Be Repeated Each Loop)
-                                #    ; DO <loopname>' example: '; DO aloop123'
-                                #
-                                # Note that this is an annotation (quoted out so the grbl controller does not see it)
-                                # Note also that loopnames are all lowercase! And have a number (if any) at the end:
-                                # in regex '[a-z]+[0-9]*'
-
-                                # get while loop info
-                                if line.find("; WHILE") >= 0:
-                                    # WHILE format: '; WHILE <int> <loopname>' example: '; WHILE 23 Aloop123'
-                                    # save buffer start index for this while (should be a loop name)
-                                    while_loopname = re.search(" [a-z]+[0-9]*",line)
-                                    if not while_loopname:
-                                        print("Missing loopname of '; WHILE' statement, abort load!")
-                                        abort = True
-                                        break
-                                    while_loopname = while_loopname.group()[1:]
-                                    while_count = re.search(" [0-9]+",line)
-                                    if not while_count:
-                                        print("Missing loop count of '; WHILE' statement, abort load!")
-                                        abort = True
-                                        break
-                                    while_count = int(while_count.group()[1:])
-                                    gcodeFile["WHILE"][while_loopname] = {"pcstart" : i+1, "pcend" : 0, "count" : while_count }
-                                elif line.find("; DO") >= 0:
-                                    # do format: '; DO <loopname>' example: '; DO Aloop123'
-                                    do_loopname = re.search(" [a-z]+[0-9]*",line)
-                                    if not do_loopname:
-                                        print("Missing loopname of '; DO' statement, abort load!")
-                                        abort = True
-                                        break
-                                    do_loopname = do_loopname.group()[1:]
-                                    # find corresponding 'WHILE DO' save buffer 'end' index for this
-                                    if do_loopname in gcodeFile["WHILE"]:
-                                        gcodeFile["WHILE"][do_loopname]["pcend"] = i-1
-                                        # check loop overlap
-                                        for loop in gcodeFile['WHILE']:
-                                            if gcodeFile['WHILE'][loop]['pcend'] == 0 and \
-                                               gcodeFile['WHILE'][loop]['pcstart'] > gcodeFile["WHILE"][do_loopname]["pcstart"]:
-                                                print("WHILE loops '" + loop + "' and '" + do_loopname + "' overlap!, abort load.")
-                                                abort = True
-                                                break
-                                        if abort:
+                        if not abort:
+                            for i, line in enumerate(gcodeFile["buffer"].lines(0, NO_OF_LINES_SHOWN)):
+                                print("[" + str(i) + "]\t", line, end = '')
+                            if len(gcodeFile["buffer"]) > NO_OF_LINES_SHOWN:
+                                print("    ...\n    ...\n")
+
+                        #    #100 = 1
+                        #    WHILE [#100 LE 5] DO1
+                        #    (Some G-Code Blocks Go Here to Be Repeated Each Loop)
+                        #    #100 = #100 + 1 (Increase #100 by 1 each iteration of the loop)
+                        #    END1
+
+                        # Simulate gcode WHILE DO instructions (above) like this:
+                        #    ; WHILE <count> <loopname>' example: '; WHILE 23 aloop123'
+                        #    (Some G-Code Blocks Go Here to Be Repeated Each Loop)
+                        #    ; DO <loopname>' example: '; DO aloop123'
+                        #
+                        # Note that this is an annotation (quoted out so the grbl controller does not see it)
+                        # Note also that loopnames are all lowercase! And have a number (if any) at the end:
+                        # in regex '[a-z]+[0-9]*'
+
+                        # find annotations (in file order)
+                        annotations = [] if abort or cached else gcodeFile["buffer"].find_all("Boundingbox:", "; WHILE", "; DO")
+                        for i, line in annotations:
+                            # get bbox if any
+                            # find line like: '; Boundingbox: (X7.231380,Y8.677330) to (X78.658588,Y24.579710)'
+                            if line.find("Boundingbox:") >= 0:
+                                gcodeFile["bBox"] = line[line.find("Boundingbox:") + len("Boundingbox:"):].strip()
+
+                            # get while loop info
+                            if line.find("; WHILE") >= 0:
+                                # WHILE format: '; WHILE <int> <loopname>' example: '; WHILE 23 Aloop123'
+                                # save buffer start index for this while (should be a loop name)
+                                while_loopname = re.search(" [a-z]+[0-9]*",line)
+                                if not while_loopname:
+                                    print("Missing loopname of '; WHILE' statement, abort load!")
+                                    abort = True
+                                    break
+                                while_loopname = while_loopname.group()[1:]
+                                while_count = re.search(" [0-9]+",line)
+                                if not while_count:
+                                    print("Missing loop count of '; WHILE' statement, abort load!")
+                                    abort = True
+                                    break
+                                while_count = int(while_count.group()[1:])
+                                gcodeFile["WHILE"][while_loopname] = {"pcstart" : i+1, "pcend" : 0, "count" : while_count }
+                            elif line.find("; DO") >= 0:
+                                # do format: '; DO <loopname>' example: '; DO Aloop123'
+                                do_loopname = re.search(" [a-z]+[0-9]*",line)
+                                if not do_loopname:
+                                    print("Missing loopname of '; DO' statement, abort load!")
+                                    abort = True
+                                    break
+                                do_loopname = do_loopname.group()[1:]
+                                # find corresponding 'WHILE DO' save buffer 'end' index for this
+                                if do_loopname in gcodeFile["WHILE"]:
+                                    gcodeFile["WHILE"][do_loopname]["pcend"] = i-1
+                                    # check loop overlap
+                                    for loop in gcodeFile['WHILE']:
+                                        if gcodeFile['WHILE'][loop]['pcend'] == 0 and \
+                                           gcodeFile['WHILE'][loop]['pcstart'] > gcodeFile["WHILE"][do_loopname]["pcstart"]:
+                                            print("WHILE loops '" + loop + "' and '" + do_loopname + "' overlap!, abort load.")
+                                            abort = True
                                             break
-                                    else:
-                                        print("WHILE info isn't consistent: cannot find WHILE label '" + do_loopname + "'!, abort load!" )
-                                        abort = True
+                                    if abort:
                                         break
+                                else:
+                                    print("WHILE info isn't consistent: cannot find WHILE label '" + do_loopname + "'!, abort load!" )
+                                    abort = True
+                                    break
 
-                                gcodeFile["buffer"].append(line)
-                            except KeyboardInterrupt:
-                                print(f"load of file {filePath} aborted!")
-                                abort = True
-                                break
-                            except MemoryError:
-                                print(f"Out of memory! Load of file {filePath} aborted!")
-                                abort = True
-                                break
+                        if not abort and not cached:
+                            # extents of all moves, the bounding box when the file has no 'Boundingbox:' annotation
+                            extents = program_extents(gcodeFile["buffer"])
+                            gcodeFile["extents"] = extents.extents()
+                            if not gcodeFile["bBox"]:
+                                gcodeFile["bBox"] = extents_text(extents)
 
                         if abort:
                             # clear buffer info
-                            gcodeFile = { "name" : "", "bBox" : "", "buffer" : [], "WHILE" : {} }
+                            if isinstance(gcodeFile["buffer"], Gcodefile):
+                                gcodeFile["buffer"].close()
+                            gcodeFile = { "name" : "", "bBox" : "", "buffer" : [], "WHILE" : {}, "extents" : None }
                         else:
+                            summaries = info["summaries"] if cached else [stage.summary() for stage in filters]
+                            if gcodeCache and cacheKey and not cached:
+                                gcodeCache.put(cacheKey, gcodeFile["buffer"], { "bBox" : gcodeFile["bBox"], "WHILE" : gcodeFile["WHILE"],
+                                               "extents" : gcodeFile["extents"], "summaries" : summaries,
+                                               "size" : gcodeFile["buffer"].size }, processed = bool(filters))
                             # give load summary
                             print("File loaded", len(gcodeFile["buffer"]) - 1, "lines, Bbox:", gcodeFile["bBox"] if gcodeFile["bBox"] else "none")
+                            if gcodeFile["extents"]:
+                                print("Extents (all moves, work coordinates):", ", ".join(axis + ": " + (format_coordinate(low) + " to " + format_coordinate(high)
+                                      if low is not None else "none") for axis, low, high in zip("XYZ", *gcodeFile["extents"])))
                             if gcodeFile["WHILE"]:
                                 print("Detected the following loop(s):")
                                 for loop in gcodeFile['WHILE']:
@@ -460,6 +619,8 @@ def grblhudloop(args):
                                     print("    " + loop + ": ", gcodeFile['WHILE'][loop]['count'], " X [", gcodeFile['WHILE'][loop]['pcstart'],
                                           "]-[", gcodeFile['WHILE'][loop]['pcend'], "]", sep = '')
                                 print("    (Note that loops can be run separately using 'run LOOP <loopname> [F<feed>] [S<speed>]')\n")
+                            for summary in summaries:
+                                print(summary)
 
                     Grblbuffer.STATUS_PAUZE = False
 
@@ -469,7 +630,7 @@ def grblhudloop(args):
 
         if re.search("^stream +[^<>:;,*|\"]+$", line):
             # stream file: 'stream <filename>'
-            if grblbuffer.machinestatus["state"] != "Idle":
+            if grblbuffer.machinestatus.state != "Idle":
                 print("machinestate must be 'Idle' to stream a file to the machine")
                 return False
             filePath = line[line.find(' ') + 1:]
@@ -489,8 +650,15 @@ def grblhudloop(args):
                         if not args.gcode:
                             print("streaming file to machine ...\n")
                         getch_nowait = UnblockedGetch().getch_nowait
+                        # gcode (pre)processing
+                        filters = load_filters(args, grblbuffer.machinesettings)
+                        # lines (and their source lines) are put on the buffer in batches
+                        batch = []
+                        tags = []
+                        # progress is measured in characters read
+                        grblbuffer.start_job(os.path.getsize(filePath), os.path.basename(filePath))
                         # for line in f:
-                        for i, line in enumerate(f):
+                        for i, (tag, line) in enumerate(filter_chain(grblbuffer.stats.counted(enumerate(f), len), filters)):
                             try:
                                 if not args.gcode:
                                     if i < NO_OF_LINES_SHOWN:
@@ -501,20 +669,31 @@ def grblhudloop(args):
 
                                 # check keypress every 1000 lines (to be able abort)
                                 if i and i % 1000 == 0:
-                                    with Grblbuffer.serialio_lock:
-                                        sleep(.02)
-                                        #print("\033[ALoaded", i, "lines ...", flush = True)
-                                        print("\033[A" + '\r' + Input.ERASE_TO_EOL + "Loaded", i, "lines ...", flush = True)
-                                        if getch_nowait() != '':
-                                            sr = input(f"Abort stream {filePath} (yes/no)? ")
-                                            if sr.find("yes") >= 0:
-                                                print(f"Stream aborted!")
-                                                abort = True
-                                                break
-                                            else:
-                                                print("\n")
+                                    grblbuffer.put_many(batch, tags)
+                                    batch = []
+                                    tags = []
+                                    wait = True
+                                    while wait:
+                                        # block when the buffer is filled up to the high water mark (until it is drained
+                                        # to the low water mark), but keep checking keypresses while waiting
+                                        wait = not grblbuffer.wait_for_room(.5)
+                                        with Grblbuffer.serialio_lock:
+                                            sleep(.02)
+                                            #print("\033[ALoaded", i, "lines ...", flush = True)
+                                            print("\033[A" + '\r' + Input.ERASE_TO_EOL + "Loaded", i, "lines ...", flush = True)
+                                            if getch_nowait() != '':
+                                                sr = input(f"Abort stream {filePath} (yes/no)? ")
+                                                if sr.find("yes") >= 0:
+                                                    print(f"Stream aborted!")
+                                                    abort = True
+                                                    break
+                                                else:
+                                                    print("\n")
+                                    if abort:
+                                        break
 
-                                grblbuffer.put(line)
+                                batch.append(line)
+                                tags.append(tag)
                             except KeyboardInterrupt:
                                 print(f"Stream {filePath} aborted!")
                                 abort = True
@@ -525,15 +704,17 @@ def grblhudloop(args):
                                 break
 
                         if abort:
-                            with Grblbuffer.bec:
-                                print("Issued softstop (purged command buffer)")
-                                # purge buffer
-                                grblbuffer.init_buffer()
+                            print("Issued softstop (purged command buffer)")
+                            # purge buffer
+                            grblbuffer.init_buffer()
                             # end grbl program (switch laser off)
                             grblbuffer.serial.write("M2\n".encode())
                         else:
+                            grblbuffer.put_many(batch, tags)
                             # give stream summary
                             print('\r' + Input.ERASE_TO_EOL + "Stream send:", i, "lines, - wait for device to complete!", flush = True)
+                            for stage in filters:
+                                print(stage.summary())
 
                     Grblbuffer.STATUS_PAUZE = False
 
@@ -541,9 +722,52 @@ def grblhudloop(args):
                 print("could not open file:", filePath)
             return False
 
+        if re.search("^estimate( +[FO][0-9]+(\.[0-9]*)?)*$", line):
+            # estimate run time: 'estimate [F<eed>] [O<verride %>]'
+            if not NUMPY:
+                print("estimate needs numpy to be installed (pip install grblhud[estimate] or pip install numpy), abort command!")
+                return False
+            if gcodeFile["name"] == '':
+                print("Currently no gcode file is loaded. Use command 'load <filename>' to load a gcode file.")
+                return False
+
+            feed = re.search(" F[0-9]+(\.[0-9]*)?", line)
+            override = re.search(" O[0-9]+(\.[0-9]*)?", line)
+            feed = float(feed.group()[2:]) if feed else None
+            # feed override: the current override of the machine, unless given
+            override = float(override.group()[2:]) if override else grblbuffer.machinestatus.overrides[0]
+            if (feed is not None and feed <= 0) or override <= 0:
+                print("Feed and override must be > 0, abort command!")
+                return False
+
+            with Grblbuffer.serialio_lock:
+                # grbl kinematics: the planner is simulated over all moves (loops run)
+                estimate = Gcodeestimate(gcodeFile["buffer"], gcodeFile["WHILE"], grblbuffer.machinesettings, feed,
+                                         override, grblbuffer.machinestatus.overrides[1])
+                print(f"Estimate for {gcodeFile['name']}{' F' + format(feed, 'g') if feed else ''}, feed override {override:g}%:")
+                print(estimate.report(grblbuffer.serial.baudrate))
+            return False
+
+        if re.search("^stats( +latency| +trace +[^<>:;,*|\"]+)?$", line):
+            # job statistics: 'stats [latency|trace <file>]'
+            with Grblbuffer.serialio_lock:
+                if not (grblbuffer.stats.active or grblbuffer.stats.ended is not None):
+                    print("No job run (or streamed) yet.")
+                elif line.find("latency") >= 0:
+                    print(grblbuffer.ledger.histogram_text())
+                elif line.find("trace") >= 0:
+                    tracePath = line[line.find("trace") + len("trace"):].strip()
+                    try:
+                        print(f"Exported the latency of {grblbuffer.ledger.export(tracePath)} blocks to {tracePath}")
+                    except OSError as e:
+                        print(f"Cannot write {tracePath}: {e}")
+                else:
+                    print(grblbuffer.job_summary())
+            return False
+
         if line.find("run") >= 0:
             # run file: 'run [LOOP] [F<eed>] [S<peed>]'
-            if grblbuffer.machinestatus["state"] != "Idle":
+            if grblbuffer.machinestatus.state != "Idle":
                 print("Machinestate must be 'Idle' to be able to run")
                 return False
 
@@ -551,21 +775,21 @@ def grblhudloop(args):
             feed = None
             speed = None
             # find Speed and/or Feed parameters
-            if re.search(" [FS][0-9]+",line):
+            if re.search(" [FS][0-9]",line):
 
-                feed = re.search(" F[0-9]+",line)
-                speed = re.search(" S[0-9]+",line)
+                feed = re.search(" F[0-9]+(\.[0-9]*)?",line)
+                speed = re.search(" S[0-9]+(\.[0-9]*)?",line)
 
                 if feed:
                     feed = feed.group()[1:]
                     FS_update = feed
                     # remove F<nr> from line
-                    line = re.sub(" F[0-9]+", "", line)
+                    line = re.sub(" F[0-9]+(\.[0-9]*)?", "", line)
                 if speed:
                     speed = speed.group()[1:]
                     FS_update = speed if FS_update == '' else FS_update + " " + speed
                     # remove S<nr> from line
-                    line = re.sub(" S[0-9]+", "", line)
+                    line = re.sub(" S[0-9]+(\.[0-9]*)?", "", line)
 
             if line.find(" LOOP ") >= 0:
                 # run loop
@@ -601,26 +825,19 @@ def grblhudloop(args):
                             grblbuffer.put("M4 " + FS_update)
                             print("<  >\t", "M4 " + FS_update)
 
-                        nbr_of_lines = 0
-                        # unroll loop(s);
-                        for loopcount in range(int(count)):
-                            grblbuffer.put("; " + loopname + " iterate nr: " + str(loopcount + 1))
-                            if nbr_of_lines < NO_OF_LINES_SHOWN:
-                                print("<  >\t", "; " + loopname + " iterate nr: " + str(loopcount + 1))
-                                nbr_of_lines += 1
-                            for li in range(gcodeFile["WHILE"][loopname]["pcstart"], gcodeFile["WHILE"][loopname]["pcend"] + 1):
-                                gcline = gcodeFile["buffer"][li]
-                                if feed:
-                                    # replace F<nr> in this line of code (if any)
-                                    gcline = re.sub("F[0-9]+", feed, gcline)
-                                if speed:
-                                    # replace S<nr> in this line of code (if any)
-                                    gcline = re.sub("S[0-9]+", speed, gcline)
-
-                                grblbuffer.put(gcline)
-                                if nbr_of_lines < NO_OF_LINES_SHOWN:
-                                    print("<" + str(li) + ">\t", gcline, end = '')
-                                    nbr_of_lines += 1
+                        # F and S are spliced in once per (F, S) setting (the result is cached)
+                        program = gcodeFile["buffer"].variant(feed, speed)
+                        # the loop is run by the run engine: blocks are produced as the buffer drains
+                        run_preview(Gcoderun(program, gcodeFile["WHILE"], loopname, count))
+                        # gcode (pre)processing (compaction drops F and S words that did not change)
+                        filters = create_filters(compact = args.compact)
+                        job = Gcoderun(program, gcodeFile["WHILE"], loopname, count)
+                        grblbuffer.start_job(job.length(), gcodeFile["name"])
+                        grblbuffer.put_source(filter_chain(grblbuffer.stats.counted(job), filters))
+
+                    if not watch_run(grblbuffer, "loop '" + loopname + "'"):
+                        print("Run loop", loopname, "-", count, "iterations of", gcodeFile["WHILE"][loopname]["pcend"] -
+                              gcodeFile["WHILE"][loopname]["pcstart"] + 1, "lines, - wait for device to complete!")
                 else:
                     print("Cannot find loop with label '" + loopname + "', abort run!")
                 return False
@@ -634,127 +851,20 @@ def grblhudloop(args):
                         # abort
                         return False
 
-                    getch_nowait = UnblockedGetch().getch_nowait
-                    nbr_of_lines = 0
-                    abort = False
-                    # unroll loop(s);
-                    # get while loop info
-                    for i, line in enumerate(gcodeFile["buffer"]):
-                        try:
-
-                            # put gcode block, substitute set 'speed' and 'feed'
-                            if feed:
-                                # replace F<nr> in this line of code (if any)
-                                line = re.sub("F[0-9]+", feed, line)
-
-                            if speed:
-                                # replace S<nr> in this line of code (if any)
-                                line = re.sub("S[0-9]+", speed, line)
-
-                            grblbuffer.put(line)
-                            if nbr_of_lines < NO_OF_LINES_SHOWN:
-                                print("<" + str(i) + ">\t", line, end = '')
-                                nbr_of_lines += 1
-                            if i == NO_OF_LINES_SHOWN:
-                                print("    ...\n    ...\n")
-                            # check keypress every 1000 lines (to be able abort)
-                            if i and i % 1000 == 0:
-                                    sleep(.02)
-                                    #print("\033[ARun", i, "lines ...")
-                                    print("\033[A" + '\r' + Input.ERASE_TO_EOL + "Run", i, "lines ...", flush = True)
-                                    if getch_nowait() != '':
-                                        sr = input(f"Abort run of {fileName} (yes/no)? ")
-                                        if sr.find("yes") >= 0:
-                                            print(f"run of file {fileName} aborted!")
-                                            with Grblbuffer.bec:
-                                                print("Issued softstop (purged command buffer)")
-                                                # purge buffer
-                                                grblbuffer.init_buffer()
-                                            # end grbl program (switch laser off)
-                                            grblbuffer.serial.write("M2\n".encode())
-                                            abort = True
-                                            break
-                                        else:
-                                            print("\n")
-
-                            #find DO's get information from label and repeat code
-                            if line.find("; DO") >= 0:
-                                # do format: '; DO <loopname>' example: '; DO Aloop123'
-                                do_loopname = re.search(" [a-z]+[0-9]*",line)
-                                if not do_loopname:
-                                    print("No 'DO' loopname given; abort run!")
-                                    abort = True
-                                    break
-                                do_loopname = do_loopname.group()[1:]
-                                # find corresponding 'WHILE' and get loop start and end address
-                                if do_loopname in gcodeFile["WHILE"]:
-                                    for loopcount in range(gcodeFile["WHILE"][do_loopname]["count"]):
-                                        grblbuffer.put("; " + do_loopname + " iterate nr: " + str(loopcount + 1))
-                                        print("[" + str(i) + "]\t", "; " + do_loopname + " iterate nr: " + str(loopcount + 1))
-                                        for li in range(gcodeFile["WHILE"][do_loopname]["pcstart"], gcodeFile["WHILE"][do_loopname]["pcend"] + 1):
-                                            gcline = gcodeFile["buffer"][li]
-
-                                            if feed:
-                                                # replace F<nr> in this line of code (if any)
-                                                gcline = re.sub("F[0-9]+", feed, gcline)
-
-                                            if speed:
-                                                # replace S<nr> in this line of code (if any)
-                                                gcline = re.sub("S[0-9]+", speed, gcline)
-
-                                            grblbuffer.put(gcline)
-                                            if nbr_of_lines < NO_OF_LINES_SHOWN:
-                                                print("<" + str(li) + ">\t", gcline, end = '')
-                                                nbr_of_lines += 1
-                                            if i == NO_OF_LINES_SHOWN:
-                                                print("    ...\n    ...\n")
-                                            # check keypress every 1000 lines (to be able abort)
-                                            if i and i % 1000 == 0:
-                                                    sleep(.02)
-                                                    #print("\033[ARun", i, "lines ...")
-                                                    print("\033[A" + '\r' + Input.ERASE_TO_EOL + "Run", i, "lines ...", flush = True)
-                                                    if getch_nowait() != '':
-                                                        sr = input(f"Abort run of {fileName} (yes/no)? ")
-                                                        if sr.find("yes") >= 0:
-                                                            print(f"run of file {fileNAme} aborted!")
-                                                            with Grblbuffer.bec:
-                                                                print("Issued softstop (purged command buffer)")
-                                                                # purge buffer
-                                                                grblbuffer.init_buffer()
-                                                            # end grbl program (switch laser off)
-                                                            grblbuffer.serial.write("M2\n".encode())
-                                                            abort = True
-                                                            break
-                                                        else:
-                                                            print("\n")
-                                else:
-                                    print("WHILE info isn't consistent: cannot find WHILE label '" + do_loopname + "', Abort run!")
-                                    break
-
-                        except KeyboardInterrupt:
-                            print(f"run of file {fileName} aborted!")
-                            with Grblbuffer.bec:
-                                print("Issued softstop (purged command buffer)")
-                                # purge buffer
-                                grblbuffer.init_buffer()
-                            # end grbl program (switch laser off)
-                            grblbuffer.serial.write("M2\n".encode())
-                            abort = True
-                            break
-                        except MemoryError:
-                            print(f"Out of memory! Run of file {fileName} aborted!")
-                            with Grblbuffer.bec:
-                                print("Issued softstop (purged command buffer)")
-                                # purge buffer
-                                grblbuffer.init_buffer()
-                            # end grbl program (switch laser off)
-                            grblbuffer.serial.write("M2\n".encode())
-                            abort = True
-                            break
-
-                    if not abort:
-                        # give run summary
-                        print("send:", len(gcodeFile["buffer"]), "lines, - wait for device to complete!")
+                    # F and S are spliced in once per (F, S) setting (the result is cached)
+                    program = gcodeFile["buffer"].variant(feed, speed)
+                    # the program is run by the run engine: blocks are produced (loops are run) as the buffer drains
+                    run_preview(Gcoderun(program, gcodeFile["WHILE"]))
+                    # gcode (pre)processing (compaction drops F and S words that did not change)
+                    filters = create_filters(compact = args.compact)
+                    job = Gcoderun(program, gcodeFile["WHILE"])
+                    grblbuffer.start_job(job.length(), gcodeFile["name"])
+                    grblbuffer.put_source(filter_chain(grblbuffer.stats.counted(job), filters))
+
+                if not watch_run(grblbuffer, fileName):
+                    # give run summary
+                    print("Run:", len(gcodeFile["buffer"]), "lines" + (" (and loops)" if gcodeFile["WHILE"] else "") +
+                          ", - wait for device to complete!")
                 return False
 
             print("Currently no gcode file is loaded. Use command 'load <filename>' to load a gcode file.")
@@ -787,21 +897,21 @@ def grblhudloop(args):
 
                 if sr.find("yes") >= 0:
                     getch_nowait = UnblockedGetch().getch_nowait
-                    for i, line in enumerate(gcodeFile["buffer"]):
-                        if i >= pcstart and i <= pcend:
-                            print("[" + str(i) + "]\t", line, end = '')
-                            # check keypress every 1000 lines (to be able abort)
-                            if i and i % 1000 == 0:
-                                    sleep(.02)
-                                    #print("\033[AListing", i, "lines ...")
-                                    print("\033[A" + '\r' + Input.ERASE_TO_EOL + "Listing", i, "lines ...", flush = True)
-                                    if getch_nowait() != '':
-                                        sr = input(f"Abort gcode list (of {gcodeFile['name']} (yes/no)?")
-                                        if sr.find("yes") >= 0:
-                                            print(f"Listing aborted!")
-                                            break
-                                        else:
-                                            print("\n")
+                    # only lines [pcstart, pcend] are read
+                    for i, line in enumerate(gcodeFile["buffer"].lines(pcstart, pcend + 1), pcstart):
+                        print("[" + str(i) + "]\t", line, end = '')
+                        # check keypress every 1000 lines (to be able abort)
+                        if i and i % 1000 == 0:
+                                sleep(.02)
+                                #print("\033[AListing", i, "lines ...")
+                                print("\033[A" + '\r' + Input.ERASE_TO_EOL + "Listing", i, "lines ...", flush = True)
+                                if getch_nowait() != '':
+                                    sr = input(f"Abort gcode list (of {gcodeFile['name']} (yes/no)?")
+                                    if sr.find("yes") >= 0:
+                                        print(f"Listing aborted!")
+                                        break
+                                    else:
+                                        print("\n")
 
                 Grblbuffer.STATUS_PAUZE = False
             return False
@@ -810,7 +920,7 @@ def grblhudloop(args):
             if (re.search("setLOOP +[a-z|A-Z]+[0-9]? +[0-9]+ +[0-9]+ +[0-9]+", line)
                 or re.search("setloop +[a-z|A-Z]+[0-9]? +[0-9]+ +[0-9]+ +[0-9]+", line)):
                 # setLOOP <loopname> <count> <pcstart> <pcend>
-                if grblbuffer.machinestatus["state"] != "Idle":
+                if grblbuffer.machinestatus.state != "Idle":
                     print("Machinestate must be 'Idle' to set a LOOP")
                     return False
                 if gcodeFile["name"] == '':
@@ -922,7 +1032,7 @@ def grblhudloop(args):
             return False
 
         # draw bounding box with low power laser setting
-        # gcodeFile = { "name" : "", "bBox" : "", "buffer" : [], "WHILE" : {} }
+        # gcodeFile = { "name" : "", "bBox" : "", "buffer" : [], "WHILE" : {}, "extents" : None }
         if line.find("Bbox") >= 0 or line.find("bbox") >= 0:
 
             with Grblbuffer.serialio_lock:
@@ -984,7 +1094,8 @@ def grblhudloop(args):
                                 minX = re.search(f'X{fltPatt}',minXY.group()).group()[1:]
                                 minY = re.search(f',Y{fltPatt}',minXY.group()).group()[2:]
 
-                            maxXY = re.search(f':X{fltPatt},Y{fltPatt}\)', gcodeFile["bBox"])
+                            # format: (X0.0,Y0.0:X20.0,Y19.9) or (annotation) (X0.0,Y0.0) to (X20.0,Y19.9)
+                            maxXY = re.search(f'(:| to \()X{fltPatt},Y{fltPatt}\)', gcodeFile["bBox"])
                             if maxXY:
                                 maxX = re.search(f'X{fltPatt}',maxXY.group()).group()[1:]
                                 maxY = re.search(f',Y{fltPatt}',maxXY.group()).group()[2:]
@@ -1052,7 +1163,7 @@ def grblhudloop(args):
                 print("showgcode needs gcode2image to be installed (pip install gcode2image), abort command!")
                 return False
 
-            if grblbuffer.machinestatus["state"] != "Idle":
+            if grblbuffer.machinestatus.state != "Idle":
                 print("Machinestate must be 'Idle' to show gcode")
                 return False
             if gcodeFile["name"] == '':
@@ -1211,6 +1322,8 @@ def grblhudloop(args):
         print("  | 'grbl state'  'XYZ coordinates' 'Feed/Speed rates' '(grbl) commands you type'")
         print("  | ")
         print("'nbr of lines in buffer' (not the machine buffer!)")
+        print("While a job runs, its progress is shown after it: 99|42% 180blk/s 5.2kB/s ETA 3:12|[Run ...")
+        print("(percent done, blocks and bytes per second acknowledged by the machine, estimated time to completion)")
         print("\n**************************************************\n")
 
         while True:
@@ -1227,25 +1340,37 @@ def grblhudloop(args):
                 print("Wait for program exit ....")
                 Grblbuffer.GRBLHUD_EXIT = True
                 grblbuffer.grblstatus.join()
+                grblbuffer.grblreader.join()
                 # put something to get run loop out of waiting
                 grblbuffer.put(";")
                 grblbuffer.join()
                 break
 
     # buffered gcode file info ('load' and 'run' command)
-    gcodeFile = { "name" : "", "bBox" : "", "buffer" : [], "WHILE" : {} }
+    gcodeFile = { "name" : "", "bBox" : "", "buffer" : [], "WHILE" : {}, "extents" : None }
+
+    # loaded programs cache ('load' command)
+    gcodeCache = None
+    if args.cache_size:
+        try:
+            gcodeCache = Gcodecache(int(args.cache_size * (1 << 20)))
+        except OSError as e:
+            print(f"Cannot use the gcode cache ({e}), loads are not cached!")
 
     # init serial device
-    ser = machine_open(args.serial if SERIALDEVICE == '' else SERIALDEVICE)
+    ser = machine_open(args.serial if SERIALDEVICE == '' else SERIALDEVICE, args.baud)
 
     # init device
     machine_init(ser)
+    # device RX buffer size (character counting)
+    rx_buffer_size = machine_buffer(ser, args.rx_buffer_size)
 
     # create instance of Input class
     grblinput = lineinput.Input()
 
     # instantiate and run buffer thread (serial io to/from grbl device)
-    grblbuffer = Grblbuffer(ser, grblinput, False if args.gcode else True)
+    grblbuffer = Grblbuffer(ser, grblinput, False if args.gcode else True, args.high_water, args.low_water, args.poll_fast, args.poll_slow,
+                            rx_buffer_size)
     grblbuffer.start()
 
     if args.gcode:
@@ -1263,6 +1388,8 @@ def grblhudloop(args):
         print("  | 'grbl state'  'XYZ coordinates' 'Feed/Speed rates' '(grbl) commands you type'")
         print("  | ")
         print("'nbr of lines in buffer' (not the machine buffer!)")
+        print("While a job runs, its progress is shown after it: 99|42% 180blk/s 5.2kB/s ETA 3:12|[Run ...")
+        print("(percent done, blocks and bytes per second acknowledged by the machine, estimated time to completion)")
         print("\n**************************************************\n")
         # JCL
         try:
@@ -1281,8 +1408,8 @@ def grblhudloop(args):
 
                 sleep(.2)
                 # wait for device ready
-                while grblbuffer.buffer_not_empty() or (grblbuffer.machinestatus["state"] != "Idle"):
-                    if grblbuffer.machinestatus["state"] not in ["Idle", "Run"]:
+                while grblbuffer.buffer_not_empty() or (grblbuffer.machinestatus.state != "Idle"):
+                    if grblbuffer.machinestatus.state not in ["Idle", "Run"]:
                         # error state, exit
                         error_state = True
                         break
@@ -1293,15 +1420,15 @@ def grblhudloop(args):
             # exit
             hudloopbody('exit')
         except (KeyboardInterrupt, MemoryError):
-            with Grblbuffer.bec:
-                print("\nIssued softstop (purged command buffer)")
-                # purge buffer
-                grblbuffer.init_buffer()
+            print("\nIssued softstop (purged command buffer)")
+            # purge buffer
+            grblbuffer.init_buffer()
             # end grbl program (switch laser off)
             grblbuffer.serial.write("M2\n".encode())
             print("Wait for program exit ....")
             Grblbuffer.GRBLHUD_EXIT = True
             grblbuffer.grblstatus.join()
+            grblbuffer.grblreader.join()
             # put something to get run loop out of waiting
             grblbuffer.put(";")
             grblbuffer.join()
@@ -0,0 +1,140 @@
+"""
+grblledger: ledger of the blocks in flight (sent to the device, not acknowledged), block latency profile
+"""
+
+import csv
+from collections import deque
+from time import monotonic, perf_counter
+
+class Grblledger:
+    """
+    Grblledger: blocks in flight, oldest first
+
+    Grbl acknowledges blocks ('ok' or 'error:<code>') in the order it received them, so an acknowledgement
+    belongs to the oldest entry. An entry holds the block, its tag (source line, None for commands) and its
+    send time, the bytes in flight are a running sum: send, acknowledge and the byte count are O(1).
+    Acknowledged blocks are profiled: their latency (send to acknowledge) is counted in a histogram
+    (power of 2 buckets of microseconds) and added to a (bounded) trace that can be exported.
+    """
+
+    # acknowledged blocks kept in the trace
+    TRACE = 100000
+    # histogram buckets: bucket k counts latencies of [2^(k-1), 2^k) microseconds
+    BUCKETS = 32
+
+    def __init__(self):
+        # entries: (block, tag, send time)
+        self.entries = deque()
+        self.bytes = 0
+        self.profile()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self):
+        """
+        forget the blocks in flight (device reset, buffer purged)
+        """
+        self.entries.clear()
+        self.bytes = 0
+
+    def profile(self, name = ''):
+        """
+        start a new latency profile (of job 'name')
+        """
+        self.name = name
+        self.started = monotonic()
+        self.histogram = [0] * Grblledger.BUCKETS
+        self.trace = deque(maxlen = Grblledger.TRACE)
+
+    def sent(self, block, tag, now):
+        """
+        block (bytes) with tag (source line) is sent at 'now' (monotonic time)
+        """
+        self.entries.append((block, tag, now))
+        self.bytes += len(block)
+
+    def acknowledged(self, now, error = None):
+        """
+        the device acknowledged the oldest block in flight at 'now', error: error code ('error:<code>')
+        returns: its entry (block, tag, send time), None when nothing is in flight
+        """
+        if not self.entries:
+            return None
+        entry = self.entries.popleft()
+        block, tag, sent = entry
+        self.bytes -= len(block)
+        latency = now - sent
+        self.histogram[min(int(latency * 1e6).bit_length(), Grblledger.BUCKETS - 1)] += 1
+        self.trace.append((tag, sent, now, len(block), error))
+        return entry
+
+    def percentile(self, fraction):
+        """
+        latency (upper bound, seconds) of 'fraction' of the acknowledged blocks, None when there are none
+        """
+        count = sum(self.histogram)
+        if not count:
+            return None
+        total = 0
+        for bucket, n in enumerate(self.histogram):
+            total += n
+            if total >= fraction * count:
+                return (1 << bucket) / 1e6
+        return None
+
+    def summary(self) -> str:
+        """
+        latency percentiles
+        """
+        if not any(self.histogram):
+            return "    block latency: no blocks acknowledged"
+        return "    block latency (send to ack): " + ", ".join(f"{name} < {self.percentile(fraction) * 1000:g} ms"
+                                                          for name, fraction in (("50%", .5), ("90%", .9), ("99%", .99), ("max", 1)))
+
+    def histogram_text(self) -> str:
+        """
+        latency histogram (non empty buckets)
+        """
+        count = sum(self.histogram)
+        if not count:
+            return "no blocks acknowledged"
+        lines = [f"block latency (send to ack) of {count} blocks{' (' + self.name + ')' if self.name else ''}:"]
+        for bucket, n in enumerate(self.histogram):
+            if n:
+                lines.append(f"  < {(1 << bucket) / 1000:>10g} ms {n:>9} {100 * n / count:5.1f}% {'#' * round(50 * n / count)}")
+        return "\n".join(lines)
+
+    def export(self, path) -> int:
+        """
+        write the trace (csv): tag (source line), send and ack time (seconds since the start of the profile),
+        latency (ms), block size and error
+        returns: number of blocks written
+        """
+        with open(path, "w", newline = '') as f:
+            writer = csv.writer(f)
+            writer.writerow(("line", "sent", "acked", "latency_ms", "bytes", "error"))
+            for tag, sent, acked, length, error in self.trace:
+                writer.writerow(('' if tag is None else tag, f"{sent - self.started:.6f}", f"{acked - self.started:.6f}",
+                                 f"{(acked - sent) * 1000:.3f}", length, error or ''))
+        return len(self.trace)
+
+def main():
+    """
+    microbenchmark: send and acknowledge cost (per block)
+    """
+    ledger = Grblledger()
+    count = 1000000
+    block = b"G1 X1.000 Y1.000\n"
+    start = perf_counter()
+    for i in range(count):
+        now = monotonic()
+        ledger.sent(block, i, now)
+        if len(ledger) > 7:
+            ledger.acknowledged(now)
+    elapsed = perf_counter() - start
+    print(f"sent and acknowledged {count} blocks in {elapsed:.3f} seconds ({elapsed / count * 1e9:.0f} ns/block)")
+    print(ledger.summary())
+
+if __name__ == '__main__':
+    main()
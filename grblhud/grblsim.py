@@ -0,0 +1,767 @@
+"""
+grblsim: grbl v1.1 device simulator on a pseudo terminal (or a socket), to test and benchmark grblhud without a machine
+"""
+
+import os
+import re
+import sys
+import tty
+import select
+import signal
+import socket
+import argparse
+from collections import deque
+from math import sqrt
+from time import monotonic
+from grblhud import __version__
+from grblhud.gcodefilter import COMMENT_PATTERN, BITS_PER_BYTE, split_block
+from grblhud.gcodeestimate import Gcodesegments
+
+# grbl 1.1 default settings (but status report mask $10=3: machine position and buffer state)
+GRBL_SETTINGS = { 0 : "10", 1 : "25", 2 : "0", 3 : "0", 4 : "0", 5 : "0", 6 : "0", 10 : "3", 11 : "0.010", 12 : "0.002",
+                  13 : "0", 20 : "0", 21 : "0", 22 : "0", 23 : "0", 24 : "25.000", 25 : "500.000", 26 : "250", 27 : "1.000",
+                  30 : "1000", 31 : "0", 32 : "0", 100 : "250.000", 101 : "250.000", 102 : "250.000",
+                  110 : "500.000", 111 : "500.000", 112 : "500.000", 120 : "10.000", 121 : "10.000", 122 : "10.000",
+                  130 : "200.000", 131 : "200.000", 132 : "200.000" }
+
+# G and M codes grbl 1.1 supports (others are 'error:20')
+GRBL_G = { 0, 1, 2, 3, 4, 10, 17, 18, 19, 20, 21, 28, 28.1, 30, 30.1, 38.2, 38.3, 38.4, 38.5, 40, 43.1, 49,
+           53, 54, 55, 56, 57, 58, 59, 61, 80, 90, 91, 91.1, 92, 92.1, 93, 94 }
+GRBL_M = { 0, 1, 2, 3, 4, 5, 7, 8, 9, 30, 56 }
+GRBL_LETTERS = "FGIJKLMNPRSTXYZ"
+
+# realtime commands: picked from the incoming bytes before they reach the RX buffer
+REALTIME_PATTERN = re.compile(rb"[?!~\x18\x80-\xff]")
+# grbl line buffer size (stripped line, without comments and spaces)
+LINE_BUFFER_SIZE = 80
+# model time of a homing cycle (seconds)
+HOMING_TIME = 1.0
+
+class Grblsim:
+    """
+    Grblsim: grbl 1.1 device on (the master side of) a pseudo terminal, or on a socket (a network attached
+    controller: grblHAL, ESP32) that serves one connection at a time
+
+    Bytes written by the host travel over the link at 'baud' (8N1) and are put in the RX buffer of
+    'rx_buffer_size' bytes, bytes that do not fit are lost (as on the device: streaming must not overflow it).
+    Realtime commands ('?', '!', '~', ctrl-x and the override bytes) are picked from the incoming bytes.
+    Lines are taken from the RX buffer one at a time and executed: motion is split in planner blocks
+    (arcs in chords, as grbl does) that wait for room in the planner of 'planner_blocks' blocks, the line is
+    acknowledged ('ok' or 'error:<code>') when all its blocks are planned. Blocks execute in 'block_time'
+    seconds each, or (block_time 0) in their length at feed rate (no acceleration), feed and rapid overrides
+    included. Soft limits ($20) raise 'ALARM:2', a reset during motion 'ALARM:3'.
+    Responses reach the host 'latency' seconds after they are sent (USB serial adapters deliver in frames).
+    The clock runs 'speed' times faster than real time: block execution and the link alike.
+    """
+
+    VERSION = "1.1h"
+    BUILD = "20190830"
+
+    def __init__(self, rx_buffer_size = 128, planner_blocks = 15, block_time = .002, baud = 115200, speed = 1.0, latency = 0.0):
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_blocks = planner_blocks
+        self.block_time = block_time
+        # link: seconds per byte (0 is not limited)
+        self.byte_time = BITS_PER_BYTE / baud if baud else 0.0
+        self.speed = speed
+        self.latency = latency
+        # responses on their way to the host: (model time they arrive, bytes)
+        self.outgoing = deque()
+        self.settings = dict(GRBL_SETTINGS)
+        self.fd = None
+        # socket: listening socket and its connection (None on a pseudo terminal)
+        self.server = None
+        self.connection = None
+        self.stopped = False
+        self.epoch = monotonic()
+
+        # link: bytes on their way to the RX buffer, model time the next byte arrives
+        self.transit = bytearray()
+        self.link_time = 0.0
+        self.rx = bytearray()
+        # planner: (kind, end position (machine), duration (model seconds), feed (mm/min), rapid)
+        self.planner = deque()
+        # block being executed: start and end time, start position
+        self.block_start = 0.0
+        self.block_end = 0.0
+        self.block_from = (0.0, 0.0, 0.0)
+        self.held_at = None
+        # blocks of the current line that wait for room in the planner, the line waits for an empty planner (sync)
+        self.pending = deque()
+        self.sync = False
+        self.reset_counters()
+        self.reports = 0
+        # machine position (of the last block executed) and work coordinate offset
+        self.mpos = (0.0, 0.0, 0.0)
+        self.wco = [0.0, 0.0, 0.0]
+        self.reset_state(alarm = False)
+
+    def reset_counters(self):
+        """
+        start counting: bytes received, lines and blocks executed, errors, RX bytes lost (overflow)
+        and the time (model seconds) the planner ran empty between blocks (starved)
+        """
+        self.counters = { "bytes" : 0, "lines" : 0, "blocks" : 0, "errors" : 0, "overflow" : 0, "starved" : 0.0 }
+        self.last_finished = None
+
+    def reset_state(self, alarm):
+        """
+        power up (or soft reset) state
+        """
+        self.rx.clear()
+        self.planner.clear()
+        self.pending.clear()
+        self.sync = False
+        self.held_at = None
+        self.door = False
+        self.sleeping = False
+        self.check = False
+        # alarm: gcode is locked, locked: nothing executes until a reset (critical alarm)
+        self.alarm = alarm or self.setting(22) == 1
+        self.locked = False
+        self.overrides = [100, 100, 100]
+        self.spindle = 5
+        self.coolant = 9
+        self.speed_value = 0.0
+        # machine position at the end of the last planned block
+        self.planned = self.mpos
+        self.tracker = Gcodesegments(float(self.settings[12]))
+        self.tracker.position = [m - w for m, w in zip(self.mpos, self.wco)]
+
+    def setting(self, number) -> float:
+        return float(self.settings[number])
+
+    def clock(self) -> float:
+        """
+        model time (seconds)
+        """
+        return (monotonic() - self.epoch) * self.speed
+
+    def open(self, link = None) -> str:
+        """
+        open a pseudo terminal, link: (symbolic) link to its device name
+        returns: device name (of the slave side, the side the host opens)
+        """
+        self.fd, slave = os.openpty()
+        tty.setraw(slave)
+        # keep the slave side open, so the master side does not see hangups when the host closes it
+        self.slave = slave
+        name = os.ttyname(slave)
+        if link:
+            if os.path.islink(link):
+                os.remove(link)
+            os.symlink(name, link)
+        self.send(f"\r\nGrbl {Grblsim.VERSION} ['$' for help]\r\n")
+        return name
+
+    def listen(self, address) -> str:
+        """
+        listen on a socket, address: 'tcp://<host>:<port>' (port 0: any free port) or 'unix://<path>'
+        returns: address the host connects to
+        """
+        kind, _, location = address.partition("://")
+        if kind == "unix":
+            if os.path.exists(location):
+                os.remove(location)
+            self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.server.bind(location)
+        elif kind == "tcp":
+            host, _, port = location.rpartition(':')
+            self.server = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+            self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.server.bind((host.strip('[]'), int(port)))
+            address = f"tcp://{host}:{self.server.getsockname()[1]}"
+        else:
+            raise ValueError(f"{address}: address must be tcp://<host>:<port> or unix://<path>")
+        self.server.listen(1)
+        return address
+
+    def accept(self):
+        """
+        accept a connection (the device powers up: it sends its banner)
+        """
+        self.connection, _ = self.server.accept()
+        if self.connection.family != socket.AF_UNIX:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.fd = self.connection.fileno()
+        self.outgoing.clear()
+        self.send(f"\r\nGrbl {Grblsim.VERSION} ['$' for help]\r\n")
+
+    def disconnect(self):
+        """
+        the host closed the connection: wait for the next one
+        """
+        self.connection.close()
+        self.connection = None
+        self.fd = None
+
+    def close(self):
+        if self.server is not None:
+            if self.connection is not None:
+                self.disconnect()
+            if self.server.family == socket.AF_UNIX and os.path.exists(self.server.getsockname()):
+                os.remove(self.server.getsockname())
+            self.server.close()
+            self.server = None
+        elif self.fd is not None:
+            os.close(self.fd)
+            os.close(self.slave)
+            self.fd = None
+
+    def write(self, data):
+        """
+        write to the host (lost when no host is connected)
+        """
+        if self.connection is not None:
+            try:
+                self.connection.sendall(data)
+            except OSError:
+                self.disconnect()
+        elif self.fd is not None:
+            os.write(self.fd, data)
+
+    def send(self, text):
+        """
+        send response(s) to the host
+        """
+        data = text.encode() if isinstance(text, str) else text
+        if self.latency:
+            self.outgoing.append((self.clock() + self.latency, data))
+        else:
+            self.write(data)
+
+    def flush(self, now):
+        """
+        responses that arrive at the host at 'now'
+        """
+        data = b''
+        while self.outgoing and self.outgoing[0][0] <= now:
+            data += self.outgoing.popleft()[1]
+        if data:
+            self.write(data)
+
+    def stop(self):
+        self.stopped = True
+
+    def run(self):
+        """
+        simulate until stop()
+        """
+        while not self.stopped:
+            now = self.clock()
+            self.execute(now)
+            self.deliver(now)
+            self.process(now)
+            self.flush(self.clock())
+
+            # sleep until the next event: a block ends, a byte or a response arrives or the host writes
+            events = []
+            if self.outgoing:
+                events.append(self.outgoing[0][0])
+            if self.planner and self.held_at is None:
+                events.append(self.block_end)
+            if self.transit:
+                events.append(self.link_time + self.byte_time)
+            timeout = max(min(events) - self.clock(), 0) / self.speed if events else .5
+            if self.fd is None:
+                # socket: wait for a host to connect
+                readable, _, _ = select.select([self.server], [], [], timeout)
+                if readable:
+                    self.accept()
+                continue
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self.fd, 65536)
+                except OSError:
+                    data = None if self.connection is None else b''
+                if data is None:
+                    continue
+                if not data and self.connection is not None:
+                    self.disconnect()
+                    continue
+                if not self.transit:
+                    self.link_time = max(self.link_time, self.clock())
+                self.transit += data
+
+    def deliver(self, now):
+        """
+        bytes that arrived over the link (at 'now') go to the RX buffer, realtime commands are executed
+        """
+        if not self.transit:
+            return
+        count = len(self.transit) if not self.byte_time else min(int((now - self.link_time) / self.byte_time), len(self.transit))
+        if count <= 0:
+            return
+        data = bytes(self.transit[:count])
+        del self.transit[:count]
+        self.link_time += count * self.byte_time
+        self.counters["bytes"] += count
+
+        start = 0
+        for realtime in REALTIME_PATTERN.finditer(data):
+            self.receive(data[start:realtime.start()])
+            self.realtime(realtime.group()[0], now)
+            start = realtime.end()
+        self.receive(data[start:])
+
+    def receive(self, data):
+        """
+        put bytes in the RX buffer, lose those that do not fit
+        """
+        room = self.rx_buffer_size - 1 - len(self.rx)
+        if len(data) > room:
+            self.counters["overflow"] += len(data) - room
+            print(f"grblsim: RX buffer overflow, {len(data) - room} bytes lost", file = sys.stderr, flush = True)
+            data = data[:max(room, 0)]
+        self.rx += data
+
+    def realtime(self, command, now):
+        """
+        execute realtime command (byte)
+        """
+        if command == ord('?'):
+            self.send(self.status(now))
+        elif command == 0x18:
+            self.reset(now)
+        elif command == ord('!'):
+            self.hold(now)
+        elif command == ord('~'):
+            if self.door:
+                self.door = False
+            self.resume(now)
+        elif command == 0x84:
+            # safety door
+            self.door = True
+            self.hold(now)
+        elif command == 0x85:
+            # jog cancel
+            if self.planner and self.planner[0][0] == "jog":
+                self.mpos = self.position(now)
+                self.planner.clear()
+                self.pending.clear()
+                self.planned = self.mpos
+                self.tracker.position = [m - w for m, w in zip(self.mpos, self.wco)]
+        elif 0x90 <= command <= 0x9d:
+            self.override(command)
+        elif command == 0x9e:
+            self.spindle = 5 if self.spindle != 5 else 3
+        elif command in (0xa0, 0xa1):
+            self.coolant = 9 if self.coolant != 9 else (8 if command == 0xa0 else 7)
+
+    def override(self, command):
+        """
+        feed (0x90-0x94), rapid (0x95-0x97) and spindle (0x99-0x9d) override
+        """
+        if command <= 0x94:
+            feed = self.overrides[0]
+            self.overrides[0] = min(max({ 0x90 : 100, 0x91 : feed + 10, 0x92 : feed - 10, 0x93 : feed + 1, 0x94 : feed - 1 }[command], 10), 200)
+        elif command <= 0x97:
+            self.overrides[1] = { 0x95 : 100, 0x96 : 50, 0x97 : 25 }[command]
+        elif command >= 0x99:
+            speed = self.overrides[2]
+            self.overrides[2] = min(max({ 0x99 : 100, 0x9a : speed + 10, 0x9b : speed - 10, 0x9c : speed + 1, 0x9d : speed - 1 }[command], 10), 200)
+        # report the overrides in the next status report
+        self.reports = -1
+
+    def hold(self, now):
+        if self.held_at is None and not self.alarm and not self.sleeping:
+            self.held_at = now
+
+    def resume(self, now):
+        if self.held_at is not None and not self.door:
+            # the block being executed continues where it stopped
+            self.block_start += now - self.held_at
+            self.block_end += now - self.held_at
+            self.held_at = None
+
+    def reset(self, now):
+        """
+        soft reset (ctrl-x): stop, clear buffers, alarm when the machine was moving
+        """
+        moving = bool(self.planner) and self.held_at is None
+        self.mpos = self.position(now)
+        self.reset_state(self.alarm or moving)
+        if moving:
+            self.send("ALARM:3\r\n")
+        self.send(f"\r\nGrbl {Grblsim.VERSION} ['$' for help]\r\n")
+        if self.alarm:
+            self.send("[MSG:'$H'|'$X' to unlock]\r\n")
+
+    def position(self, now):
+        """
+        machine position at 'now' (interpolated within the block being executed)
+        """
+        if not self.planner:
+            return self.mpos
+        if self.held_at is not None:
+            now = self.held_at
+        end = self.planner[0][1]
+        duration = self.block_end - self.block_start
+        fraction = min(max((now - self.block_start) / duration, 0.0), 1.0) if duration > 0 else 1.0
+        return tuple(a + (b - a) * fraction for a, b in zip(self.block_from, end))
+
+    def state(self) -> str:
+        if self.sleeping:
+            return "Sleep"
+        if self.alarm:
+            return "Alarm"
+        if self.door:
+            return "Door:0"
+        if self.held_at is not None:
+            return "Hold:0"
+        if self.check:
+            return "Check"
+        if self.planner:
+            return { "run" : "Run", "dwell" : "Run", "jog" : "Jog", "home" : "Home" }[self.planner[0][0]]
+        return "Idle"
+
+    def status(self, now) -> str:
+        """
+        status report (fields as selected by $10)
+        """
+        mask = int(self.setting(10))
+        position = self.position(now)
+        if mask & 1:
+            fields = ["MPos:" + ",".join(f"{value:.3f}" for value in position)]
+        else:
+            fields = ["WPos:" + ",".join(f"{value - offset:.3f}" for value, offset in zip(position, self.wco))]
+        if mask & 2:
+            # as grbl: its RX ring buffer reports one byte less than its size
+            fields.append(f"Bf:{self.planner_blocks - len(self.planner)},{self.rx_buffer_size - 1 - len(self.rx)}")
+        feed = 0.0
+        if self.planner and self.held_at is None and self.planner[0][0] != "dwell":
+            _, _, _, feed, rapid = self.planner[0]
+            feed *= self.overrides[1 if rapid else 0] / 100
+        fields.append(f"FS:{feed:.0f},{self.speed_value * self.overrides[2] / 100 if self.spindle != 5 else 0:.0f}")
+        # work coordinate offset and overrides: every 10 reports (and after a change)
+        if self.reports % 10 == 0:
+            fields.append("WCO:" + ",".join(f"{value:.3f}" for value in self.wco))
+        elif self.reports % 10 == 1 or self.reports < 0:
+            fields.append("Ov:" + ",".join(map(str, self.overrides)))
+            accessories = ("S" if self.spindle == 3 else "C" if self.spindle == 4 else "") + \
+                          ("F" if self.coolant == 8 else "M" if self.coolant == 7 else "")
+            if accessories:
+                fields.append("A:" + accessories)
+        self.reports = max(self.reports, 0) + 1
+        return f"<{self.state()}|{'|'.join(fields)}>\r\n"
+
+    def execute(self, now):
+        """
+        finish the blocks that ended at 'now', start the next ones
+        """
+        while self.planner and self.held_at is None and now >= self.block_end:
+            kind, end, _, _, _ = self.planner.popleft()
+            self.mpos = end
+            self.counters["blocks"] += 1
+            self.last_finished = self.block_end
+            if self.planner:
+                self.start(self.block_end)
+
+    def start(self, now):
+        """
+        start executing the first block of the planner at 'now'
+        """
+        kind, end, duration, _, rapid = self.planner[0]
+        self.block_start = now
+        self.block_end = now + (duration * 100 / self.overrides[1 if rapid else 0] if kind != "dwell" else duration)
+        self.block_from = self.mpos
+
+    def plan(self, block, now):
+        """
+        add a block to the planner (that has room), start it when the machine is idle
+        """
+        self.planner.append(block)
+        if len(self.planner) == 1:
+            if self.last_finished is not None:
+                # the planner ran empty between blocks
+                self.counters["starved"] += max(now - self.last_finished, 0.0)
+            self.start(now)
+
+    def process(self, now):
+        """
+        execute the lines in the RX buffer (in order) while the planner has room
+        """
+        while not self.locked and not self.sleeping:
+            if self.pending or self.sync:
+                while self.pending and len(self.planner) < self.planner_blocks:
+                    block = self.pending[0]
+                    if block[0] in ("dwell", "home") and self.planner:
+                        # a dwell (or homing) waits for the moves before it
+                        return
+                    self.plan(self.pending.popleft(), now)
+                if self.pending or (self.sync and self.planner):
+                    return
+                self.sync = False
+                self.send("ok\r\n")
+                continue
+
+            end = min((i for i in (self.rx.find(b'\n'), self.rx.find(b'\r')) if i >= 0), default = -1)
+            if end < 0:
+                if len(self.rx) >= self.rx_buffer_size - 1:
+                    # a line longer than the RX buffer
+                    self.rx.clear()
+                    self.send("error:11\r\n")
+                return
+            line = self.rx[:end].decode("ascii", errors = "replace")
+            del self.rx[:end + 1]
+            self.counters["lines"] += 1
+            error = self.execute_line(line, now)
+            if self.locked:
+                # critical alarm: no response
+                return
+            if error:
+                self.counters["errors"] += 1
+                self.pending.clear()
+                self.sync = False
+                self.send(f"error:{error}\r\n")
+            elif not self.pending and not self.sync:
+                self.send("ok\r\n")
+
+    def execute_line(self, line, now):
+        """
+        execute a line (planner blocks go to 'pending')
+        returns: error code, None when ok
+        """
+        code = "".join(COMMENT_PATTERN.sub('', line).split()).upper()
+        if len(code) >= LINE_BUFFER_SIZE - 1:
+            return 11
+        if not code:
+            # empty line (sync)
+            return None
+        if code[0] == '$':
+            return self.system(code, now)
+        if self.alarm or (self.planner and self.planner[0][0] == "jog"):
+            return 9
+        return self.gcode(code)
+
+    def gcode(self, code, jog = False):
+        """
+        parse a gcode block, plan its moves
+        returns: error code, None when ok
+        """
+        words = split_block(code)
+        if words is None:
+            return 2 if re.search("[A-Z](?![-+.0-9])", code) else 1
+        codes = set()
+        for letter, value in words:
+            if letter not in GRBL_LETTERS or (letter == 'G' and value not in GRBL_G) or (letter == 'M' and value not in GRBL_M):
+                return 20
+            if letter in "GM":
+                codes.add((letter, value))
+            elif letter == 'S':
+                self.speed_value = value
+        axes = [letter for letter, _ in words if letter in "XYZ"]
+        motion = [value for letter, value in words if letter == 'G' and value in (0, 1, 2, 3)]
+        motion = motion[-1] if motion else self.tracker.motion
+        if axes and motion in (1, 2, 3) and self.tracker.feed is None and 'F' not in dict(words):
+            # feed rate not set
+            return 22
+        if jog and 'F' not in dict(words):
+            return 22
+        for letter, value in codes:
+            if letter == 'M' and value in (3, 4, 5):
+                self.spindle = int(value)
+            elif letter == 'M' and value in (7, 8, 9):
+                self.coolant = int(value)
+        if self.check:
+            return None
+
+        start = list(self.tracker.position)
+        if ('G', 92) in codes or ('G', 92.1) in codes or ('G', 10) in codes:
+            # coordinate offsets
+            values = dict(words)
+            for axis, letter in enumerate("XYZ"):
+                if ('G', 92.1) in codes:
+                    self.wco[axis] = 0.0
+                elif letter in values:
+                    scale = self.tracker.scale
+                    if ('G', 10) in codes and values.get('L') == 2:
+                        self.wco[axis] = values[letter] * scale
+                    else:
+                        self.wco[axis] = self.planned[axis] - values[letter] * scale
+            self.tracker.position = [m - w for m, w in zip(self.planned, self.wco)]
+            return None
+        if ('G', 4) in codes:
+            self.pending.append(("dwell", self.planned, dict(words).get('P', 0.0), 0.0, False))
+            self.sync = True
+            return None
+
+        self.tracker.segments = []
+        self.tracker.update(code)
+        position = self.tracker.position
+        if None in position:
+            # home (G28, G30): to the machine origin, machine coordinates (G53): to the given machine position
+            values = dict(words)
+            for axis, letter in enumerate("XYZ"):
+                if position[axis] is None:
+                    if ('G', 53) in codes and letter in values:
+                        position[axis] = values[letter] * self.tracker.scale - self.wco[axis]
+                    elif ('G', 28) in codes or ('G', 30) in codes:
+                        position[axis] = -self.wco[axis]
+                    else:
+                        position[axis] = start[axis]
+            if position != start:
+                self.tracker.segments.append((0, *position, 0.0, True))
+
+        previous = self.planned
+        for _, x, y, z, feed, rapid in self.tracker.segments:
+            end = (x + self.wco[0], y + self.wco[1], z + self.wco[2])
+            length = sqrt(sum((b - a) ** 2 for a, b in zip(previous, end)))
+            if length == 0:
+                continue
+            if self.setting(20) == 1 and any(not -self.setting(130 + axis) <= end[axis] <= 0 for axis in range(3)):
+                self.soft_limit()
+                return None
+            rate = min(self.setting(110 + axis) for axis in range(3) if end[axis] != previous[axis])
+            if not rapid:
+                rate = min(max(feed, 1.0), rate)
+            duration = self.block_time if self.block_time > 0 else 60 * length / rate
+            self.pending.append(("jog" if jog else "run", end, duration, rate, rapid))
+            previous = end
+        self.planned = previous
+        return None
+
+    def soft_limit(self):
+        """
+        target beyond the machine travel: critical alarm, motion is lost, a reset is needed
+        """
+        self.planner.clear()
+        self.pending.clear()
+        self.sync = False
+        self.alarm = True
+        self.locked = True
+        self.send("ALARM:2\r\n[MSG:Reset to continue]\r\n")
+
+    def system(self, code, now):
+        """
+        '$' (system) command
+        returns: error code, None when ok
+        """
+        command = code[1:]
+        if command == '':
+            self.send("[HLP:$$ $# $G $I $N $x=val $Nx=line $J=line $SLP $C $X $H ~ ! ? ctrl-x]\r\n")
+            return None
+        if command == 'G':
+            tracker = self.tracker
+            self.send(f"[GC:G{tracker.motion or 0} G54 G{tracker.plane} G{21 if tracker.scale == 1 else 20} "
+                      f"G{90 if tracker.absolute else 91} G94 M{self.spindle} M{self.coolant} T0 "
+                      f"F{(tracker.feed or 0) / tracker.scale:g} S{self.speed_value:g}]\r\n")
+            return None
+        if command.startswith("J="):
+            if self.alarm or (self.planner and self.planner[0][0] != "jog"):
+                return 8
+            return self.gcode(command[2:], jog = True)
+        if self.planner or self.held_at is not None:
+            return 8
+        if command == '$':
+            self.send("".join(f"${number}={value}\r\n" for number, value in self.settings.items()))
+        elif command == '#':
+            self.send("".join(f"[G{number}:0.000,0.000,0.000]\r\n" for number in (54, 55, 56, 57, 58, 59, 28, 30)) +
+                      "[G92:" + ",".join(f"{value:.3f}" for value in self.wco) + "]\r\n[TLO:0.000]\r\n[PRB:0.000,0.000,0.000:0]\r\n")
+        elif command == 'I':
+            # build info: options, planner blocks and RX buffer size
+            self.send(f"[VER:{Grblsim.VERSION}.{Grblsim.BUILD}:]\r\n[OPT:V,{self.planner_blocks},{self.rx_buffer_size}]\r\n")
+        elif command == 'N':
+            self.send("$N0=\r\n$N1=\r\n")
+        elif command == 'X':
+            if self.alarm:
+                self.alarm = False
+                self.send("[MSG:Caution: Unlocked]\r\n")
+        elif command == 'H':
+            if self.setting(22) != 1:
+                return 5
+            self.alarm = False
+            self.pending.append(("home", (0.0, 0.0, 0.0), HOMING_TIME, 0.0, False))
+            self.sync = True
+        elif command == 'C':
+            self.check = not self.check
+            if self.check:
+                self.send("[MSG:Enabled]\r\n")
+            else:
+                # leaving check mode resets grbl
+                self.send("[MSG:Disabled]\r\n")
+                self.reset(now)
+        elif command == "SLP":
+            self.sleeping = True
+            self.send("[MSG:Sleeping]\r\n")
+        elif command.startswith("RST="):
+            if command == "RST=$" or command == "RST=*":
+                self.settings = dict(GRBL_SETTINGS)
+            self.send("[MSG:Restoring defaults]\r\n")
+        elif self.alarm:
+            return 9 if not re.fullmatch(r"\d+=.*", command) else self.set(command)
+        else:
+            return self.set(command)
+        return None
+
+    def set(self, command):
+        """
+        '$<number>=<value>'
+        returns: error code, None when ok
+        """
+        setting = re.fullmatch(r"(\d+)=([-+]?(?:\d+\.?\d*|\.\d+))", command)
+        if not setting:
+            return 3
+        number, value = int(setting.group(1)), float(setting.group(2))
+        if number not in self.settings:
+            return 3
+        if value < 0:
+            return 4
+        self.settings[number] = f"{value:.3f}" if '.' in GRBL_SETTINGS[number] else str(int(value))
+        return None
+
+def main():
+    """
+    run a grbl simulator on a pseudo terminal (or a socket), until interrupted
+    """
+    parser = argparse.ArgumentParser(description = "grbl 1.1 device simulator on a pseudo terminal (or a socket), connect with: grblhud --serial <device>",
+                                     formatter_class = argparse.RawTextHelpFormatter)
+    parser.add_argument('--rx_buffer_size', type = int, default = 128, metavar = "<default:128>",
+                        help = 'RX (serial receive) buffer size (bytes)')
+    parser.add_argument('--planner_blocks', type = int, default = 15, metavar = "<default:15>",
+                        help = 'planner buffer size (blocks)')
+    parser.add_argument('--block_time', type = float, default = .002, metavar = "<default:0.002>",
+                        help = 'execution time of a block (seconds), 0: its length at feed rate (no acceleration)')
+    parser.add_argument('--baud', type = int, default = 115200, metavar = "<default:115200>",
+                        help = 'link speed (bits/s) of the bytes sent to the device, 0 is not limited')
+    parser.add_argument('--speed', type = float, default = 1.0, metavar = "<default:1.0>",
+                        help = 'run this many times faster than real time (block execution and link)')
+    parser.add_argument('--latency', type = float, default = 0, metavar = "<default:0>",
+                        help = 'time (seconds) responses take to reach the host (USB serial adapters: 1 to 16 ms)')
+    parser.add_argument('--link', metavar = "<path>",
+                        help = 'create a (symbolic) link to the device, so it has a fixed name')
+    parser.add_argument('--listen', metavar = "<address>",
+                        help = 'listen on a socket instead: tcp://<host>:<port> (a network attached controller, use --baud 0)\n'
+                               'or unix://<path>')
+    parser.add_argument('-V', '--version', action = 'version', version = '%(prog)s ' + __version__, help = "show version number and exit")
+    args = parser.parse_args()
+    if args.rx_buffer_size < 2 or args.planner_blocks < 1:
+        parser.error("rx_buffer_size must be at least 2 and planner_blocks at least 1")
+    if args.block_time < 0 or args.baud < 0 or args.latency < 0 or args.speed <= 0:
+        parser.error("block_time, baud and latency must not be negative, speed must be greater than 0")
+
+    if args.listen and args.link:
+        parser.error("link is a name of the pseudo terminal, it does not go with listen")
+
+    sim = Grblsim(args.rx_buffer_size, args.planner_blocks, args.block_time, args.baud, args.speed, args.latency)
+    try:
+        device = sim.listen(args.listen) if args.listen else sim.open(args.link)
+    except (OSError, ValueError) as e:
+        parser.error(f"cannot listen on {args.listen} ({e})")
+    signal.signal(signal.SIGTERM, lambda signum, frame: sim.stop())
+    print(f"grbl {Grblsim.VERSION} simulator on {args.link or device} (RX buffer {args.rx_buffer_size} bytes, "
+          f"{args.planner_blocks} planner blocks), connect with: grblhud --serial {args.link or device}", flush = True)
+    try:
+        sim.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.close()
+        if args.link and os.path.islink(args.link):
+            os.remove(args.link)
+        print("\n" + ", ".join(f"{name} {value:.1f}" if isinstance(value, float) else f"{name} {value}"
+                               for name, value in sim.counters.items()))
+
+if __name__ == '__main__':
+    main()
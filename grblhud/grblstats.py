@@ -0,0 +1,242 @@
+"""
+grblstats: progress, throughput, ETA and device buffer state of the job being sent to the device
+"""
+
+from math import exp
+from collections import deque
+from time import monotonic, perf_counter
+from grblhud.gcodeestimate import format_time
+from grblhud.machinestatus import parse_status
+
+class Grblstats:
+    """
+    Grblstats: job progress, throughput and device buffer state
+
+    A job (run or stream) is measured in units of its source: lines for a run (loop iterations included,
+    see Gcoderun.length()), characters for a stream. Units are counted as they are pulled from the source
+    (counted()), acknowledged blocks and bytes are counted by the reader (ack()). The blocks of a job are
+    tagged with their source line (filters pass the tags along with the lines).
+    Filters can merge or drop lines on their way to the device, so the units done are the units produced,
+    scaled by the part of the blocks produced that is acknowledged.
+    Rates are sampled on each status report (update()) and smoothed by an exponential moving average
+    (time constant TAU), the ETA follows from the smoothed rate of units done.
+
+    Status reports that have a 'Bf:' field (free planner blocks and RX bytes, grbl setting $10) are recorded
+    along with the bytes in flight (sent, not acknowledged). The planner starves when it runs empty while
+    the machine is in 'Run' and the job still has blocks to send: the machine waits on the host (or the
+    link). Starvation intervals are measured from report to report (the status poll interval).
+    """
+
+    # EMA time constant (seconds)
+    TAU = 5.0
+    # min time between samples (seconds)
+    SAMPLE_TIME = .05
+    # buffer state samples kept (at 10 status reports per second: an hour)
+    HISTORY = 36000
+
+    def __init__(self):
+        # planner size (free blocks of an 'Idle' machine), 0 when not known
+        self.planner_size = 0
+        # a status report had a 'Bf:' field
+        self.buffer_reports = False
+        self.active = False
+        self.start(0)
+        self.active = False
+
+    def start(self, total, name = ''):
+        """
+        start job 'name' of 'total' units
+        """
+        self.active = True
+        self.name = name
+        self.total = max(total, 1)
+        self.produced = 0
+        self.complete = False
+        self.acked = 0
+        self.bytes = 0
+        self.done = 0.0
+        self.started = monotonic()
+        self.ended = None
+        self.sampled = (self.started, 0, 0, 0.0)
+        self.block_rate = None
+        self.byte_rate = None
+        self.unit_rate = None
+
+        # buffer state samples: (time (since start), free planner blocks, free RX bytes, bytes in flight)
+        self.samples = deque(maxlen = Grblstats.HISTORY)
+        # 'Run' sample sums: (count, free planner blocks, free RX bytes, bytes in flight)
+        self.run_sums = [0, 0, 0, 0]
+        # starvation intervals: count, total and longest time (seconds), start time of the current interval
+        self.starved = 0
+        self.starved_time = 0.0
+        self.starved_longest = 0.0
+        self.starving = None
+
+    def stop(self):
+        """
+        job ended (or aborted)
+        """
+        if self.active:
+            self.active = False
+            self.ended = monotonic()
+            self.starvation_end(self.ended)
+
+    def counted(self, lines, measure = None):
+        """
+        count the units (lines, or measure(line)) pulled from 'lines', (source line, line) tuples (generator)
+        """
+        for position, line in lines:
+            self.produced += 1 if measure is None else measure(line)
+            yield position, line
+        self.complete = True
+
+    def ack(self, length):
+        """
+        the device acknowledged a block of 'length' bytes
+        """
+        if self.active:
+            self.acked += 1
+            self.bytes += length
+
+    def update(self, status, pending, in_flight) -> bool:
+        """
+        sample a status report: progress, rates and buffer state
+        status: MachineStatus
+        pending: blocks queued or in flight (not acknowledged yet)
+        in_flight: bytes in flight (sent, not acknowledged yet)
+        returns: True when the job is done (all units sent and acknowledged and the machine is 'Idle')
+        """
+        if status.planner_blocks is not None:
+            self.buffer_reports = True
+            if status.state == "Idle":
+                # all planner blocks are free
+                self.planner_size = status.planner_blocks
+        if not self.active:
+            return False
+
+        now = monotonic()
+        sent = self.complete and not pending
+        if sent and status.state == "Idle":
+            self.done = self.total
+            self.stop()
+            return True
+
+        if status.planner_blocks is not None:
+            self.buffer_state(now, status, in_flight, sent)
+
+        blocks = self.acked + pending
+        self.done = min(self.produced * self.acked / blocks if blocks else 0.0, self.total)
+
+        then, acked, acked_bytes, done = self.sampled
+        elapsed = now - then
+        if elapsed < Grblstats.SAMPLE_TIME:
+            return False
+        rates = ((self.acked - acked) / elapsed, (self.bytes - acked_bytes) / elapsed, (self.done - done) / elapsed)
+        if self.block_rate is None:
+            self.block_rate, self.byte_rate, self.unit_rate = rates
+        else:
+            # exponential moving average (of time varying sample intervals)
+            alpha = 1 - exp(-elapsed / Grblstats.TAU)
+            self.block_rate += alpha * (rates[0] - self.block_rate)
+            self.byte_rate += alpha * (rates[1] - self.byte_rate)
+            self.unit_rate += alpha * (rates[2] - self.unit_rate)
+        self.sampled = (now, self.acked, self.bytes, self.done)
+        return False
+
+    def buffer_state(self, now, status, in_flight, sent):
+        """
+        record the buffer state of a status report, track planner starvation
+        sent: all blocks of the job are sent (an empty planner is the end of the job)
+        """
+        self.samples.append((now - self.started, status.planner_blocks, status.rx_bytes, in_flight))
+        if status.state != "Run":
+            self.starvation_end(now)
+            return
+        self.run_sums[0] += 1
+        self.run_sums[1] += status.planner_blocks
+        self.run_sums[2] += status.rx_bytes
+        self.run_sums[3] += in_flight
+        if self.planner_size and status.planner_blocks >= self.planner_size and not sent:
+            if self.starving is None:
+                self.starving = now
+                self.starved += 1
+        else:
+            self.starvation_end(now)
+
+    def starvation_end(self, now):
+        """
+        end the current starvation interval (if any)
+        """
+        if self.starving is not None:
+            interval = now - self.starving
+            self.starved_time += interval
+            self.starved_longest = max(self.starved_longest, interval)
+            self.starving = None
+
+    def eta(self):
+        """
+        estimated time to completion (seconds), None when nothing is done yet
+        """
+        if not self.unit_rate or self.unit_rate <= 0:
+            return None
+        return (self.total - self.done) / self.unit_rate
+
+    def format(self) -> str:
+        """
+        format progress for printing: '<percent> <blocks/s> <bytes/s> ETA <time>'
+        """
+        eta = self.eta()
+        return (
+                    f"{100 * self.done / self.total:.0f}% "
+                    f"{self.block_rate or 0:.0f}blk/s "
+                    f"{(self.byte_rate or 0) / 1000:.1f}kB/s "
+                    f"ETA {format_time(eta) if eta is not None else '--:--'}"
+        )
+
+    def summary(self) -> str:
+        """
+        job statistics: throughput and buffer state
+        """
+        elapsed = max((self.ended or monotonic()) - self.started, 1e-9)
+        state = "running" if self.active else ("done" if self.done >= self.total else "stopped")
+        lines = [f"Job {state}: {self.acked} blocks, {self.bytes} bytes in {format_time(elapsed)} "
+                 f"({self.acked / elapsed:.0f} blocks/s, {self.bytes / elapsed / 1000:.1f} kB/s, {100 * self.done / self.total:.0f}%)"]
+        count = self.run_sums[0]
+        if not self.samples and not self.buffer_reports:
+            lines.append("    no buffer state: status reports have no 'Bf:' field (add 2 to grbl setting $10)")
+        elif not self.samples:
+            lines.append("    no buffer state: no status report was sampled during the job")
+        elif count:
+            lines.append(f"    buffers in Run (avg of {count} reports): planner {self.run_sums[1] / count:.1f} of "
+                         f"{self.planner_size or '?'} blocks free, RX {self.run_sums[2] / count:.0f} bytes free, "
+                         f"{self.run_sums[3] / count:.0f} bytes in flight")
+            starving = (monotonic() - self.starving) if self.starving is not None else 0.0
+            lines.append(f"    planner starved {self.starved} times, {self.starved_time + starving:.1f} s "
+                         f"({100 * (self.starved_time + starving) / elapsed:.1f}% of the job, longest "
+                         f"{max(self.starved_longest, starving):.1f} s)" +
+                         (": the machine waits on the host or the link" if self.starved else ""))
+        return "\n".join(lines)
+
+def main():
+    """
+    microbenchmark: cost of counting units and blocks (per block)
+    """
+    stats = Grblstats()
+    stats.update(parse_status("<Idle|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0>"), 0, 0)
+    reports = [parse_status("<Run|MPos:0.000,0.000,0.000|Bf:2,40|FS:1000,0>"),
+               parse_status("<Run|MPos:0.000,0.000,0.000|Bf:15,128|FS:1000,0>")]
+    count = 1000000
+    stats.start(count)
+    start = perf_counter()
+    for i, (tag, line) in enumerate(stats.counted((i, "G1 X1 Y1\n") for i in range(count))):
+        stats.ack(len(line))
+        if i % 10000 == 0:
+            # a status report (every tenth one starved)
+            stats.update(reports[i % 100000 == 0], 1, 88)
+    elapsed = perf_counter() - start
+    print(f"counted {count} blocks in {elapsed:.3f} seconds ({elapsed / count * 1e9:.0f} ns/block): {stats.format()}")
+    stats.update(parse_status("<Idle|MPos:0.000,0.000,0.000|Bf:15,128|FS:0,0>"), 0, 0)
+    print(stats.summary())
+
+if __name__ == '__main__':
+    main()
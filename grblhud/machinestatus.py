@@ -0,0 +1,216 @@
+"""
+machinestatus: grbl v1.1 realtime status report parser
+"""
+
+import re
+from operator import add, sub
+from time import perf_counter
+
+# Note that 'Real-time Status Reports' are specified here:
+# 'https://github.com/gnea/grbl/wiki/Grbl-v1.1-Interface'
+
+class MachineStatus:
+    """
+    MachineStatus: grbl machine status record (one parsed status report)
+
+    Positions are (X, Y, Z) tuples. X, Y and Z are the work position (WPos)
+    coordinates as shown by the hud.
+    Fields that are not part of every report (WCO, Ov, A) are retained from the
+    previous report.
+    """
+    __slots__ = ( "state", "substate", "mpos", "wpos", "wco", "X", "Y", "Z", "feed", "speed",
+                  "planner_blocks", "rx_bytes", "line_number", "overrides", "pins", "accessories" )
+
+    def __init__(self, state = ""):
+        self.state = state                  # Idle, Run, Hold, Jog, Alarm, Door, Check, Home, Sleep
+        self.substate = None                # Hold:<n>, Door:<n>
+        self.mpos = (0.0, 0.0, 0.0)         # machine position
+        self.wpos = (0.0, 0.0, 0.0)         # work position
+        self.wco = (0.0, 0.0, 0.0)          # work coordinate offset (WPos = MPos - WCO)
+        self.X = 0.0
+        self.Y = 0.0
+        self.Z = 0.0
+        self.feed = 0.0                     # FS: or F: (current feed)
+        self.speed = 0.0                    # FS: (current spindle speed)
+        self.planner_blocks = None          # Bf: available planner blocks
+        self.rx_bytes = None                # Bf: available RX buffer bytes
+        self.line_number = None             # Ln: line number (when enabled)
+        self.overrides = (100, 100, 100)    # Ov: feed, rapids, spindle (percent)
+        self.pins = ""                      # Pn: input pins triggered
+        self.accessories = ""               # A: accessory state
+
+def parse_status(report: str, previous = None):
+    """
+    parse a grbl status report in one pass, for example:
+      <Idle|MPos:0.000,0.000,-10.000|FS:0,0>
+      <Run|MPos:-2.996,-2.996,0.000|Bf:15,126|FS:500,8000|Ov:100,100,100|A:S|WCO:0.000,0.000,0.000>
+    previous: MachineStatus of the previous report (to retain WCO, Ov and A)
+    returns: MachineStatus, or None when the report is not valid (broken off)
+    """
+    if not (report.startswith('<') and report.endswith('>')):
+        return None
+
+    fields = report[1:-1].split('|')
+
+    status = MachineStatus()
+    if previous is not None:
+        status.wco = previous.wco
+        status.overrides = previous.overrides
+        status.accessories = previous.accessories
+
+    state, _, substate = fields[0].partition(':')
+    status.state = state
+
+    mpos = None
+    wpos = None
+    overrides = False
+    accessories = False
+    try:
+        if substate:
+            status.substate = int(substate)
+        for field in fields[1:]:
+            # fields are ordered by frequency
+            name, _, value = field.partition(':')
+            if name == "MPos":
+                mpos = tuple(map(float, value.split(',')))
+            elif name == "FS":
+                feed, _, speed = value.partition(',')
+                status.feed = float(feed)
+                status.speed = float(speed)
+            elif name == "Bf":
+                blocks, _, rx_bytes = value.partition(',')
+                status.planner_blocks = int(blocks)
+                status.rx_bytes = int(rx_bytes)
+            elif name == "WPos":
+                wpos = tuple(map(float, value.split(',')))
+            elif name == "F":
+                status.feed = float(value)
+            elif name == "WCO":
+                status.wco = tuple(map(float, value.split(',')))
+            elif name == "Ov":
+                status.overrides = tuple(map(int, value.split(',')))
+                overrides = True
+            elif name == "Ln":
+                status.line_number = int(value)
+            elif name == "Pn":
+                status.pins = value
+            elif name == "A":
+                status.accessories = value
+                accessories = True
+    except ValueError:
+        # broken off (or garbled) report
+        return None
+
+    if overrides and not accessories:
+        # GRBL documentation: when 'Ov:' is reported and 'A:' is not, all accessories are off
+        status.accessories = ""
+
+    # GRBL documentation:
+    #    GUI Developers: Simply track and retain the last WCO: vector and use the below equation to compute the
+    #    other position vector for your position readouts. If Grbl's status reports show either WPos or MPos,
+    #    just follow the equations below. It's as easy as that!
+    #    * If MPos: is given, use WPos = MPos - WCO.
+    #    * If WPos: is given, use MPos = WPos + WCO.
+    wco = status.wco
+    if mpos is not None:
+        status.mpos = mpos
+        status.wpos = tuple(map(sub, mpos, wco))
+    elif wpos is not None:
+        status.wpos = wpos
+        status.mpos = tuple(map(add, wpos, wco))
+    elif previous is not None:
+        status.mpos = previous.mpos
+        status.wpos = previous.wpos
+
+    # always report WPos coordinates (of the axes reported, others keep their previous value)
+    axes = tuple(status.wpos[:3])
+    if len(axes) < 3:
+        axes += ((previous.X, previous.Y, previous.Z) if previous is not None else (0.0, 0.0, 0.0))[len(axes):]
+    status.X, status.Y, status.Z = axes
+
+    return status
+
+def regex_status(status, wco):
+    """
+    status report parser parse_status() replaced (grblbuffer update_machinestatus(): a search per field,
+    MPos, WPos, WCO and FS only), kept for the benchmark
+    wco: work coordinate offset { "X" : .., "Y" : .., "Z" : .. } (updated)
+    returns: { "state" : .., "X" : .., "Y" : .., "Z" : .., "Feed" : .., "Speed" : .. }
+    """
+    machinestatus = {"state" : "Error", "X" : -1.0, "Y" : -1.0, "Z" : -1.0, "Feed" : "-1", "Speed" : "-1"}
+    state = re.search("<[a-zA-Z]+",status)
+    if state:
+        machinestatus["state"] = state.group(0)[1:]
+    match = re.search("WCO:[+\-]?[0-9.,+\-]+[\|>]",status)
+    if match:
+        X = re.search("[+-]?[0-9.+\-]+", match.group(0))
+        if X:
+            wco["X"] = float(X.group(0))
+        Y = re.search(",[+-]?[0-9.+\-]+", match.group(0))
+        if Y:
+            wco["Y"] = float(Y.group(0)[1:])
+        Z = re.search(",[+-]?[0-9.+\-]+[\|>]", match.group(0))
+        if Z:
+            wco["Z"] = float(Z.group(0)[1:-1])
+    mpos = re.search("MPos:[+\-]?[0-9.,+\-]+[\|>]",status)
+    if mpos:
+        X = re.search("[+-]?[0-9.+\-]+", mpos.group(0))
+        if X:
+            machinestatus["X"] = float(X.group(0)) - wco["X"]
+        Y = re.search(",[+-]?[0-9.+\-]+", mpos.group(0))
+        if Y:
+            machinestatus["Y"] = float(Y.group(0)[1:]) - wco["Y"]
+        Z = re.search(",[+-]?[0-9.+\-]+[\|>]", mpos.group(0))
+        if Z:
+            machinestatus["Z"] = float(Z.group(0)[1:-1]) - wco["Z"]
+    else:
+        wpos = re.search("WPos:[+\-]?[0-9.,+\-]+[\|>]",status)
+        if wpos:
+            X = re.search("[+-]?[0-9.+\-]+", wpos.group(0))
+            if X:
+                machinestatus["X"] = float(X.group(0))
+            Y = re.search(",[+-]?[0-9.+\-]+", wpos.group(0))
+            if Y:
+                machinestatus["Y"] = float(Y.group(0)[1:])
+            Z = re.search(",[+-]?[0-9.+\-]+[\|>]", wpos.group(0))
+            if Z:
+                machinestatus["Z"] = float(Z.group(0)[1:-1])
+    fs = re.search("FS:[0-9,]+",status)
+    if fs:
+        F = re.search("[0-9]+", fs.group(0))
+        if F:
+            machinestatus["Feed"] = F.group(0)
+        S = re.search(",[0-9]+", fs.group(0))
+        if S:
+            machinestatus["Speed"] = S.group(0)[1:]
+    return machinestatus
+
+def main():
+    """
+    microbenchmark: status reports parsed per second, parse_status() against the regex parser it replaced
+    """
+    reports = [ "<Idle|MPos:0.000,0.000,-10.000|FS:0,0>",
+                "<Idle|MPos:-2.996,-2.996,0.000|Bf:15,126|FS:0,0|WCO:0.000,0.000,0.000>",
+                "<Run|MPos:59.268,19.031,0.000|Bf:2,0|FS:1050,850|Ov:100,100,100|A:S>",
+                "<Hold:0|WPos:0.050,51.049,0.000|Bf:15,128|FS:0,850|Pn:XZ>",
+                "<Jog|MPos:141.840,45.351,0.000|Bf:13,98|F:500|Ln:99999>" ]
+    count = 200000
+
+    wco = { "X" : 0.0, "Y" : 0.0, "Z" : 0.0 }
+    start = perf_counter()
+    for i in range(count):
+        regex_status(reports[i % len(reports)], wco)
+    elapsed = perf_counter() - start
+    print(f"regex parser (4 fields):  {count} status reports in {elapsed:.3f} seconds: {count / elapsed:.0f} reports/s "
+          f"({elapsed / count * 1e6:.2f} us/report)")
+
+    status = None
+    start = perf_counter()
+    for i in range(count):
+        status = parse_status(reports[i % len(reports)], status)
+    elapsed_new = perf_counter() - start
+    print(f"parse_status (all fields): {count} status reports in {elapsed_new:.3f} seconds: {count / elapsed_new:.0f} reports/s "
+          f"({elapsed_new / count * 1e6:.2f} us/report), {elapsed / elapsed_new:.1f}x")
+
+if __name__ == '__main__':
+    main()
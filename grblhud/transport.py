@@ -0,0 +1,234 @@
+"""
+transport: byte stream to the grbl device: serial port, raw TCP, telnet or unix socket
+"""
+
+import os
+import re
+import socket
+import select
+import stat
+from time import monotonic, perf_counter
+
+# telnet commands (RFC 854)
+IAC = 255
+DONT, DO, WONT, WILL = 254, 253, 252, 251
+SB, SE = 250, 240
+
+# device address: 'tcp://<host>:<port>', 'telnet://<host>[:<port>]', 'unix://<path>'
+ADDRESS_PATTERN = re.compile(r"(tcp|telnet|unix)://(.+)")
+
+class Transport:
+    """
+    Transport: socket connection to the device, with the part of the pyserial (Serial) interface grblhud uses
+
+    read() blocks (up to 'timeout' seconds) until the bytes asked for are received, in_waiting is the number
+    of bytes that can be read without blocking, write() sends all bytes. Received bytes are buffered:
+    in_waiting and read() take what the socket has in one recv().
+    """
+
+    # socket receive size
+    CHUNK = 1 << 16
+
+    def __init__(self, sock, name, timeout = .5):
+        self.sock = sock
+        self.name = name
+        self.timeout = timeout
+        # link speed (bits/s) of the serial port, 0: not limited
+        self.baudrate = 0
+        self.received = bytearray()
+
+    def __repr__(self):
+        return self.name
+
+    def fill(self, timeout) -> bool:
+        """
+        receive what the socket has (wait up to 'timeout' seconds for it)
+        returns: False when nothing was received
+        """
+        readable, _, _ = select.select([self.sock], [], [], timeout)
+        if not readable:
+            return False
+        data = self.sock.recv(Transport.CHUNK)
+        if not data:
+            raise ConnectionError(f"{self.name}: connection closed by the device")
+        self.received += self.decode(data)
+        return True
+
+    def decode(self, data):
+        """
+        received bytes to device bytes (telnet removes its commands)
+        """
+        return data
+
+    @property
+    def in_waiting(self) -> int:
+        while self.fill(0):
+            pass
+        return len(self.received)
+
+    def read(self, size = 1) -> bytes:
+        deadline = monotonic() + self.timeout
+        while len(self.received) < size:
+            remaining = deadline - monotonic()
+            if remaining <= 0 or not self.fill(remaining):
+                break
+        data = bytes(self.received[:size])
+        del self.received[:size]
+        return data
+
+    def read_until(self, expected = b'\n', size = None) -> bytes:
+        deadline = monotonic() + self.timeout
+        start = 0
+        while True:
+            end = self.received.find(expected, start)
+            if end >= 0:
+                end += len(expected)
+                break
+            start = max(len(self.received) - len(expected) + 1, 0)
+            remaining = deadline - monotonic()
+            if (size is not None and len(self.received) >= size) or remaining <= 0 or not self.fill(remaining):
+                end = len(self.received)
+                break
+        if size is not None:
+            end = min(end, size)
+        data = bytes(self.received[:end])
+        del self.received[:end]
+        return data
+
+    def write(self, data) -> int:
+        self.sock.sendall(data)
+        return len(data)
+
+    def flush(self):
+        # nothing is pending: write() sends all bytes
+        pass
+
+    def reset_input_buffer(self):
+        self.in_waiting
+        self.received.clear()
+
+    def reset_output_buffer(self):
+        # nothing is pending: write() sends all bytes
+        pass
+
+    def close(self):
+        self.sock.close()
+
+class Telnettransport(Transport):
+    """
+    Telnettransport: telnet connection, telnet commands are removed from the received bytes and
+    option requests are refused (the device bytes are passed as they are)
+    """
+
+    def __init__(self, sock, name, timeout = .5):
+        super().__init__(sock, name, timeout)
+        # the start of a telnet command received so far
+        self.pending = b''
+        self.subnegotiation = False
+
+    def decode(self, data):
+        data = self.pending + data
+        self.pending = b''
+        out = bytearray()
+        i = 0
+        while i < len(data):
+            byte = data[i]
+            if self.subnegotiation:
+                # skip until 'IAC SE'
+                if byte == IAC and i + 1 < len(data) and data[i + 1] == SE:
+                    self.subnegotiation = False
+                    i += 2
+                elif byte == IAC and i + 1 == len(data):
+                    self.pending = data[i:]
+                    break
+                else:
+                    i += 1
+                continue
+            if byte != IAC:
+                end = data.find(IAC, i)
+                end = len(data) if end < 0 else end
+                out += data[i:end]
+                i = end
+                continue
+            if i + 1 == len(data):
+                self.pending = data[i:]
+                break
+            command = data[i + 1]
+            if command == IAC:
+                # escaped 255
+                out.append(IAC)
+                i += 2
+            elif command in (DO, DONT, WILL, WONT):
+                if i + 2 == len(data):
+                    self.pending = data[i:]
+                    break
+                if command in (DO, WILL):
+                    # refuse the option
+                    self.sock.sendall(bytes((IAC, WONT if command == DO else DONT, data[i + 2])))
+                i += 3
+            elif command == SB:
+                self.subnegotiation = True
+                i += 2
+            else:
+                i += 2
+        return out
+
+    def write(self, data) -> int:
+        self.sock.sendall(bytes(data).replace(b'\xff', b'\xff\xff'))
+        return len(data)
+
+def open_transport(device, baud = 115200, timeout = .5):
+    """
+    open the connection to the device
+    device: 'tcp://<host>:<port>', 'telnet://<host>[:<port>]', 'unix://<path>' (or the path of a unix socket),
+    or a serial port (opened at 'baud')
+    returns: transport (pyserial Serial for a serial port)
+    raises: OSError (serial.SerialException is one) when it cannot be opened
+    """
+    address = ADDRESS_PATTERN.fullmatch(device)
+    if address is None and os.path.exists(device) and stat.S_ISSOCK(os.stat(device).st_mode):
+        address = ADDRESS_PATTERN.fullmatch("unix://" + device)
+    if address is None:
+        # needs pyserial!
+        import serial
+        return serial.Serial(port = device, baudrate = baud, timeout = timeout)
+
+    kind, location = address.groups()
+    if kind == "unix":
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(5)
+        sock.connect(location)
+    else:
+        host, _, port = location.rpartition(':')
+        if kind == "telnet" and (not host or not port.isdigit()):
+            # default telnet port
+            host, port = location, "23"
+        if not host or not port.isdigit():
+            raise OSError(f"{device}: address must be {kind}://<host>:<port>")
+        sock = socket.create_connection((host.strip('[]'), int(port)), timeout = 5)
+        # realtime commands ('?', '!', etc.) and blocks are sent right away
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.settimeout(None)
+    return (Telnettransport if kind == "telnet" else Transport)(sock, device, timeout)
+
+def main():
+    """
+    microbenchmark: read and write cost of a transport (over a local socket pair)
+    """
+    host, device = socket.socketpair()
+    transport = Transport(host, "socketpair")
+    count = 100000
+    block = b"G1 X1.000 Y1.000\n"
+    start = perf_counter()
+    for i in range(count):
+        transport.write(block)
+        device.recv(Transport.CHUNK)
+        device.sendall(b"ok\r\n")
+        transport.read_until()
+    elapsed = perf_counter() - start
+    print(f"{count} blocks written and acknowledged in {elapsed:.3f} seconds ({elapsed / count * 1e6:.1f} us/block)")
+    transport.close()
+    device.close()
+
+if __name__ == '__main__':
+    main()
@@ -12,8 +12,11 @@ class UnblockedGetch:
     """
     UnblockedGetch: unbuffered, unblocked, raw (uncooked) character input
     """
-    # set at program start
-    prevStdinAttributes = termios.tcgetattr(sys.stdin)
+    # set at program start (None when stdin is not a terminal, so the module can be imported without one)
+    try:
+        prevStdinAttributes = termios.tcgetattr(sys.stdin)
+    except (termios.error, ValueError):
+        prevStdinAttributes = None
 
     def __init__(self):
         pass
@@ -0,0 +1,70 @@
+"""
+gcode (pre)processing stages (gcodefilter)
+"""
+
+import random
+from math import cos, pi, sin
+
+from grblhud.gcodefilter import Gcodecompact, arc_radius_error, create_filters, filter_chain, split_block, MOTION
+
+def replay_arcs(lines) -> int:
+    """
+    replay (compacted) lines: number of arcs that fail the grbl arc check (error:33)
+    """
+    errors = 0
+    x, y, motion = 0.0, 0.0, None
+    for line in lines:
+        words = dict(split_block(line.strip()))
+        motion = words.get('G', motion) if words.get('G') in MOTION else motion
+        ex, ey = words.get('X', x), words.get('Y', y)
+        if motion in (2, 3) and ('I' in words or 'J' in words):
+            errors += arc_radius_error((x, y), (ex, ey), (x + words.get('I', 0.0), y + words.get('J', 0.0)))
+        x, y = ex, ey
+    return errors
+
+def test_compact():
+    lines = ["G90 G21\n", "G1 X1.000 Y2.000 F1000 ; cut\n", "G1 X2.004 Y2.000 F1000\n", "(comment)\n", "M5\n"]
+    stage = Gcodecompact(.01)
+    assert [line for tag, line in stage.filter(enumerate(lines))] == ["G90G21\n", "G1X1Y2F1000\n", "X2\n", "M5\n"]
+    assert (stage.lines_in, stage.lines_out) == (5, 4)
+
+def test_compact_arc_round_trip():
+    rng = random.Random(1)
+    lines = ["G90 G21 G17\n", "G0 X0 Y0\n", "G1 F1000\n"]
+    x, y = 0.0, 0.0
+    for i in range(2000):
+        # small arcs with exact (4 decimal) offsets
+        radius = rng.uniform(.5, 3)
+        angle = rng.uniform(0, 2 * pi)
+        sweep = rng.uniform(.2, 3)
+        cx, cy = x - radius * cos(angle), y - radius * sin(angle)
+        ex, ey = cx + radius * cos(angle + sweep), cy + radius * sin(angle + sweep)
+        lines.append(f"G3 X{ex:.4f} Y{ey:.4f} I{cx - x:.4f} J{cy - y:.4f}\n")
+        x, y = float(f"{ex:.4f}"), float(f"{ey:.4f}")
+    assert replay_arcs(lines) == 0
+
+    # rounded end points: the arcs must still pass the check
+    compacted = [line for tag, line in Gcodecompact(.01).filter(enumerate(lines))]
+    assert len(compacted) == len(lines)
+    assert replay_arcs(compacted) == 0
+
+def test_tags():
+    # a circle (r 10) of chords, then two collinear moves
+    lines = (["G90 G21\n", "G0 X10 Y0\n", "M4 S100\n"] +
+             [f"G1 X{10 * cos(i * pi / 50):.4f} Y{10 * sin(i * pi / 50):.4f} F1000\n" for i in range(1, 60)] +
+             ["G1 X0 Y0\n", "G1 X1 Y0\n", "G1 X2 Y0\n", "M5\n"])
+    filters = create_filters(compact = .01, simplify = .01, arcs = .01)
+    processed = list(filter_chain(enumerate(lines), filters))
+    tags = [tag for tag, line in processed]
+    # blocks keep the tag of their (last) source line, in order
+    assert tags == sorted(tags)
+    assert tags[:3] == [0, 1, 2]
+    assert tags[-1] == len(lines) - 1
+    # the arc ends at the last chord it replaces, the merged collinear moves at the last move
+    arc = [tag for tag, line in processed if line.startswith("G3")]
+    assert arc == [61]
+    assert (64, "X2\n") in processed
+
+def test_unfiltered():
+    lines = ["G1 X1\n", "G1 X2\n"]
+    assert list(filter_chain(enumerate(lines), [])) == [(0, "G1 X1\n"), (1, "G1 X2\n")]
@@ -0,0 +1,105 @@
+"""
+two lane gcode queue (gcodequeue)
+"""
+
+import threading
+
+from grblhud.gcodequeue import Gcodequeue
+
+def test_lanes():
+    queue = Gcodequeue(threading.Condition())
+    queue.put("G1 X1")
+    queue.put_many(["G1 X2", "G1 X3"], [2, 3])
+    queue.put("?", prepend = True)
+    assert len(queue) == 4
+    assert [queue.get() for _ in range(4)] == [(None, "?"), (None, "G1 X1"), (2, "G1 X2"), (3, "G1 X3")]
+    assert not queue.ready()
+
+def test_get_fitting():
+    queue = Gcodequeue(threading.Condition())
+    queue.put_many([b"G1X1\n", b"G1X100\n"], [1, 2])
+    assert queue.get_fitting(4) is None
+    assert queue.get_fitting(5) == (1, b"G1X1\n")
+    assert queue.get_fitting(5) is None
+    assert len(queue) == 1
+
+def test_water_marks():
+    queue = Gcodequeue(threading.Condition(), high_water = 10, low_water = 4)
+    queue.put_many(["G1"] * 9)
+    assert queue.wait_for_room(0)
+    queue.put("G1")
+    # high water mark: no room until drained to the low water mark
+    assert not queue.wait_for_room(0)
+    for _ in range(5):
+        queue.get()
+    assert not queue.wait_for_room(0)
+    queue.get()
+    assert queue.wait_for_room(0)
+    queue.put_many(["G1"] * 5)
+    assert len(queue) == 9
+    assert queue.wait_for_room(0)
+
+def test_drain_wakes_producer():
+    queue = Gcodequeue(threading.Condition(), high_water = 10, low_water = 4)
+    queue.put_many(["G1"] * 10)
+    room = []
+    producer = threading.Thread(target = lambda: room.append(queue.wait_for_room(5)))
+    producer.start()
+    for _ in range(6):
+        queue.get()
+    producer.join(5)
+    assert room == [True]
+
+def test_clear_releases_producer():
+    queue = Gcodequeue(threading.Condition(), high_water = 10, low_water = 4)
+    queue.put_many(["G1"] * 10)
+    room = []
+    producer = threading.Thread(target = lambda: room.append(queue.wait_for_room(5)))
+    producer.start()
+    # softstop
+    queue.clear()
+    producer.join(5)
+    assert room == [True]
+    assert len(queue) == 0
+    assert not queue.ready()
+
+def test_source():
+    queue = Gcodequeue(threading.Condition())
+    count = 3 * Gcodequeue.SOURCE_CHUNK + 10
+    queue.set_source((i, f"G1 X{i}") for i in range(count))
+    queue.set_source((None, "M5") for _ in range(1))
+    assert queue.ready()
+    # lines are pulled a chunk at a time
+    assert len(queue) == 0
+    lines = [queue.get() for _ in range(count + 1)]
+    assert lines == [(i, f"G1 X{i}") for i in range(count)] + [(None, "M5")]
+    assert queue.get_fitting(100) is None
+    assert queue.source is None
+    assert not queue.ready()
+
+def test_clear_while_pulling():
+    queue = Gcodequeue(threading.Condition())
+    def source():
+        for i in range(Gcodequeue.SOURCE_CHUNK):
+            if i == 10:
+                # softstop while the chunk is pulled (outside the queue lock)
+                queue.clear()
+            yield i, "G1"
+    queue.set_source(source())
+    assert queue.get_fitting(100) is None
+    # the chunk pulled is dropped
+    assert len(queue) == 0
+    assert not queue.ready()
+
+def test_source_set_while_pulling():
+    queue = Gcodequeue(threading.Condition())
+    def source():
+        yield 0, "G1 X0"
+        # a job is added while this one runs out
+        queue.set_source([(1, "G1 X1")])
+    queue.set_source(source())
+    assert queue.get() == (0, "G1 X0")
+    assert queue.get() == (1, "G1 X1")
+    # the source is done when a pull finds it empty
+    assert queue.get_fitting(100) is None
+    assert not queue.ready()
@@ -0,0 +1,169 @@
+"""
+streamer, reader and buffer detection (grblbuffer), against a fake device
+"""
+
+import sys
+import threading
+from time import monotonic, sleep
+
+import pytest
+
+from grblhud.grblbuffer import Grblbuffer
+
+class Fakedevice:
+    """
+    Fakedevice: grbl with an RX buffer of 'rx_buffer_size' bytes, blocks are acknowledged ('ok') as the device
+    takes them from its buffer (one at a time, by a device thread), '?' is answered with an 'Idle' status report
+    """
+
+    def __init__(self, rx_buffer_size = 128, delay = 0.0):
+        self.rx_buffer_size = rx_buffer_size
+        self.delay = delay
+        self.condition = threading.Condition()
+        self.rx = bytearray()
+        self.responses = bytearray()
+        self.blocks = []
+        # max bytes in the RX buffer (must not exceed its size)
+        self.rx_max = 0
+        self.running = True
+        self.device = threading.Thread(target = self.run)
+        self.device.start()
+
+    @property
+    def in_waiting(self) -> int:
+        return len(self.responses)
+
+    def read(self, size = 1) -> bytes:
+        with self.condition:
+            self.condition.wait_for(lambda: self.responses, .05)
+            data = bytes(self.responses[:size])
+            del self.responses[:size]
+            return data
+
+    def write(self, data) -> int:
+        with self.condition:
+            for byte in data.replace(b'?', b''):
+                self.rx.append(byte)
+            self.rx_max = max(self.rx_max, len(self.rx))
+            if b'?' in data:
+                self.responses += b"<Idle|MPos:0.000,0.000,0.000|Bf:15,127|FS:0,0>\r\n"
+            self.condition.notify_all()
+        return len(data)
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                if not self.condition.wait_for(lambda: b'\n' in self.rx, .05):
+                    continue
+                end = self.rx.index(b'\n') + 1
+                self.blocks.append(bytes(self.rx[:end]))
+                del self.rx[:end]
+                self.responses += b"ok\r\n"
+                self.condition.notify_all()
+            if self.delay:
+                sleep(self.delay)
+
+    def close(self):
+        self.running = False
+        self.device.join()
+
+@pytest.fixture
+def device():
+    device = Fakedevice()
+    yield device
+    device.close()
+
+@pytest.fixture
+def grblbuffer(device):
+    Grblbuffer.GRBLHUD_EXIT = False
+    grblbuffer = Grblbuffer(device, None, False, rx_buffer_size = device.rx_buffer_size)
+    grblbuffer.start()
+    yield grblbuffer
+    Grblbuffer.GRBLHUD_EXIT = True
+    grblbuffer.put(";")
+    for thread in (grblbuffer, grblbuffer.grblstatus, grblbuffer.grblreader):
+        thread.join(5)
+        assert not thread.is_alive()
+
+def wait_for(predicate, timeout = 10) -> bool:
+    end = monotonic() + timeout
+    while not predicate():
+        if monotonic() > end:
+            return False
+        sleep(.01)
+    return True
+
+def test_stream(grblbuffer, device):
+    count = 2000
+    grblbuffer.start_job(count)
+    grblbuffer.put_source((i, f"G1 X{i} Y{i % 7}\n") for i in range(count))
+    assert wait_for(lambda: len(device.blocks) == count and not grblbuffer.ledger)
+    # in order, and the device RX buffer never overflowed
+    assert device.blocks == [f"G1 X{i} Y{i % 7}\n".encode() for i in range(count)]
+    assert device.rx_max <= device.rx_buffer_size
+    # every block acknowledged
+    assert grblbuffer.ledger.bytes == 0
+    assert grblbuffer.stats.acked == count
+    assert grblbuffer.gcode_count == count
+
+def test_error_tag(grblbuffer, device):
+    grblbuffer.put_many(["G1 X1", "G1 X2"], [7, 8])
+    assert wait_for(lambda: len(device.blocks) == 2 and not grblbuffer.ledger)
+    # an 'error' acknowledges the oldest block in flight as well
+    grblbuffer.ledger.sent(b"G1 X3\n", 9, monotonic())
+    grblbuffer.dispatch(b"error:22")
+    assert grblbuffer.last_acknowledged[:2] == (b"G1 X3\n", 9)
+    assert not grblbuffer.ledger
+
+def test_softstop_while_streaming(grblbuffer, device):
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        for _ in range(10):
+            grblbuffer.put_source((i, f"G1 X{i}\n") for i in range(20000))
+            sleep(.01)
+
+            # softstop from another thread, holding the locks the hud holds (lock order: serialio_lock, bec, ifc)
+            def softstop():
+                with Grblbuffer.serialio_lock, Grblbuffer.bec:
+                    grblbuffer.init_buffer()
+            stop = threading.Thread(target = softstop)
+            stop.start()
+            stop.join(5)
+            assert not stop.is_alive(), "softstop deadlocked with the streamer"
+            assert not grblbuffer.source_active()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    # the streamer still runs
+    sent = len(device.blocks)
+    grblbuffer.put("G1 X1")
+    assert wait_for(lambda: len(device.blocks) > sent)
+
+class Responses:
+    """
+    serial port that responds with 'lines' (one per read)
+    """
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+
+    def write(self, data):
+        return len(data)
+
+    def read_until(self):
+        return self.lines.pop(0) if self.lines else b''
+
+def test_detect_buffers():
+    assert Grblbuffer.detect_buffers(Responses([b"[VER:1.1h.20190830:]\r\n", b"[OPT:VNMSL,15,128]\r\n", b"ok\r\n"])) == \
+        (128, 15, "$I")
+    # a late 'ok' before the '$I' response
+    assert Grblbuffer.detect_buffers(Responses([b"ok\r\n", b"[VER:1.1h.20190830:]\r\n", b"[OPT:V,35,1024]\r\n", b"ok\r\n"])) == \
+        (1024, 35, "$I")
+    # the free RX bytes of an idle status report are one less than the buffer size
+    assert Grblbuffer.detect_buffers(Responses([b"[VER:1.1f.20170801:]\r\n", b"ok\r\n",
+                                                b"<Idle|MPos:0.000,0.000,0.000|Bf:15,127|FS:0,0>\r\n"])) == (128, 15, "status report")
+    # grbl 0.9: no buffer sizes
+    assert Grblbuffer.detect_buffers(Responses([b"[0.9j.20160316:]\r\n", b"ok\r\n",
+                                                b"<Idle,MPos:0.000,0.000,0.000,WPos:0.000,0.000,0.000>\r\n"])) == (None, None, None)
+    assert Grblbuffer.detect_buffers(Responses([])) == (None, None, None)
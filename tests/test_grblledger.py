@@ -0,0 +1,48 @@
+"""
+blocks in flight (grblledger)
+"""
+
+from grblhud.grblledger import Grblledger
+
+def test_ack_accounting():
+    ledger = Grblledger()
+    ledger.sent(b"G1X1\n", 1, 0.0)
+    ledger.sent(b"G1X22\n", 2, 0.0)
+    ledger.sent(b"M5\n", None, 0.0)
+    assert len(ledger) == 3
+    assert ledger.bytes == 5 + 6 + 3
+
+    # acknowledged oldest first
+    assert ledger.acknowledged(.001) == (b"G1X1\n", 1, 0.0)
+    assert ledger.bytes == 6 + 3
+    assert ledger.acknowledged(.002, "error:22") == (b"G1X22\n", 2, 0.0)
+    assert ledger.acknowledged(.003) == (b"M5\n", None, 0.0)
+    assert len(ledger) == 0
+    assert ledger.bytes == 0
+    assert [entry[4] for entry in ledger.trace] == [None, "error:22", None]
+
+def test_ack_nothing_in_flight():
+    ledger = Grblledger()
+    # pending acknowledgements (of blocks sent before a reset) are ignored
+    assert ledger.acknowledged(1.0) is None
+    assert ledger.bytes == 0
+    assert sum(ledger.histogram) == 0
+
+def test_clear():
+    ledger = Grblledger()
+    for i in range(10):
+        ledger.sent(b"G1X1\n", i, 0.0)
+    ledger.clear()
+    assert len(ledger) == 0
+    assert ledger.bytes == 0
+    assert ledger.acknowledged(1.0) is None
+
+def test_latency_profile():
+    ledger = Grblledger()
+    for latency in (.0005, .0005, .0005, .02):
+        ledger.sent(b"G1X1\n", None, 0.0)
+        ledger.acknowledged(latency)
+    assert sum(ledger.histogram) == 4
+    # power of 2 buckets of microseconds
+    assert ledger.percentile(.5) == 512 / 1e6
+    assert ledger.percentile(1) == 32768 / 1e6
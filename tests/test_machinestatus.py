@@ -0,0 +1,51 @@
+"""
+status report parser (machinestatus)
+"""
+
+from grblhud.machinestatus import parse_status
+
+def test_report_fields():
+    status = parse_status("<Run|MPos:-2.996,-2.996,1.000|Bf:15,126|FS:500,8000|Ov:110,100,90|A:S|WCO:1.000,2.000,0.000|Ln:42|Pn:XP>")
+    assert status.state == "Run"
+    assert status.substate is None
+    assert status.mpos == (-2.996, -2.996, 1.0)
+    assert status.wco == (1.0, 2.0, 0.0)
+    # WPos = MPos - WCO
+    assert status.wpos == (-3.996, -4.996, 1.0)
+    assert (status.X, status.Y, status.Z) == status.wpos
+    assert (status.feed, status.speed) == (500.0, 8000.0)
+    assert (status.planner_blocks, status.rx_bytes) == (15, 126)
+    assert status.overrides == (110, 100, 90)
+    assert status.accessories == "S"
+    assert status.line_number == 42
+    assert status.pins == "XP"
+
+def test_substate_and_wpos():
+    status = parse_status("<Hold:1|WPos:1.000,2.000,3.000|F:250>")
+    assert (status.state, status.substate) == ("Hold", 1)
+    assert status.wpos == (1.0, 2.0, 3.0)
+    assert status.feed == 250.0
+    assert status.planner_blocks is None
+
+def test_retained_fields():
+    previous = parse_status("<Idle|MPos:5.000,5.000,0.000|FS:0,0|Ov:120,100,100|A:M|WCO:1.000,1.000,0.000>")
+    status = parse_status("<Run|MPos:6.000,5.000,0.000|FS:100,0>", previous)
+    # WCO, Ov and A are not part of every report
+    assert status.wco == (1.0, 1.0, 0.0)
+    assert status.wpos == (5.0, 4.0, 0.0)
+    assert status.overrides == (120, 100, 100)
+    assert status.accessories == "M"
+    # Ov without A: all accessories are off
+    status = parse_status("<Run|MPos:6.000,5.000,0.000|FS:100,0|Ov:100,100,100>", status)
+    assert status.accessories == ""
+
+def test_fewer_axes():
+    previous = parse_status("<Idle|MPos:1.000,2.000,3.000|FS:0,0>")
+    status = parse_status("<Idle|MPos:4.000,5.000|FS:0,0>", previous)
+    assert (status.X, status.Y, status.Z) == (4.0, 5.0, 3.0)
+
+def test_broken_reports():
+    assert parse_status("<Idle|MPos:0.000,0.0") is None
+    assert parse_status("Pos:0.000,0.000,0.000|FS:0,0>") is None
+    assert parse_status("<Idle|MPos:0.000,x,0.000|FS:0,0>") is None
+    assert parse_status("<Hold:x|MPos:0.000,0.000,0.000>") is None